@@ -74,6 +74,10 @@ class Worker:
         """Perform work on x and return result."""
         raise NotImplementedError
 
+    def close(self) -> None:
+        """Finish up after the last piece of work (in the same process)."""
+        pass
+
 
 class IdReader(Reader):
     """Reader that returns its input."""
@@ -19,13 +19,16 @@ from collections import OrderedDict
 from typing import List, NamedTuple, Optional, Tuple
 
 import numpy as np
-from tqdm import tqdm
 
 from landshark import iteration
 from landshark.basetypes import CategoricalArraySource, CategoricalType, Worker
+from landshark.multiproc import task_list
 
 log = logging.getLogger(__name__)
 
+# Largest range of category values to map with a dense lookup table
+MAX_TABLE_RANGE = 1 << 16
+
 
 class CategoryInfo(NamedTuple):
     """
@@ -42,21 +45,62 @@ class CategoryInfo(NamedTuple):
     counts: List[np.ndarray]
 
 
-def _unique_values(x: np.ndarray) -> Tuple[List[np.ndarray], List[int]]:
-    """Provide the unique entries and their counts for each column x."""
+def _unique_values(x: np.ndarray,
+                   missing: Optional[int] = None
+                   ) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+    """Provide the unique entries and their counts for each column x.
+
+    Entries equal to missing are left out. Columns with a small range of
+    values are counted with np.bincount rather than sorted.
+    """
     x = x.reshape((-1), x.shape[-1])
-    unique_vals, counts = zip(*[np.unique(c, return_counts=True)
-                                for c in x.T])
+    unique_vals, counts = [], []
+    for c in x.T:
+        if missing is not None:
+            c = c[c != missing]
+        if c.size > 0 and int(c.max()) - int(c.min()) < MAX_TABLE_RANGE:
+            lo = c.min()
+            bins = np.bincount(c - lo)
+            nonzero = np.flatnonzero(bins)
+            unique_vals.append((nonzero + lo).astype(c.dtype))
+            counts.append(bins[nonzero])
+        else:
+            u, n = np.unique(c, return_counts=True)
+            unique_vals.append(u)
+            counts.append(n)
     return unique_vals, counts
 
 
+class _UniqueWorker(Worker):
+    """Find the unique values and their counts in each column of a block."""
+
+    def __init__(self, missing: Optional[int] = None) -> None:
+        self.missing = missing
+
+    def __call__(self, x: np.ndarray
+                 ) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        return _unique_values(x, self.missing)
+
+
 class _CategoryAccumulator:
-    """Class for accumulating categorical values and their counts."""
+    """Class for accumulating categorical values and their counts.
+
+    The values seen so far are kept sorted, with their counts, so that
+    each update is a vectorised merge.
+    """
 
     def __init__(self, missing_value: CategoricalType) -> None:
         """Initialise the object."""
-        self.counts: OrderedDict = OrderedDict()
         self.missing = missing_value
+        self.values = np.empty(0, dtype=CategoricalType)
+        self.value_counts = np.empty(0, dtype=np.int64)
+
+    @property
+    def counts(self) -> OrderedDict:
+        """Get the count of each value, in increasing order of value."""
+        counts = OrderedDict(zip(self.values.tolist(),
+                                 self.value_counts.tolist()))
+        return counts
 
     def update(self, values: np.ndarray, counts: np.ndarray) -> None:
         """Add a new set of values from a batch."""
@@ -65,17 +109,21 @@ class _CategoryAccumulator:
         assert values.shape == counts.shape
         assert counts.dtype == int
         assert np.all(counts >= 0)
-        for v, c in zip(values, counts):
-            if v in self.counts:
-                self.counts[v] += c
-            else:
-                self.counts[v] = c
         # Dont include the missing value
-        if self.missing in self.counts:
-            self.counts.pop(self.missing)
-
-
-def get_maps(src: CategoricalArraySource, batchrows: int) -> CategoryInfo:
+        if self.missing is not None:
+            keep = values != self.missing
+            values, counts = values[keep], counts[keep]
+        all_values = np.concatenate((self.values, values))
+        all_counts = np.concatenate((self.value_counts, counts))
+        self.values, inverse = np.unique(all_values, return_inverse=True)
+        self.value_counts = np.zeros(len(self.values), dtype=np.int64)
+        np.add.at(self.value_counts, inverse, all_counts)
+
+
+def get_maps(src: CategoricalArraySource,
+             batchrows: int,
+             n_workers: int = 0
+             ) -> CategoryInfo:
     """
     Extract the unique categorical variables and their counts.
 
@@ -90,6 +138,9 @@ def get_maps(src: CategoricalArraySource, batchrows: int) -> CategoryInfo:
     batchrows : int
         The number of rows to read from src in a single batch. Larger
         values are probably faster but will use more memory.
+    n_workers : int
+        The number of additional worker processes counting the values in
+        each batch.
 
     Returns
     -------
@@ -105,30 +156,63 @@ def get_maps(src: CategoricalArraySource, batchrows: int) -> CategoryInfo:
     if missing_value is not None and missing_value > 0:
         raise ValueError("Missing value must be negative")
 
-    with tqdm(total=n_rows) as pbar:
-        with src:
-            for s in iteration.batch_slices(batchrows, n_rows):
-                x = src(s)
-                unique, counts = _unique_values(x)
-                for a, u, c in zip(accums, unique, counts):
-                    a.update(u, c)
-                pbar.update(x.shape[0])
-
-    count_dicts = [m.counts for m in accums]
-    unsorted_mappings = [np.array(list(c.keys())) for c in count_dicts]
-    unsorted_counts = [np.array(list(c.values()), dtype=np.int64)
-                       for c in count_dicts]
-    sortings = [np.argsort(m, kind="mergesort") for m in unsorted_mappings]
-    mappings = [m[s] for m, s in zip(unsorted_mappings, sortings)]
-    counts = [c[s] for c, s in zip(unsorted_counts, sortings)]
+    slices = list(iteration.batch_slices(batchrows, n_rows))
+    out_it = task_list(slices, src, _UniqueWorker(missing_value),
+                       n_workers)
+    for unique, counts in out_it:
+        for a, u, c in zip(accums, unique, counts):
+            a.update(u, c)
+
+    mappings = [a.values for a in accums]
+    counts = [a.value_counts for a in accums]
     result = CategoryInfo(mappings=mappings, counts=counts)
     return result
 
 
+def compact_dtype(nvalues: np.ndarray) -> np.dtype:
+    """
+    Get the smallest type that can store a set of mapped categories.
+
+    The largest value of the type is reserved to mark missing data, so
+    this is the smallest unsigned type holding more than max(nvalues)
+    values, falling back to CategoricalType.
+
+    Arguments
+    ---------
+    nvalues : np.ndarray
+        The number of categories in each column.
+
+    Returns
+    -------
+    dtype : np.dtype
+        The storage type for all the columns.
+
+    """
+    nmax = np.amax(nvalues) if len(nvalues) > 0 else 0
+    for t in (np.uint8, np.uint16):
+        if nmax < np.iinfo(t).max:
+            return np.dtype(t)
+    return np.dtype(CategoricalType)
+
+
+def mapped_missing(missing_value: Optional[int],
+                   dtype: np.dtype
+                   ) -> Optional[int]:
+    """Get the missing value for mapped data stored as dtype."""
+    if missing_value is None or np.dtype(dtype) == CategoricalType:
+        return missing_value
+    new_missing = np.iinfo(dtype).max
+    return new_missing
+
+
 class CategoryMapper(Worker):
     """
     Worker class to perform a categorical data remapping.
 
+    Columns whose category values span a small range are mapped with a
+    dense lookup table, and the others by binary search of the sorted
+    mapping, so no sorting of the data is needed.
+
     Arguments
     ---------
     mappings : List[np.ndarray]
@@ -138,11 +222,16 @@ class CategoryMapper(Worker):
     missing_value : Optional[int]
         If this dataset has a missing value, then providing here will ensure
         that it gets mapped to 0 (helpful for doing extra-category imputing).
+
+    dtype : np.dtype
+        The type of the mapped output. Missing values are mapped to the
+        value given by `mapped_missing` for this type.
     """
 
     def __init__(self,
                  mappings: List[np.ndarray],
-                 missing_value: Optional[int]
+                 missing_value: Optional[int],
+                 dtype: np.dtype = CategoricalType
                  ) -> None:
         """Initialise the worker object."""
         for m in mappings:
@@ -150,6 +239,8 @@ class CategoryMapper(Worker):
             assert is_sorted
         self._mappings = mappings
         self._missing = missing_value
+        self._dtype = dtype
+        self._tables = [_lookup_table(m) for m in mappings]
 
     def __call__(self, x: np.ndarray) -> np.ndarray:
         """Map the data in x into the new categories.
@@ -165,19 +256,59 @@ class CategoryMapper(Worker):
         x_new : np.ndarray
             The version of x in which the remappings have been applied.
 
+        Raises
+        ------
+        ValueError
+            If x has a (non-missing) value that is not in the mappings.
+
         """
-        fill = self._missing if self._missing is not None else 0
-        x_new = np.empty_like(x)
-        for i, cats in enumerate(self._mappings):
-            x_i = x[..., i].ravel()
-            mask = x_i != self._missing if self._missing \
-                else np.ones_like(x_i, dtype=bool)
-            x_i_valid = x_i[mask].flatten()
-            flat = np.hstack((cats, x_i_valid))
-            actual_cat, remap = np.unique(flat, return_inverse=True)
-            x_i_new_valid = remap[len(cats):]
-            x_i_new = np.full_like(x_i, fill)
-            x_i_new[mask] = x_i_new_valid
-            x_new[..., i] = x_i_new.reshape(x[..., i].shape)
-            assert np.all(actual_cat == cats)
+        missing = mapped_missing(self._missing, self._dtype)
+        fill = missing if missing is not None else 0
+        x_new = np.empty(x.shape, dtype=self._dtype)
+        for i, (cats, table) in enumerate(zip(self._mappings, self._tables)):
+            x_i = x[..., i]
+            idx = _table_lookup(x_i, *table) if table \
+                else _search_lookup(x_i, cats)
+            unseen = idx < 0
+            if self._missing is not None:
+                valid = x_i != self._missing
+                unseen &= valid
+                idx[~valid] = fill
+            if np.any(unseen):
+                raise ValueError("Unknown categories {} in column {}".format(
+                    np.unique(x_i[unseen]), i))
+            x_new[..., i] = idx
         return x_new
+
+
+def _lookup_table(cats: np.ndarray) -> Optional[Tuple[int, np.ndarray]]:
+    """Build a dense table from offset category values to their indices.
+
+    Values not in cats map to -1. Returns None if cats span too large a
+    range for a table.
+    """
+    if len(cats) == 0 or cats[-1] - cats[0] >= MAX_TABLE_RANGE:
+        return None
+    offset = int(cats[0])
+    table = np.full(int(cats[-1]) - offset + 1, -1, dtype=np.int64)
+    table[cats - offset] = np.arange(len(cats))
+    return offset, table
+
+
+def _table_lookup(x: np.ndarray, offset: int, table: np.ndarray
+                  ) -> np.ndarray:
+    """Map x to category indices with a lookup table (-1 if unknown)."""
+    pos = x.astype(np.int64) - offset
+    outside = (pos < 0) | (pos >= len(table))
+    idx = table[np.clip(pos, 0, len(table) - 1)]
+    idx[outside] = -1
+    return idx
+
+
+def _search_lookup(x: np.ndarray, cats: np.ndarray) -> np.ndarray:
+    """Map x to category indices by binary search (-1 if unknown)."""
+    if len(cats) == 0:
+        return np.full(x.shape, -1, dtype=np.int64)
+    pos = np.minimum(np.searchsorted(cats, x), len(cats) - 1)
+    idx = np.where(cats[pos] == x, pos, -1)
+    return idx
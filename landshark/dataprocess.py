@@ -15,21 +15,23 @@
 # limitations under the License.
 
 import logging
-from itertools import count, groupby
-from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+import os.path
+from typing import List, NamedTuple, Optional, Tuple
 
 import numpy as np
 import tables
+from numpy.lib.stride_tricks import as_strided
 
 from landshark import patch, tfwrite
 from landshark.basetypes import ArraySource, FixedSlice, IdReader, Worker
-from landshark.hread import H5Features
-from landshark.image import (ImageSpec, image_to_world, indices_strip,
+from landshark.featurewrite import QUERY_VALID_FILE, create_valid_mask
+from landshark.hread import FeatureArray, H5Features
+from landshark.image import (ImageSpec, ImageWindow, band_indices,
+                             image_to_world, row_bands, strip_slices,
                              world_to_image)
 from landshark.iteration import batch_slices
 from landshark.kfold import KFolds
 from landshark.multiproc import task_list
-from landshark.patch import PatchMaskRowRW, PatchRowRW
 from landshark.serialise import DataArrays, serialise
 
 log = logging.getLogger(__name__)
@@ -46,6 +48,9 @@ class ProcessTrainingArgs(NamedTuple):
     directory: str
     batchsize: int
     nworkers: int
+    bands: Optional[List[str]] = None
+    cache_mb: float = 0.
+    resident: bool = False
 
 
 class ProcessQueryArgs(NamedTuple):
@@ -60,96 +65,120 @@ class ProcessQueryArgs(NamedTuple):
     batchsize: int
     nworkers: int
     tag: str
-
-
-def _direct_read(array: tables.CArray,
-                 patch_reads: List[PatchRowRW],
-                 mask_reads: List[PatchMaskRowRW],
-                 npatches: int,
-                 patchwidth: int
-                 ) -> np.ma.MaskedArray:
-    """Build patches from a data source given the read/write operations."""
-    assert npatches > 0
-    assert patchwidth > 0
-    nfeatures = array.atom.shape[0]
-    dtype = array.atom.dtype.base
-    patch_data = np.zeros((npatches, patchwidth, patchwidth, nfeatures),
-                          dtype=dtype)
-    patch_mask = np.zeros_like(patch_data, dtype=bool)
-
-    for r in patch_reads:
-        patch_data[r.idx, r.yp, r.xp] = array[r.y, r.x]
-
-    for m in mask_reads:
-        patch_mask[m.idx, m.yp, m.xp] = True
-
+    bands: Optional[List[str]] = None
+    cache_mb: float = 0.
+    resident: bool = False
+    window: Optional[ImageWindow] = None
+
+
+def _tile_groups(indices_x: np.ndarray,
+                 indices_y: np.ndarray,
+                 chunkshape: Tuple[int, int]
+                 ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sort points by the storage chunk (tile) holding them.
+
+    Returns the order of the points and the bounds of each tile's run of
+    points in that order. Tiles are ordered by row and then column, so
+    reading them in turn moves sequentially through the array.
+    """
+    tile_y = indices_y // chunkshape[0]
+    tile_x = indices_x // chunkshape[1]
+    order = np.lexsort((indices_x, indices_y, tile_x, tile_y))
+    new_tile = np.logical_or(np.diff(tile_y[order]) != 0,
+                             np.diff(tile_x[order]) != 0)
+    bounds = np.concatenate(([0], np.flatnonzero(new_tile) + 1,
+                             [order.shape[0]]))
+    return order, bounds
+
+
+def _masked_patches(array: FeatureArray,
+                    data: np.ndarray,
+                    outside: np.ndarray
+                    ) -> np.ma.MaskedArray:
+    """Mask patch pixels outside the image or missing in the array.
+
+    The fill value is the missing value of the array, as the default
+    (1e20) overflows compact dtypes such as float16.
+    """
+    mask = np.broadcast_to(outside[..., np.newaxis], data.shape)
     if array.missing is not None:
-        patch_mask |= patch_data == array.missing
-
-    marray = np.ma.MaskedArray(data=patch_data, mask=patch_mask)
+        mask = np.logical_or(mask, data == array.missing)
+    marray = np.ma.MaskedArray(data=data, mask=mask.copy(),
+                               fill_value=array.missing)
     return marray
 
 
-def _cached_read(row_dict: Dict[int, np.ndarray],
-                 array: tables.CArray,
-                 patch_reads: List[PatchRowRW],
-                 mask_reads: List[PatchMaskRowRW],
-                 npatches: int,
-                 patchwidth: int
-                 ) -> np.ma.MaskedArray:
-    """Build patches from a data source given the read/write operations."""
+def _windowed_read(array: FeatureArray,
+                   indices_x: np.ndarray,
+                   indices_y: np.ndarray,
+                   halfwidth: int,
+                   image_width: int,
+                   image_height: int
+                   ) -> np.ma.MaskedArray:
+    """
+    Build patches with one windowed read per chunk tile of the points.
+
+    The points are grouped by the storage chunk holding them. Each group
+    reads the window of the array covering its patches once, and gathers
+    its patches from the window with vectorised indexing. The patches are
+    written back in the original order of the points. Pixels outside the
+    image are masked (and zero).
+    """
+    npatches = indices_x.shape[0]
     assert npatches > 0
-    assert patchwidth > 0
-    nfeatures = array.atom.shape[0]
-    dtype = array.atom.dtype.base
+    patchwidth = 2 * halfwidth + 1
+    nfeatures = array.shape[-1]
     patch_data = np.zeros((npatches, patchwidth, patchwidth, nfeatures),
-                          dtype=dtype)
-    patch_mask = np.zeros_like(patch_data, dtype=bool)
-
-    for r in patch_reads:
-        patch_data[r.idx, r.yp, r.xp] = row_dict[r.y][r.x]
-
-    for m in mask_reads:
-        patch_mask[m.idx, m.yp, m.xp] = True
-
-    if array.missing is not None:
-        patch_mask |= patch_data == array.missing
-
-    marray = np.ma.MaskedArray(data=patch_data, mask=patch_mask)
+                          dtype=array.dtype)
+    outside = np.zeros((npatches, patchwidth, patchwidth), dtype=bool)
+
+    order, bounds = _tile_groups(indices_x, indices_y, array.chunkshape)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        idx = order[start:stop]
+        p = patch.patches(indices_x[idx], indices_y[idx], halfwidth,
+                          image_width, image_height)
+        y0 = max(int(p.y.min()), 0)
+        y1 = min(int(p.y.max()) + 1, image_height)
+        x0 = max(int(p.x.min()), 0)
+        x1 = min(int(p.x.max()) + 1, image_width)
+        window = array[y0:y1, x0:x1]
+        patch_data[idx] = patch.gather(p, window, np.arange(y0, y1), x0)
+        outside[idx] = patch.patch_mask(p)
+
+    marray = _masked_patches(array, patch_data, outside)
     return marray
 
 
-def _as_range(iterable: Iterator[int]) -> FixedSlice:
-    lst = list(iterable)
-    if len(lst) > 1:
-        return FixedSlice(start=lst[0], stop=(lst[-1] + 1))
-    else:
-        return FixedSlice(start=lst[0], stop=(lst[0] + 1))
-
-
-def _slices_from_patches(patch_reads: List[PatchRowRW]) -> List[FixedSlice]:
-    rowlist = sorted(list({k.y for k in patch_reads}))
-
-    c_init = count()
-
-    def _get(n: int, c: Iterator[int] = c_init) -> int:
-        res = n - next(c)
-        return res
-
-    slices = [_as_range(g) for _, g in groupby(rowlist, key=_get)]
+def _slices_from_rows(rows: np.ndarray) -> List[FixedSlice]:
+    """Get the contiguous runs of a sorted array of unique rows."""
+    breaks = np.flatnonzero(np.diff(rows) != 1) + 1
+    starts = rows[np.concatenate(([0], breaks))]
+    stops = rows[np.concatenate((breaks - 1, [-1]))] + 1
+    slices = [FixedSlice(int(a), int(b)) for a, b in zip(starts, stops)]
     return slices
 
 
-def _get_rows(slices: List[FixedSlice],
-              array: tables.CArray
-              ) -> Dict[int, np.ndarray]:
-    # TODO make faster
-    data_slices = [array[s.start:s.stop] for s in slices]
-    data = {}
-    for s, d in zip(slices, data_slices):
-        for i, d_io in zip(range(s[0], s[1]), d):
-            data[i] = d_io
-    return data
+def _rows_read(array: FeatureArray,
+               p: patch.PatchIndices,
+               slices: List[FixedSlice],
+               rows: np.ndarray
+               ) -> np.ma.MaskedArray:
+    """Build patches from rows, read once per contiguous run.
+
+    Only the columns covered by the patches are read, unless that is
+    every column (which reads whole rows).
+    """
+    x0 = max(int(p.x.min()), 0)
+    x1 = min(int(p.x.max()) + 1, array.shape[1])
+    if x1 - x0 == array.shape[1]:
+        blocks = [array[s.start:s.stop] for s in slices]
+    else:
+        blocks = [array[s.start:s.stop, x0:x1] for s in slices]
+    block = np.concatenate(blocks, axis=0)
+    data = patch.gather(p, block, rows, x0)
+    marray = _masked_patches(array, data, patch.patch_mask(p))
+    return marray
 
 
 def _process_training(coords: np.ndarray,
@@ -161,56 +190,147 @@ def _process_training(coords: np.ndarray,
     coords_x, coords_y = coords.T
     indices_x = world_to_image(coords_x, image_spec.x_coordinates)
     indices_y = world_to_image(coords_y, image_spec.y_coordinates)
-    patch_reads, mask_reads = patch.patches(indices_x, indices_y,
-                                            halfwidth,
-                                            image_spec.width,
-                                            image_spec.height)
-    npatches = indices_x.shape[0]
-    patchwidth = 2 * halfwidth + 1
     con_marray, cat_marray = None, None
     if feature_source.continuous:
-        con_marray = _direct_read(feature_source.continuous,
-                                  patch_reads, mask_reads,
-                                  npatches, patchwidth)
+        con_marray = _windowed_read(feature_source.continuous,
+                                    indices_x, indices_y, halfwidth,
+                                    image_spec.width, image_spec.height)
     if feature_source.categorical:
-        cat_marray = _direct_read(feature_source.categorical,
-                                  patch_reads, mask_reads,
-                                  npatches, patchwidth)
+        cat_marray = _windowed_read(feature_source.categorical,
+                                    indices_x, indices_y, halfwidth,
+                                    image_spec.width, image_spec.height)
     indices = np.vstack((indices_x, indices_y)).T
     output = DataArrays(con_marray, cat_marray, targets, coords, indices)
     return output
 
 
+def _dense_pixels(indices_x: np.ndarray,
+                  indices_y: np.ndarray
+                  ) -> Optional[Tuple[FixedSlice, FixedSlice]]:
+    """
+    Get the columns and pixel range of a batch, if it is contiguous.
+
+    The batch is contiguous if it is a run of pixels in the raster order
+    of the window of image columns it covers (such as whole rows of a
+    strip, tile or region). The pixel range is in that order.
+    """
+    x0 = int(indices_x.min())
+    x1 = int(indices_x.max()) + 1
+    flat = indices_y.astype(np.int64) * (x1 - x0) + (indices_x - x0)
+    start = int(flat[0])
+    stop = start + flat.shape[0]
+    if not np.array_equal(flat, np.arange(start, stop)):
+        return None
+    return FixedSlice(x0, x1), FixedSlice(start, stop)
+
+
+def _sliding_windows(a: np.ndarray, width: int) -> np.ndarray:
+    """Get a read-only view of every width x width window of a 2D grid."""
+    shape = (a.shape[0] - width + 1, a.shape[1] - width + 1, width, width)
+    strides = a.strides[:2] * 2
+    view = as_strided(a, shape=shape + a.shape[2:],
+                      strides=strides + a.strides[2:], writeable=False)
+    return view
+
+
+def _dense_read(array: FeatureArray,
+                cols: FixedSlice,
+                pixels: FixedSlice,
+                halfwidth: int,
+                image_width: int,
+                image_height: int
+                ) -> np.ma.MaskedArray:
+    """
+    Build the patches of a contiguous run of pixels from whole rows.
+
+    The run is in the raster order of the window of columns cols. The
+    rows of the run (and the halfwidth rows and columns around them) are
+    read in one go. With halfwidth 0 the patches are a reshaped slice of
+    the rows. Otherwise the rows are zero-padded to the patch halfwidth
+    and the patches are taken from a strided view of its sliding windows.
+    """
+    npatches = pixels.stop - pixels.start
+    nfeatures = array.shape[-1]
+    width = cols.stop - cols.start
+    y0 = pixels.start // width
+    y1 = (pixels.stop - 1) // width + 1
+    first = pixels.start - y0 * width
+    r0 = max(y0 - halfwidth, 0)
+    r1 = min(y1 + halfwidth, image_height)
+    c0 = max(cols.start - halfwidth, 0)
+    c1 = min(cols.stop + halfwidth, image_width)
+    block = array[r0:r1] if c1 - c0 == image_width else \
+        array[r0:r1, c0:c1]
+
+    if halfwidth == 0:
+        data = block.reshape((-1, 1, 1, nfeatures))[first:first + npatches]
+        outside = np.zeros(data.shape[:3], dtype=bool)
+        return _masked_patches(array, data, outside)
+
+    patchwidth = 2 * halfwidth + 1
+    padded_shape = (y1 - y0 + 2 * halfwidth, width + 2 * halfwidth)
+    padded = np.zeros(padded_shape + (nfeatures,), dtype=array.dtype)
+    outside = np.ones(padded_shape, dtype=bool)
+    top = r0 - (y0 - halfwidth)
+    left = c0 - (cols.start - halfwidth)
+    interior = (slice(top, top + r1 - r0), slice(left, left + c1 - c0))
+    padded[interior] = block
+    outside[interior] = False
+    ly, lx = np.divmod(np.arange(first, first + npatches), width)
+    data = _sliding_windows(padded, patchwidth)[ly, lx]
+    mask = _sliding_windows(outside, patchwidth)[ly, lx]
+    marray = _masked_patches(array, data, mask)
+    return marray
+
+
 def _process_query(indices: np.ndarray,
                    feature_source: H5Features,
                    image_spec: ImageSpec,
-                   halfwidth: int
+                   halfwidth: int,
+                   keep: Optional[np.ndarray] = None
                    ) -> DataArrays:
+    """
+    Build the query data of the pixels at indices.
+
+    If keep is given, only the pixels it marks are queried. A contiguous
+    run of pixels is still read densely, and the rest dropped after.
+    """
     indices_x, indices_y = indices.T
+    dense = _dense_pixels(indices_x, indices_y)
+    if keep is not None and dense is None:
+        indices = indices[keep]
+        indices_x, indices_y = indices.T
+    con_marray, cat_marray = None, None
+    if dense is not None:
+        cols, pixels = dense
+        if feature_source.continuous:
+            con_marray = _dense_read(feature_source.continuous, cols,
+                                     pixels, halfwidth, image_spec.width,
+                                     image_spec.height)
+        if feature_source.categorical:
+            cat_marray = _dense_read(feature_source.categorical, cols,
+                                     pixels, halfwidth, image_spec.width,
+                                     image_spec.height)
+        if keep is not None:
+            indices = indices[keep]
+            indices_x, indices_y = indices.T
+            con_marray = con_marray[keep] if con_marray is not None \
+                else None
+            cat_marray = cat_marray[keep] if cat_marray is not None \
+                else None
+    else:
+        p = patch.patches(indices_x, indices_y, halfwidth,
+                          image_spec.width, image_spec.height)
+        rows = patch.patch_rows(p)
+        slices = _slices_from_rows(rows)
+        if feature_source.continuous:
+            con_marray = _rows_read(feature_source.continuous, p, slices,
+                                    rows)
+        if feature_source.categorical:
+            cat_marray = _rows_read(feature_source.categorical, p, slices,
+                                    rows)
     coords_x = image_to_world(indices_x, image_spec.x_coordinates)
     coords_y = image_to_world(indices_y, image_spec.y_coordinates)
-    patch_reads, mask_reads = patch.patches(indices_x, indices_y,
-                                            halfwidth,
-                                            image_spec.width,
-                                            image_spec.height)
-    patch_data_slices = _slices_from_patches(patch_reads)
-    npatches = indices_x.shape[0]
-    patchwidth = 2 * halfwidth + 1
-    con_marray, cat_marray = None, None
-    if feature_source.continuous:
-        con_data_cache = _get_rows(patch_data_slices,
-                                   feature_source.continuous)
-        con_marray = _cached_read(con_data_cache,
-                                  feature_source.continuous,
-                                  patch_reads, mask_reads, npatches,
-                                  patchwidth)
-    if feature_source.categorical:
-        cat_data_cache = _get_rows(patch_data_slices,
-                                   feature_source.categorical)
-        cat_marray = _cached_read(cat_data_cache,
-                                  feature_source.categorical,
-                                  patch_reads, mask_reads, npatches,
-                                  patchwidth)
     coords = np.vstack((coords_x, coords_y)).T
     output = DataArrays(con_marray, cat_marray, None, coords, indices)
     return output
@@ -221,43 +341,77 @@ class _TrainingDataProcessor(Worker):
     def __init__(self,
                  feature_path: str,
                  image_spec: ImageSpec,
-                 halfwidth: int
+                 halfwidth: int,
+                 bands: Optional[List[str]] = None,
+                 cache_mb: float = 0.,
+                 features: Optional[H5Features] = None
                  ) -> None:
         self.feature_path = feature_path
-        self.feature_source: Optional[H5Features] = None
+        self.feature_source = features
         self.image_spec = image_spec
         self.halfwidth = halfwidth
+        self.bands = bands
+        self.cache_mb = cache_mb
 
     def __call__(self, values: Tuple[np.ndarray, np.ndarray]) -> List[bytes]:
         if not self.feature_source:
-            self.feature_source = H5Features(self.feature_path)
+            self.feature_source = H5Features(self.feature_path,
+                                             self.bands, self.cache_mb)
         targets, coords = values
         arrays = _process_training(coords, targets, self.feature_source,
                                    self.image_spec, self.halfwidth)
         strings = serialise(arrays)
         return strings
 
+    def close(self) -> None:
+        if self.feature_source:
+            self.feature_source.log_cache_stats()
+
 
 class _QueryDataProcessor(Worker):
 
     def __init__(self,
                  feature_path: str,
                  image_spec: ImageSpec,
-                 halfwidth: int
+                 window: ImageWindow,
+                 halfwidth: int,
+                 bands: Optional[List[str]] = None,
+                 cache_mb: float = 0.,
+                 features: Optional[H5Features] = None
                  ) -> None:
         self.feature_path = feature_path
-        self.feature_source: Optional[H5Features] = None
+        self.feature_source = features
         self.image_spec = image_spec
+        self.window = window
         self.halfwidth = halfwidth
+        self.bands = bands
+        self.cache_mb = cache_mb
 
-    def __call__(self, indices: np.ndarray) -> List[bytes]:
+    def __call__(self, rows: FixedSlice) -> List[bytes]:
         if not self.feature_source:
-            self.feature_source = H5Features(self.feature_path)
+            # The rolling window reuses rows of the band this process read
+            # last. Worker processes take bands from a shared queue, so
+            # consecutive bands rarely meet and only nworkers == 0 (or a
+            # resident store) reliably avoids rereading halo rows.
+            self.feature_source = H5Features(self.feature_path,
+                                             self.bands, self.cache_mb,
+                                             rolling=True)
+        indices = band_indices(rows, self.window.cols)
+        mask = _query_mask(self.feature_source, self.window, rows)
+        keep = None
+        if mask is not None:
+            keep = mask.ravel()
+            if not keep.any():
+                return []
         arrays = _process_query(indices, self.feature_source, self.image_spec,
-                                self.halfwidth)
+                                self.halfwidth, keep)
         strings = serialise(arrays)
         return strings
 
+    def close(self) -> None:
+        if self.feature_source:
+            self.feature_source.log_cache_stats()
+
 
 def write_trainingdata(args: ProcessTrainingArgs) -> None:
     log.info("Testing data is fold {} of {}".format(args.testfold,
@@ -265,25 +419,122 @@ def write_trainingdata(args: ProcessTrainingArgs) -> None:
     log.info("Writing training data to tfrecord in {}-point batches".format(
         args.batchsize))
     n_rows = len(args.target_src)
+    features = H5Features(args.feature_path, args.bands,
+                          resident=FixedSlice(0, args.image_spec.height)) \
+        if args.resident else None
     worker = _TrainingDataProcessor(args.feature_path, args.image_spec,
-                                    args.halfwidth)
+                                    args.halfwidth, args.bands,
+                                    args.cache_mb, features)
     tasks = list(batch_slices(args.batchsize, n_rows))
     out_it = task_list(tasks, args.target_src, worker, args.nworkers)
     fold_it = args.folds.iterator(args.batchsize)
     tfwrite.training(out_it, n_rows, args.directory, args.testfold, fold_it)
 
 
+def _query_window(args: ProcessQueryArgs) -> ImageWindow:
+    """Get the window of a query: its region of interest, or its strip."""
+    if args.window is not None:
+        return args.window
+    rows = strip_slices(args.image_spec.height,
+                        args.total_strips)[args.strip_idx - 1]
+    window = ImageWindow(FixedSlice(int(rows.start), int(rows.stop)),
+                         FixedSlice(0, args.image_spec.width))
+    return window
+
+
+def _query_rows(args: ProcessQueryArgs) -> FixedSlice:
+    """Get the image rows read by the patches of a query."""
+    rows = _query_window(args).rows
+    start = max(rows.start - args.halfwidth, 0)
+    stop = min(rows.stop + args.halfwidth, args.image_spec.height)
+    return FixedSlice(start, stop)
+
+
+def _query_mask(features: H5Features,
+                window: ImageWindow,
+                rows: FixedSlice
+                ) -> Optional[np.ndarray]:
+    """
+    Get the mask of the pixels to query in rows of a window.
+
+    These are the pixels with data (if the features record them) inside
+    the window's footprint (if it has one). Returns None if every pixel
+    is queried.
+    """
+    mask = features.valid_rows(rows)
+    if mask is not None:
+        mask = mask[:, window.cols.start:window.cols.stop]
+    if window.footprint is not None:
+        footprint = window.footprint[rows.start - window.rows.start:
+                                     rows.stop - window.rows.start]
+        mask = footprint if mask is None else \
+            np.logical_and(mask, footprint)
+    return mask
+
+
+def _chunk_rows(features: H5Features) -> int:
+    """Get the rows of the storage chunks of the feature arrays."""
+    rows = max(a.chunkshape[0] for a in (features.continuous,
+                                         features.categorical) if a)
+    return int(rows)
+
+
+def _write_query_valid(features: H5Features,
+                       window: ImageWindow,
+                       bands: List[FixedSlice],
+                       directory: str
+                       ) -> Optional[int]:
+    """
+    Copy the mask of the pixels queried in a window to the query directory.
+
+    Prediction fills the pixels left out with nodata. Returns the number
+    of pixels queried, or None if every pixel is.
+    """
+    if not bands or _query_mask(features, window, bands[0]) is None:
+        return None
+    path = os.path.join(directory, QUERY_VALID_FILE)
+    shape = (window.rows.stop - window.rows.start,
+             window.cols.stop - window.cols.start)
+    n_valid = 0
+    with tables.open_file(path, mode="w") as hfile:
+        valid = create_valid_mask(hfile, shape)
+        for b in bands:
+            mask = _query_mask(features, window, b)
+            valid[b.start - window.rows.start:
+                  b.stop - window.rows.start] = mask
+            n_valid += int(np.count_nonzero(mask))
+    return n_valid
+
+
 def write_querydata(args: ProcessQueryArgs) -> None:
 
-    log.info("Query data is strip {} of {}".format(args.strip_idx,
-                                                   args.total_strips))
-    log.info("Writing query data to tfrecord in {}-point batches".format(
-        args.batchsize))
+    window = _query_window(args)
+    if args.window is None:
+        log.info("Query data is strip {} of {}".format(args.strip_idx,
+                                                       args.total_strips))
+    else:
+        log.info("Query data is rows {} to {} and columns {} to {}".format(
+            window.rows.start, window.rows.stop, window.cols.start,
+            window.cols.stop))
+    log.info("Writing query data to tfrecord in whole-row batches of "
+             "about {} points".format(args.batchsize))
     reader_src = IdReader()
-    it, n_total = indices_strip(args.image_spec, args.strip_idx,
-                                args.total_strips, args.batchsize)
-    worker = _QueryDataProcessor(args.feature_path, args.image_spec,
-                                 args.halfwidth)
-    tasks = list(it)
+    features = H5Features(args.feature_path, args.bands,
+                          resident=_query_rows(args)) \
+        if args.resident else None
+    source = features if features else \
+        H5Features(args.feature_path, args.bands)
+    width = window.cols.stop - window.cols.start
+    tasks = row_bands(window.rows, width, args.batchsize, _chunk_rows(source))
+    n_total = (window.rows.stop - window.rows.start) * width
+    n_valid = _write_query_valid(source, window, tasks, args.directory)
+    del source
+    if n_valid is not None:
+        log.info("Extracting {} of the {} pixels in the window".format(
+            n_valid, n_total))
+        n_total = n_valid
+    worker = _QueryDataProcessor(args.feature_path, args.image_spec, window,
+                                 args.halfwidth, args.bands, args.cache_mb,
+                                 features)
     out_it = task_list(tasks, reader_src, worker, args.nworkers)
     tfwrite.query(out_it, n_total, args.directory, args.tag)
@@ -72,3 +72,177 @@ class PredictionShape(Error):
         """Construct the object."""
         self.message = "Prediction shape for {} is shaped {}. Predictions \
             must be 1D.".format(name, shape)
+
+
+class ImageSpecMismatch(Error):
+    """New tifs don't match the image of an existing feature file."""
+
+    def __init__(self, path: str, prop: str) -> None:
+        """Construct the object."""
+        self.message = "The supplied tifs do not match the {} of the \
+            image in {}".format(prop, path)
+
+
+class DuplicateBands(Error):
+    """Bands being added already exist in the feature file."""
+
+    def __init__(self, path: str, cols: List[str]) -> None:
+        """Construct the object."""
+        self.message = "The following bands are already in {}: {}".format(
+            path, cols)
+
+
+class UnknownBands(Error):
+    """Requested bands are not in the feature file."""
+
+    def __init__(self, cols: List[str]) -> None:
+        """Construct the object."""
+        self.message = "The following bands are not in the feature \
+            file: {}".format(cols)
+
+
+class NoBandsSelected(Error):
+    """Band selection leaves no bands to extract."""
+
+    message = "The --include/--exclude options leave no bands to extract"
+
+
+class UnnormalisedCompactType(Error):
+    """Reduced precision storage was requested for unnormalised data."""
+
+    message = "Reduced precision continuous storage requires the data \
+        to be normalised"
+
+
+class CategoricalTypeOverflow(Error):
+    """Categories don't fit in the storage type of a feature file."""
+
+    def __init__(self, nvalues: int, dtype: np.dtype) -> None:
+        """Construct the object."""
+        self.message = "{} categories cannot be stored in the {} \
+            categorical data of the feature file".format(nvalues, dtype)
+
+
+class TooManyShards(Error):
+    """More shards were requested than there are image rows."""
+
+    def __init__(self, nshards: int, nrows: int) -> None:
+        """Construct the object."""
+        self.message = "Cannot split {} image rows into {} shards".format(
+            nrows, nshards)
+
+
+class InvalidFraction(Error):
+    """An option that should be a fraction is outside (0, 1]."""
+
+    def __init__(self, option: str, value: float) -> None:
+        """Construct the object."""
+        self.message = "{} must be greater than 0 and at most 1, " \
+            "not {}".format(option, value)
+
+
+class InvalidClipPercentile(Error):
+    """The clipping percentile is outside [0, 50)."""
+
+    def __init__(self, percentile: float) -> None:
+        """Construct the object."""
+        self.message = "clip-percentile must be at least 0 and less than " \
+            "50, not {}".format(percentile)
+
+
+class UnknownTableFormat(Error):
+    """A target table has an unrecognised file extension."""
+
+    def __init__(self, path: str, extensions: Tuple[str, ...]) -> None:
+        """Construct the object."""
+        self.message = "Cannot read the table {}, the supported file \
+            extensions are {}".format(path, ", ".join(extensions))
+
+
+class UnknownTableColumns(Error):
+    """Requested columns are missing from a target table."""
+
+    def __init__(self, path: str, cols: List[str]) -> None:
+        """Construct the object."""
+        self.message = "The following columns are not in the table \
+            {}: {}".format(path, cols)
+
+
+class RaggedCsvRows(Error):
+    """The rows of a CSV table have different numbers of fields."""
+
+    def __init__(self, path: str) -> None:
+        """Construct the object."""
+        self.message = "The rows of the CSV table {} do not all have the \
+            same number of fields as its header".format(path)
+
+
+class NoTableFound(Error):
+    """An HDF5 file has no table of targets."""
+
+    def __init__(self, path: str) -> None:
+        """Construct the object."""
+        self.message = "The HDF5 file {} contains no table".format(path)
+
+
+class MissingCategoricalValues(Error):
+    """Categorical target columns have missing or non-numeric values."""
+
+    def __init__(self, path: str) -> None:
+        """Construct the object."""
+        self.message = "The categorical columns of the table {} have \
+            missing or non-numeric values".format(path)
+
+
+class MissingDependency(Error):
+    """An optional package needed for an input format is not installed."""
+
+    def __init__(self, package: str, purpose: str) -> None:
+        """Construct the object."""
+        self.message = "The {} package is required for {}. Install it \
+            with pip install {}".format(package, purpose, package)
+
+
+class TargetSourceCount(Error):
+    """Targets were not given as exactly one of a shapefile or table."""
+
+    message = "Give exactly one of --shapefile or --table"
+
+
+class UnknownRoiFormat(Error):
+    """A region of interest file is not a shapefile or GeoJSON."""
+
+    def __init__(self, path: str, extensions: Tuple[str, ...]) -> None:
+        """Construct the object."""
+        self.message = "Region of interest {} is not one of the supported \
+            formats {}".format(path, list(extensions))
+
+
+class RoiOutsideImage(Error):
+    """A region of interest does not overlap the feature image."""
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        """Construct the object."""
+        self.message = "The region of interest with bounds {} does not \
+            overlap the features".format(list(bounds))
+
+
+class QueryRegionCount(Error):
+    """More than one of a strip, tile, bounding box or region was queried."""
+
+    message = "Give at most one of --strip, --tile, --bbox or --roi"
+
+
+class BalanceWithoutStrips(Error):
+    """Balanced strips were asked for with a tile or region query."""
+
+    message = ("--balance only applies to --strip queries, not --tile, "
+               "--bbox or --roi")
+
+
+class EmptyRoi(Error):
+    """A region of interest file has no shapes."""
+
+    def __init__(self, path: str) -> None:
+        """Construct the object."""
+        self.message = "The region of interest {} has no shapes".format(path)
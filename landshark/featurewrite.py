@@ -15,22 +15,24 @@
 # limitations under the License.
 
 import logging
-from typing import List, Optional, Tuple, TypeVar
+import os.path
+from typing import Any, List, NamedTuple, Optional, Tuple, TypeVar
 
 import numpy as np
 import tables
 
 from landshark.basetypes import (ArraySource, CategoricalArraySource,
-                                 ContinuousArraySource, CoordinateArraySource,
-                                 IdWorker, Worker)
-from landshark.category import CategoryMapper
-from landshark.image import ImageSpec
+                                 CategoricalType, ContinuousArraySource,
+                                 ContinuousType, CoordinateArraySource,
+                                 FixedSlice, IdWorker, MissingType, Worker)
+from landshark.category import CategoryMapper, mapped_missing
+from landshark.image import ImageSpec, strip_slices
 from landshark.iteration import batch_slices, with_slices
 from landshark.metadata import (CategoricalFeatureSet, CategoricalTarget,
                                 ContinuousFeatureSet, ContinuousTarget,
                                 FeatureSet, Target)
 from landshark.multiproc import task_list
-from landshark.normalise import Normaliser
+from landshark.normalise import Normaliser, storage_missing
 
 log = logging.getLogger(__name__)
 
@@ -38,6 +40,114 @@ log = logging.getLogger(__name__)
 T = TypeVar("T")
 
 
+def column_groups(hfile: tables.File, name: str) -> List[tables.CArray]:
+    """Get every column group array holding the bands of `name`."""
+    groups = []
+    while hasattr(hfile.root, _group_name(name, len(groups))):
+        groups.append(hfile.get_node("/" + _group_name(name, len(groups))))
+    return groups
+
+
+def _group_name(name: str, group: int) -> str:
+    """Name of the array holding a column group (the first has no suffix)."""
+    group_name = name if group == 0 else "{}_{}".format(name, group)
+    return group_name
+
+
+# The query directory file holding the valid pixels of its strip
+QUERY_VALID_FILE = "valid.hdf5"
+
+
+def create_valid_mask(hfile: tables.File,
+                      shape: Tuple[int, int]
+                      ) -> tables.CArray:
+    """
+    Create the (all False) mask of the pixels holding any feature data.
+
+    Pixels where every band is missing (such as ocean, or outside a
+    survey) are invalid and left out of query extraction and prediction.
+    """
+    filters = tables.Filters(complevel=1, complib="blosc:lz4")
+    valid = hfile.create_carray(hfile.root, name="valid",
+                                atom=tables.BoolAtom(), shape=shape,
+                                filters=filters)
+    return valid
+
+
+def _valid_counts(hfile: tables.File, nrows: int) -> tables.Array:
+    """Get (or create, as zeros) the number of valid pixels in each row."""
+    if hasattr(hfile.root, "valid_counts"):
+        return hfile.root.valid_counts
+    counts = hfile.create_array(hfile.root, name="valid_counts",
+                                obj=np.zeros(nrows, dtype=np.int64))
+    return counts
+
+
+def read_valid_counts(path: str) -> Optional[np.ndarray]:
+    """
+    Read the number of valid pixels in each row of a feature image.
+
+    The counts are kept up to date at import (and when adding bands),
+    and are used to divide the image into strips of equal work. Returns
+    None if the feature file doesn't record them.
+    """
+    with tables.open_file(path, "r") as hfile:
+        counts = hfile.root.valid_counts.read() \
+            if hasattr(hfile.root, "valid_counts") else None
+    return counts
+
+
+class Shard(NamedTuple):
+    """A file holding the feature data of a contiguous range of rows."""
+
+    path: str
+    rows: FixedSlice
+
+
+def write_shard_index(hfile: tables.File, nrows: int, nshards: int) -> None:
+    """
+    Make a new feature file the index of a store split into row shards.
+
+    The index keeps the metadata, while the data of each of nshards
+    contiguous row ranges goes to its own file next to the index. The
+    data arrays in the index have no rows and just record their layout.
+
+    Parameters
+    ----------
+    hfile : tables.File
+        The newly created feature file.
+    nrows : int
+        The number of rows (image height) of the features.
+    nshards : int
+        The number of shard files to split the rows across.
+
+    """
+    dirname = os.path.dirname(hfile.filename)
+    stem, ext = os.path.splitext(os.path.basename(hfile.filename))
+    names = ["{}_shard{}{}".format(stem, i, ext) for i in range(nshards)]
+    slices = strip_slices(nrows, nshards)
+    hfile.root._v_attrs.shard_files = names
+    hfile.root._v_attrs.shard_rows = np.array(
+        [s.start for s in slices] + [nrows])
+    for n in names:
+        with tables.open_file(os.path.join(dirname, n), mode="w"):
+            pass
+    log.info("Splitting {} rows across {} shard files".format(
+        nrows, nshards))
+
+
+def read_shards(hfile: tables.File) -> List[Shard]:
+    """Get the shards of a feature file (empty if it isn't sharded)."""
+    attrs = hfile.root._v_attrs
+    if "shard_files" not in attrs:
+        return []
+    dirname = os.path.dirname(hfile.filename)
+    bounds = attrs.shard_rows
+    shards = [Shard(os.path.join(dirname, f), FixedSlice(int(a), int(b)))
+              for f, a, b in zip(attrs.shard_files, bounds[:-1], bounds[1:])]
+    return shards
+
+
 def write_feature_metadata(meta: FeatureSet, hfile: tables.File) -> None:
     hfile.root._v_attrs.N = len(meta)
     hfile.root._v_attrs.halfwidth = meta.halfwidth
@@ -48,6 +158,20 @@ def write_feature_metadata(meta: FeatureSet, hfile: tables.File) -> None:
         _write_categorical_metadata(meta.categorical, hfile)
 
 
+def append_feature_metadata(meta: FeatureSet, hfile: tables.File) -> None:
+    """Add the metadata of newly written bands to an existing feature file."""
+    if meta.continuous:
+        if hasattr(hfile.root, "continuous_labels"):
+            _append_continuous_metadata(meta.continuous, hfile)
+        else:
+            _write_continuous_metadata(meta.continuous, hfile)
+    if meta.categorical:
+        if hasattr(hfile.root, "categorical_labels"):
+            _append_categorical_metadata(meta.categorical, hfile)
+        else:
+            _write_categorical_metadata(meta.categorical, hfile)
+
+
 def read_feature_metadata(path: str) -> FeatureSet:
     with tables.open_file(path, "r") as hfile:
         N = hfile.root._v_attrs.N
@@ -99,17 +223,35 @@ def _write_continuous_metadata(meta: ContinuousFeatureSet,
         _make_float_vlarray(hfile, "continuous_sds", sds)
 
 
+def _append_continuous_metadata(meta: ContinuousFeatureSet,
+                                hfile: tables.File
+                                ) -> None:
+    attrs = hfile.root.continuous_data.attrs
+    if attrs.missing is None:
+        attrs.missing = meta.missing_value
+    labels = [k for k in meta.columns.keys()]
+    D = np.array([v.D for v in meta.columns.values()], dtype=int)
+    means = [v.mean for v in meta.columns.values()]
+    sds = [v.sd for v in meta.columns.values()]
+    _extend_vlarray(hfile.root.continuous_labels, labels)
+    _extend_array(hfile, "continuous_D", D)
+    if meta.normalised:
+        _extend_vlarray(hfile.root.continuous_means, means)
+        _extend_vlarray(hfile.root.continuous_sds, sds)
+
+
 def _read_continuous_metadata(hfile: tables.File) -> ContinuousFeatureSet:
     missing_value = hfile.root.continuous_data.attrs.missing
     normalised = hfile.root.continuous_data.attrs.normalised
     labels = [k.decode() for k in hfile.root.continuous_labels.read()]
+    dtype = hfile.root.continuous_data.atom.dtype.base
     stats = None
     if normalised:
         stats = (
             hfile.root.continuous_means.read(),
             hfile.root.continuous_sds.read()
         )
-    meta = ContinuousFeatureSet(labels, missing_value, stats)
+    meta = ContinuousFeatureSet(labels, missing_value, stats, dtype)
     return meta
 
 
@@ -153,6 +295,24 @@ def _write_categorical_metadata(meta: CategoricalFeatureSet,
     hfile.create_array(hfile.root, name="categorical_nvalues", obj=nvalues)
 
 
+def _append_categorical_metadata(meta: CategoricalFeatureSet,
+                                 hfile: tables.File
+                                 ) -> None:
+    attrs = hfile.root.categorical_data.attrs
+    if attrs.missing is None:
+        attrs.missing = meta.missing_value
+    labels = [k for k in meta.columns.keys()]
+    nvalues = np.array([v.nvalues for v in meta.columns.values()])
+    D = np.array([v.D for v in meta.columns.values()])
+    mappings = [v.mapping for v in meta.columns.values()]
+    counts = [v.counts for v in meta.columns.values()]
+    _extend_vlarray(hfile.root.categorical_labels, labels)
+    _extend_array(hfile, "categorical_D", D)
+    _extend_vlarray(hfile.root.categorical_counts, counts)
+    _extend_vlarray(hfile.root.categorical_mappings, mappings)
+    _extend_array(hfile, "categorical_nvalues", nvalues)
+
+
 def _read_categorical_metadata(hfile: tables.File) -> CategoricalFeatureSet:
     missing_value = hfile.root.categorical_data.attrs.missing
     labels = [k.decode() for k in hfile.root.categorical_labels.read()]
@@ -160,8 +320,9 @@ def _read_categorical_metadata(hfile: tables.File) -> CategoricalFeatureSet:
     mappings = hfile.root.categorical_mappings.read()
     counts = hfile.root.categorical_counts.read()
     nvalues = np.array(hfile.root.categorical_nvalues.read())
+    dtype = hfile.root.categorical_data.atom.dtype.base
     meta = CategoricalFeatureSet(labels, missing_value,
-                                 nvalues, mappings, counts)
+                                 nvalues, mappings, counts, dtype)
     return meta
 
 
@@ -208,52 +369,172 @@ def write_continuous(source: ContinuousArraySource,
                      hfile: tables.File,
                      n_workers: int,
                      batchrows: Optional[int] = None,
-                     stats: Optional[Tuple[np.ndarray, np.ndarray]] = None
+                     stats: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                     group: int = 0,
+                     bands_per_group: int = 0,
+                     dtype: np.dtype = ContinuousType,
+                     clip: Optional[Tuple[np.ndarray, np.ndarray]] = None
                      ) -> None:
-    transform = Normaliser(*stats, source.missing) if stats else IdWorker()
+    # Compact dtypes only have the range for normalised data
+    assert stats or np.dtype(dtype) == ContinuousType
+    transform = Normaliser(*stats, source.missing, dtype, clip) if stats \
+        else IdWorker()
     n_workers = n_workers if stats else 0
-    _write_source(source, hfile, tables.Float32Atom(source.shape[-1]),
-                  "continuous_data", transform, n_workers, batchrows)
+    missing = storage_missing(source.missing, dtype)
+    _write_source(source, hfile, dtype, missing, "continuous_data",
+                  transform, n_workers, batchrows, group, bands_per_group)
 
 
 def write_categorical(source: CategoricalArraySource,
                       hfile: tables.File,
                       n_workers: int,
                       batchrows: Optional[int] = None,
-                      maps: Optional[np.ndarray] = None
+                      maps: Optional[np.ndarray] = None,
+                      group: int = 0,
+                      bands_per_group: int = 0,
+                      dtype: np.dtype = CategoricalType
                       ) -> None:
-    transform = CategoryMapper(maps, source.missing) if maps else IdWorker()
+    # Compact dtypes can only hold mapped categories
+    assert maps or np.dtype(dtype) == CategoricalType
+    transform = CategoryMapper(maps, source.missing, dtype) if maps \
+        else IdWorker()
     n_workers = n_workers if maps else 0
-    _write_source(source, hfile, tables.Int32Atom(source.shape[-1]),
-                  "categorical_data", transform, n_workers, batchrows)
+    missing = mapped_missing(source.missing, dtype)
+    _write_source(source, hfile, dtype, missing, "categorical_data",
+                  transform, n_workers, batchrows, group, bands_per_group)
 
 
 def _write_source(src: ArraySource,
                   hfile: tables.File,
-                  atom: tables.Atom,
+                  dtype: np.dtype,
+                  missing: MissingType,
                   name: str,
                   transform: Worker,
                   n_workers: int,
-                  batchrows: Optional[int] = None
+                  batchrows: Optional[int] = None,
+                  group: int = 0,
+                  bands_per_group: int = 0
                   ) -> None:
+    """Write src into column groups of at most bands_per_group bands.
+
+    The groups are numbered on from `group`, and a bands_per_group of 0
+    puts every band into the same group. If hfile is the index of a sharded
+    store, each shard gets the groups for its rows.
+    """
     front_shape = src.shape[0:-1]
-    filters = tables.Filters(complevel=1, complib="blosc:lz4")
-    array = hfile.create_carray(hfile.root, name=name,
-                                atom=atom, shape=front_shape, filters=filters)
-    array.attrs.missing = src.missing
+    nbands = src.shape[-1]
+    bands_per_group = bands_per_group if bands_per_group > 0 else nbands
+    band_slices = list(batch_slices(bands_per_group, nbands))
+    # Files imported before the valid mask existed don't get one, as the
+    # new bands alone would miss the pixels with data in the old ones
+    has_mask = hasattr(hfile.root, "valid") or not any(
+        hasattr(hfile.root, k) for k in ("continuous_data",
+                                         "categorical_data"))
+    shards = read_shards(hfile)
+    if shards:
+        # The index records the groups, the shards hold their rows
+        _create_groups(hfile, name, group, dtype, missing, band_slices,
+                       (0,) + front_shape[1:], placeholder=True)
+        files = [tables.open_file(sh.path, mode="a") for sh in shards]
+        rows = [sh.rows for sh in shards]
+    else:
+        files = [hfile]
+        rows = [FixedSlice(0, front_shape[0])]
+    arrays = [_create_groups(f, name, group, dtype, missing, band_slices,
+                             (r.stop - r.start,) + front_shape[1:])
+              for f, r in zip(files, rows)]
+    # Images also record the pixels with data in any band (targets don't)
+    valid, counts = None, None
+    if len(front_shape) == 2 and has_mask:
+        valid = hfile.root.valid if hasattr(hfile.root, "valid") else \
+            create_valid_mask(hfile, front_shape)
+        counts = _valid_counts(hfile, front_shape[0])
+    elif len(front_shape) == 2:
+        log.info("Feature file has no mask of the pixels with data, so "
+                 "every pixel is queried")
     batchrows = batchrows if batchrows else src.native
     log.info("Writing {} to HDF5 in {}-row batches".format(name, batchrows))
-    _write(src, array, batchrows, n_workers, transform)
-
-
-def _write(source: ArraySource, array: tables.CArray,
-           batchrows: int, n_workers: int, transform: Worker) -> None:
+    if len(band_slices) > 1:
+        log.info("Writing {} bands in {} column groups".format(
+            nbands, len(band_slices)))
+    try:
+        _write(src, arrays, rows, band_slices, batchrows, n_workers,
+               transform, valid, missing, counts)
+    finally:
+        if shards:
+            for f in files:
+                f.close()
+
+
+def _create_groups(hfile: tables.File,
+                   name: str,
+                   group: int,
+                   dtype: np.dtype,
+                   missing: MissingType,
+                   band_slices: List[FixedSlice],
+                   front_shape: Tuple[int, ...],
+                   placeholder: bool = False
+                   ) -> List[tables.Array]:
+    """Create the column group arrays of name, numbered on from group.
+
+    Placeholders are empty extendable arrays, used in the index of a
+    sharded store to record the atom and attributes of each group.
+    """
+    filters = tables.Filters(complevel=1, complib="blosc:lz4")
+    arrays = []
+    for i, b in enumerate(band_slices):
+        atom = tables.Atom.from_dtype(np.dtype((dtype, (b.stop - b.start,))))
+        create = hfile.create_earray if placeholder else hfile.create_carray
+        array = create(hfile.root, name=_group_name(name, group + i),
+                       atom=atom, shape=front_shape, filters=filters)
+        array.attrs.missing = missing
+        arrays.append(array)
+    return arrays
+
+
+def _write(source: ArraySource,
+           arrays: List[List[tables.CArray]],
+           rows: List[FixedSlice],
+           band_slices: List[FixedSlice],
+           batchrows: int,
+           n_workers: int,
+           transform: Worker,
+           valid: Optional[tables.CArray] = None,
+           missing: MissingType = None,
+           counts: Optional[tables.Array] = None
+           ) -> None:
+    """Write source to the column group arrays of each row range.
+
+    If given, pixels with any non-missing band are marked in valid (which
+    keeps those marked by bands written before), and the valid pixels of
+    each row are counted in counts.
+    """
     n_rows = len(source)
     slices = list(batch_slices(batchrows, n_rows))
     out_it = task_list(slices, source, transform, n_workers)
     for s, d in with_slices(out_it):
-        array[s.start:s.stop] = d
-    array.flush()
+        if valid is not None:
+            has_data = np.ones(d.shape[:-1], dtype=bool) if missing is None \
+                else np.any(d != missing, axis=-1)
+            has_data = valid[s.start:s.stop] | has_data
+            valid[s.start:s.stop] = has_data
+            if counts is not None:
+                counts[s.start:s.stop] = np.count_nonzero(has_data, axis=1)
+        for shard_arrays, r in zip(arrays, rows):
+            start, stop = max(s.start, r.start), min(s.stop, r.stop)
+            if start >= stop:
+                continue
+            shard_d = d[start - s.start:stop - s.start]
+            for array, b in zip(shard_arrays, band_slices):
+                array[start - r.start:stop - r.start] = \
+                    shard_d[..., b.start:b.stop]
+    for shard_arrays in arrays:
+        for array in shard_arrays:
+            array.flush()
+    if valid is not None:
+        valid.flush()
+    if counts is not None:
+        counts.flush()
 
 
 def write_coordinates(array_src: CoordinateArraySource,
@@ -288,10 +569,26 @@ def _make_float_vlarray(h5file: tables.File,
                         ) -> None:
     vlarray = h5file.create_vlarray(h5file.root, name=name,
                                     atom=tables.Float64Atom(shape=()))
+    for a in attribute:
+        vlarray.append(np.atleast_1d(a))
+
+
+def _extend_vlarray(vlarray: tables.VLArray, attribute: List[Any]) -> None:
     for a in attribute:
         vlarray.append(a)
 
 
+def _extend_array(h5file: tables.File,
+                  name: str,
+                  attribute: np.ndarray
+                  ) -> None:
+    """Replace a (fixed size) array with one that has attribute appended."""
+    old = h5file.get_node("/" + name).read()
+    h5file.remove_node(h5file.root, name)
+    h5file.create_array(h5file.root, name=name,
+                        obj=np.concatenate((old, attribute)))
+
+
 def _make_str_vlarray(h5file: tables.File,
                       name: str,
                       attribute: List[str]
@@ -14,20 +14,29 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import ctypes
+import logging
+from multiprocessing.sharedctypes import RawArray
 from types import TracebackType
-from typing import Tuple, Union
+from typing import Any, Iterable, List, Optional, Tuple, Union
 
 import numpy as np
 import tables
+from lru import LRU
 
 from landshark.basetypes import (ArraySource, CategoricalArraySource,
-                                 ContinuousArraySource)
-from landshark.featurewrite import read_feature_metadata, read_target_metadata
+                                 ContinuousArraySource, FixedSlice,
+                                 MissingType)
+from landshark.featurewrite import (column_groups, read_feature_metadata,
+                                    read_shards, read_target_metadata)
+from landshark.iteration import batch_slices
+
+log = logging.getLogger(__name__)
 
 
 class H5ArraySource(ArraySource):
     """Note these are only used for targets! see the target specific metadata
-    call. Should probably be renamed."""
+    call. Should probably be renamed. Target files are never sharded."""
 
     _array_name = ""
 
@@ -87,22 +96,384 @@ class CategoricalH5ArraySource(H5ArraySource, CategoricalArraySource):
     _array_name = "categorical_data"
 
 
+class FeatureArray:
+    """
+    The bands of one feature type, stored across one or more column groups.
+
+    Indexing behaves as for a single CArray whose atom holds every selected
+    band, with the groups concatenated along the last (band) axis. Column
+    groups with no selected bands are never read.
+
+    Parameters
+    ----------
+    carrays : List[tables.CArray]
+        The column group arrays, in band order.
+    missing : MissingType
+        The value indicating missing data, or None if there is none.
+    columns : Optional[List[int]]
+        The indices of the bands to read, in increasing order. All bands
+        are read if not provided.
+
+    Attributes
+    ----------
+    chunkshape : Tuple[int, int]
+        The rows and columns of the storage chunks (of the largest if the
+        column groups differ), for aligning reads with them.
+
+    """
+
+    def __init__(self,
+                 carrays: List[tables.CArray],
+                 missing: MissingType,
+                 columns: Optional[List[int]] = None
+                 ) -> None:
+        self.missing = missing
+        self.dtype = carrays[0].atom.dtype.base
+        self._reads: List[Tuple[tables.CArray, Optional[List[int]]]] = []
+        nfeatures = 0
+        start = 0
+        for c in carrays:
+            stop = start + c.atom.shape[0]
+            if columns is None:
+                local = list(range(stop - start))
+            else:
+                local = [i - start for i in columns if start <= i < stop]
+            if local:
+                everything = local == list(range(stop - start))
+                self._reads.append((c, None if everything else local))
+                nfeatures += len(local)
+            start = stop
+        self.shape = tuple(carrays[0].shape) + (nfeatures,)
+        self.chunkshape = tuple(
+            int(max(c.chunkshape[i] for c, _ in self._reads))
+            for i in range(2))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        data_list = [c[key] if cols is None else c[key][..., cols]
+                     for c, cols in self._reads]
+        if len(data_list) == 1:
+            return data_list[0]
+        data = np.concatenate(data_list, axis=-1)
+        return data
+
+
+class ShardedFeatureArray(FeatureArray):
+    """
+    The bands of one feature type, stored across row-range shard files.
+
+    Reads of a row or a range of rows are routed to the shards holding
+    them, so indexing behaves as for a FeatureArray over the whole image.
+
+    Parameters
+    ----------
+    shards : List[FeatureArray]
+        The arrays of each shard, in row order.
+    rows : List[FixedSlice]
+        The rows of the image held by each shard.
+
+    """
+
+    def __init__(self,
+                 shards: List[FeatureArray],
+                 rows: List[FixedSlice]
+                 ) -> None:
+        self.missing = shards[0].missing
+        self.dtype = shards[0].dtype
+        self.shape = (rows[-1].stop,) + shards[0].shape[1:]
+        self.chunkshape = shards[0].chunkshape
+        self._shards = shards
+        self._rows = rows
+        self._starts = np.array([r.start for r in rows])
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        row_key, rest = (key[0], key[1:]) if isinstance(key, tuple) \
+            else (key, ())
+        if isinstance(row_key, slice):
+            start, stop, step = row_key.indices(len(self))
+            assert step == 1
+            data_list = [
+                a[(slice(max(start, r.start) - r.start,
+                         min(stop, r.stop) - r.start),) + rest]
+                for a, r in zip(self._shards, self._rows)
+                if start < r.stop and r.start < stop]
+            if len(data_list) == 0:
+                return self._shards[0][(slice(0, 0),) + rest]
+            if len(data_list) == 1:
+                return data_list[0]
+            data = np.concatenate(data_list, axis=0)
+            return data
+        row = int(row_key)
+        row = row + len(self) if row < 0 else row
+        i = int(np.searchsorted(self._starts, row, side="right")) - 1
+        return self._shards[i][(row - self._rows[i].start,) + rest]
+
+
+def _key_range(key: Any, size: int) -> Tuple[int, int]:
+    """Get the start and stop of an int or unit-step slice key."""
+    if isinstance(key, slice):
+        start, stop, step = key.indices(size)
+        assert step == 1
+        return start, max(start, stop)
+    index = int(key)
+    index = index + size if index < 0 else index
+    return index, index + 1
+
+
+class CachedFeatureArray(FeatureArray):
+    """
+    A feature array read through an LRU cache of decoded chunk tiles.
+
+    The array is divided into tiles matching its storage chunks. Reads
+    are assembled from whole tiles, and the most recently used tiles are
+    kept decoded, so overlapping patches and neighbouring points don't
+    decompress the same chunks again. Indexing behaves as for the wrapped
+    array, for keys of a row and an optional column (each an int or a
+    slice).
+
+    Parameters
+    ----------
+    array : FeatureArray
+        The array to read.
+    max_bytes : int
+        The most memory to use for cached tiles. At least one tile is kept.
+
+    """
+
+    def __init__(self, array: FeatureArray, max_bytes: int) -> None:
+        self.missing = array.missing
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.chunkshape = array.chunkshape
+        self.hits = 0
+        self.misses = 0
+        self._array = array
+        tile_bytes = self.chunkshape[0] * self.chunkshape[1] * \
+            self.shape[-1] * np.dtype(self.dtype).itemsize
+        self._tiles = LRU(max(1, max_bytes // tile_bytes))
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _tile(self, ty: int, tx: int) -> np.ndarray:
+        """Get a tile, reading it on a cache miss."""
+        tile = self._tiles.get((ty, tx))
+        if tile is None:
+            self.misses += 1
+            rows, cols = self.chunkshape
+            tile = self._array[ty * rows:(ty + 1) * rows,
+                               tx * cols:(tx + 1) * cols]
+            self._tiles[(ty, tx)] = tile
+        else:
+            self.hits += 1
+        return tile
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        keys = key if isinstance(key, tuple) else (key,)
+        assert len(keys) <= 2
+        row_key = keys[0]
+        col_key = keys[1] if len(keys) == 2 else slice(None)
+        y0, y1 = _key_range(row_key, self.shape[0])
+        x0, x1 = _key_range(col_key, self.shape[1])
+        rows, cols = self.chunkshape
+        data = np.empty((y1 - y0, x1 - x0, self.shape[-1]), dtype=self.dtype)
+        for ty in range(y0 // rows, -(-y1 // rows)):
+            a0, a1 = max(y0, ty * rows), min(y1, (ty + 1) * rows)
+            for tx in range(x0 // cols, -(-x1 // cols)):
+                b0, b1 = max(x0, tx * cols), min(x1, (tx + 1) * cols)
+                tile = self._tile(ty, tx)
+                data[a0 - y0:a1 - y0, b0 - x0:b1 - x0] = \
+                    tile[a0 - ty * rows:a1 - ty * rows,
+                         b0 - tx * cols:b1 - tx * cols]
+        if not isinstance(col_key, slice):
+            data = data[:, 0]
+        if not isinstance(row_key, slice):
+            data = data[0]
+        return data
+
+
+class ResidentFeatureArray(FeatureArray):
+    """
+    Rows of a feature array decoded once into shared memory.
+
+    The rows are read when the array is constructed, into a buffer that
+    worker processes forked afterwards share. Indexing returns numpy views
+    of the buffer (without copying), for keys of a row and an optional
+    column within the resident rows.
+
+    Parameters
+    ----------
+    array : FeatureArray
+        The array to read.
+    rows : FixedSlice
+        The rows of the array to keep resident.
+
+    """
+
+    def __init__(self, array: FeatureArray, rows: FixedSlice) -> None:
+        self.missing = array.missing
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.chunkshape = array.chunkshape
+        self._rows = rows
+        self._window_shape = (rows.stop - rows.start,) + array.shape[1:]
+        self._size = int(np.prod(self._window_shape))
+        nbytes = self._size * np.dtype(self.dtype).itemsize
+        self._buffer = RawArray(ctypes.c_byte, max(nbytes, 1))
+        data = self._view()
+        for s in batch_slices(self.chunkshape[0], self._window_shape[0]):
+            data[s.start:s.stop] = array[rows.start + s.start:
+                                         rows.start + s.stop]
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _view(self) -> np.ndarray:
+        """Get the resident rows as an array."""
+        data = np.frombuffer(self._buffer, dtype=self.dtype,
+                             count=self._size).reshape(self._window_shape)
+        return data
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        keys = key if isinstance(key, tuple) else (key,)
+        row_key = keys[0]
+        y0, y1 = _key_range(row_key, self.shape[0])
+        assert self._rows.start <= y0 and y1 <= self._rows.stop
+        local = slice(y0 - self._rows.start, y1 - self._rows.start) \
+            if isinstance(row_key, slice) else y0 - self._rows.start
+        return self._view()[(local,) + keys[1:]]
+
+
+class RollingFeatureArray(FeatureArray):
+    """
+    A feature array that keeps the rows of its last read decoded.
+
+    Reads of a range of rows (of all columns, or of one range of columns)
+    reuse the rows they share with the previous read of the same columns
+    and only read the rest, so a sequence of overlapping row ranges (such
+    as query batches and the halo rows of their patches) reads each row
+    once. Other keys are passed to the wrapped array.
+
+    Parameters
+    ----------
+    array : FeatureArray
+        The array to read.
+
+    """
+
+    def __init__(self, array: FeatureArray) -> None:
+        self.missing = array.missing
+        self.dtype = array.dtype
+        self.shape = array.shape
+        self.chunkshape = array.chunkshape
+        self.rows_read = 0
+        self.rows_reused = 0
+        self._array = array
+        self._start = 0
+        self._cols = (0, self.shape[1])
+        self._rows = np.empty((0,) + self.shape[1:], dtype=self.dtype)
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def _read(self, start: int, stop: int) -> List[np.ndarray]:
+        """Read rows from the wrapped array, if there are any."""
+        self.rows_read += max(stop - start, 0)
+        if stop <= start:
+            return []
+        c0, c1 = self._cols
+        data = self._array[start:stop] if (c0, c1) == (0, self.shape[1]) \
+            else self._array[start:stop, c0:c1]
+        return [data]
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        row_key, col_key = key if isinstance(key, tuple) and \
+            len(key) == 2 else (key, slice(None))
+        if not (isinstance(row_key, slice) and isinstance(col_key, slice)):
+            return self._array[key]
+        cols = _key_range(col_key, self.shape[1])
+        if cols != self._cols:
+            self._cols = cols
+            self._rows = np.empty((0, cols[1] - cols[0]) + self.shape[2:],
+                                  dtype=self.dtype)
+        y0, y1 = _key_range(row_key, self.shape[0])
+        w0, w1 = self._start, self._start + self._rows.shape[0]
+        a, b = max(y0, w0), min(y1, w1)
+        if a < b:
+            self.rows_reused += b - a
+            data_list = self._read(y0, a) + [self._rows[a - w0:b - w0]] + \
+                self._read(b, y1)
+        else:
+            data_list = self._read(y0, y1)
+        data = data_list[0] if len(data_list) == 1 else \
+            np.concatenate(data_list, axis=0) if data_list else \
+            self._rows[0:0]
+        data.flags.writeable = False
+        self._start, self._rows = y0, data
+        return data
+
+
 class H5Features:
-    """Note unlike the array classes this isn't picklable."""
+    """Note unlike the array classes this isn't picklable.
+
+    If bands is provided only those bands are read, and the metadata is
+    restricted to match. If cache_mb is positive, reads go through an LRU
+    cache of decoded chunk tiles of about that size (see
+    `CachedFeatureArray`), split between the feature types by their size.
+
+    If resident rows are given they are decoded into shared memory (see
+    `ResidentFeatureArray`) and the files are closed. The object can then
+    be shared by forked worker processes, which may only read those rows.
 
-    def __init__(self, h5file: str) -> None:
+    If rolling, reads of whole rows reuse the rows of the previous read
+    (see `RollingFeatureArray`), for reading bands of rows in order.
+
+    Files imported with a mask of the pixels with data in any band give
+    it through `valid_rows`.
+    """
+
+    def __init__(self,
+                 h5file: str,
+                 bands: Optional[List[str]] = None,
+                 cache_mb: float = 0.,
+                 resident: Optional[FixedSlice] = None,
+                 rolling: bool = False
+                 ) -> None:
 
         self.continuous, self.categorical, self.coordinates = None, None, None
-        self.metadata = read_feature_metadata(h5file)
+        metadata = read_feature_metadata(h5file)
+        self.metadata = metadata.select(bands) if bands else metadata
         self._hfile = tables.open_file(h5file, "r")
-        if hasattr(self._hfile.root, "continuous_data"):
-            self.continuous = self._hfile.root.continuous_data
-            assert self.metadata.continuous is not None
-            self.continuous.missing = self.metadata.continuous.missing_value
-        if hasattr(self._hfile.root, "categorical_data"):
-            self.categorical = self._hfile.root.categorical_data
-            assert self.metadata.categorical is not None
-            self.categorical.missing = self.metadata.categorical.missing_value
+        self._shards = read_shards(self._hfile)
+        self._shard_files = [tables.open_file(sh.path, "r")
+                             for sh in self._shards]
+        self._valid: Any = getattr(self._hfile.root, "valid", None)
+        self._valid_start = 0
+        if self.metadata.continuous:
+            assert metadata.continuous is not None
+            self.continuous = self._feature_array(
+                "continuous_data",
+                self.metadata.continuous.missing_value,
+                _column_indices(metadata.continuous.columns,
+                                self.metadata.continuous.columns))
+        if self.metadata.categorical:
+            assert metadata.categorical is not None
+            self.categorical = self._feature_array(
+                "categorical_data",
+                self.metadata.categorical.missing_value,
+                _column_indices(metadata.categorical.columns,
+                                self.metadata.categorical.columns))
+        if resident is not None:
+            self._make_resident(resident)
+        elif cache_mb > 0:
+            self._add_caches(int(cache_mb * 1024 ** 2))
+        if rolling and resident is None:
+            if self.continuous:
+                self.continuous = RollingFeatureArray(self.continuous)
+            if self.categorical:
+                self.categorical = RollingFeatureArray(self.categorical)
         if self.continuous:
             self._n = len(self.continuous)
         if self.categorical:
@@ -114,4 +485,86 @@ class H5Features:
         return self._n
 
     def __del__(self) -> None:
+        self._close()
+
+    def _close(self) -> None:
+        """Close the feature file and any shard files."""
+        for f in self._shard_files:
+            f.close()
+        self._shard_files = []
         self._hfile.close()
+
+    def _make_resident(self, rows: FixedSlice) -> None:
+        """Decode rows of the feature arrays into shared memory."""
+        if self.continuous:
+            self.continuous = ResidentFeatureArray(self.continuous, rows)
+        if self.categorical:
+            self.categorical = ResidentFeatureArray(self.categorical, rows)
+        nbytes = sum(a._size * np.dtype(a.dtype).itemsize
+                     for a in (self.continuous, self.categorical) if a)
+        log.info("Decoded rows {} to {} of the features into {:.1f}MB "
+                 "of shared memory".format(rows.start, rows.stop,
+                                           nbytes / 1024 ** 2))
+        if self._valid is not None:
+            self._valid = self._valid[rows.start:rows.stop]
+            self._valid_start = rows.start
+        self._close()
+
+    def valid_rows(self, rows: FixedSlice) -> Optional[np.ndarray]:
+        """Get the (rows, width) mask of pixels with data, if there is one."""
+        if self._valid is None:
+            return None
+        start = rows.start - self._valid_start
+        valid = self._valid[start:start + rows.stop - rows.start]
+        return valid
+
+    def _add_caches(self, max_bytes: int) -> None:
+        """Read the feature arrays through tile caches sharing max_bytes."""
+        arrays = [a for a in (self.continuous, self.categorical) if a]
+        pixel_bytes = [a.shape[-1] * np.dtype(a.dtype).itemsize
+                       for a in arrays]
+        shares = [max_bytes * b // sum(pixel_bytes) for b in pixel_bytes]
+        caches = iter([CachedFeatureArray(a, k)
+                       for a, k in zip(arrays, shares)])
+        if self.continuous:
+            self.continuous = next(caches)
+        if self.categorical:
+            self.categorical = next(caches)
+
+    def log_cache_stats(self) -> None:
+        """Log the hits and misses of the tile caches, if there are any."""
+        for name in ("continuous", "categorical"):
+            array = getattr(self, name)
+            if isinstance(array, RollingFeatureArray):
+                log.info("{} row window: read {} rows, reused {}".format(
+                    name.capitalize(), array.rows_read, array.rows_reused))
+                array = array._array
+            if isinstance(array, CachedFeatureArray):
+                total = max(array.hits + array.misses, 1)
+                log.info("{} tile cache: {} hits, {} misses "
+                         "({:.1%} hit rate)".format(
+                             name.capitalize(), array.hits, array.misses,
+                             array.hits / total))
+
+    def _feature_array(self,
+                       name: str,
+                       missing: MissingType,
+                       columns: List[int]
+                       ) -> FeatureArray:
+        """Get the array of name, routing rows to shards if there are any."""
+        if not self._shards:
+            return FeatureArray(column_groups(self._hfile, name), missing,
+                                columns)
+        shard_arrays = [FeatureArray(column_groups(f, name), missing, columns)
+                        for f in self._shard_files]
+        array = ShardedFeatureArray(shard_arrays,
+                                    [sh.rows for sh in self._shards])
+        return array
+
+
+def _column_indices(all_columns: Iterable[str],
+                    columns: Iterable[str]
+                    ) -> List[int]:
+    """Find the indices of columns in all_columns."""
+    indices = [i for i, k in enumerate(all_columns) if k in columns]
+    return indices
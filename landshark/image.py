@@ -15,14 +15,12 @@
 # limitations under the License.
 
 import logging
-from itertools import product
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import numpy as np
 from affine import Affine
 from rasterio.transform import from_bounds
 
-from landshark import iteration
 from landshark.basetypes import CoordinateType, FixedSlice, IndexType
 
 log = logging.getLogger(__name__)
@@ -293,7 +291,7 @@ def strip_image_spec(strip: int,
     assert nstrips > 0
     assert strip >= 1 and strip <= nstrips
     # strips are indexed from one
-    strip_slice = _strip_slices(image_spec.height, nstrips)[strip - 1]
+    strip_slice = strip_slices(image_spec.height, nstrips)[strip - 1]
     # coordinates are of all pixel edges so need to go one past the end
     x_coords = image_spec.x_coordinates
     y_coords = image_spec.y_coordinates[
@@ -303,45 +301,192 @@ def strip_image_spec(strip: int,
     return new_spec
 
 
-def indices_strip(image_spec: ImageSpec,
-                  strip: int,
-                  nstrips: int,
-                  batchsize: int
-                  ) -> Tuple[Iterable[np.ndarray], int]:
+def _band_rows(batch_rows: int, chunk_rows: int) -> int:
+    """Get the largest multiple or divisor of chunk_rows in batch_rows."""
+    if batch_rows >= chunk_rows:
+        return batch_rows // chunk_rows * chunk_rows
+    rows = max(d for d in range(1, batch_rows + 1) if chunk_rows % d == 0)
+    return rows
+
+
+def row_bands(rows: FixedSlice,
+              width: int,
+              batchsize: int,
+              chunk_rows: int = 1
+              ) -> List[FixedSlice]:
+    """
+    Divide rows of an image window into whole-row query batches.
+
+    Batches hold about batchsize points (at least one row). Their
+    boundaries are multiples of a band height that is a multiple or a
+    divisor of the storage chunk rows, so consecutive batches read whole
+    chunks rather than splitting them between batches.
+
+    Parameters
+    ----------
+    rows : FixedSlice
+        The rows of the window.
+    width : int
+        The width of the window in pixels.
+    batchsize : int
+        The approximate number of points in each batch.
+    chunk_rows : int
+        The rows of the storage chunks of the features.
+
+    Returns
+    -------
+    bands : List[FixedSlice]
+        The image rows of each batch, in order.
+
+    """
+    assert batchsize > 0 and chunk_rows > 0
+    height = _band_rows(max(1, batchsize // width), chunk_rows)
+    first = -(-rows.start // height) * height
+    edges = np.unique(np.concatenate(
+        ([rows.start], np.arange(first, rows.stop, height), [rows.stop])))
+    bands = [FixedSlice(int(a), int(b)) for a, b in zip(edges[:-1], edges[1:])]
+    return bands
+
+
+def band_indices(rows: FixedSlice, cols: FixedSlice) -> np.ndarray:
+    """Get the x, y indices of every pixel in a window, in raster order."""
+    width = cols.stop - cols.start
+    y, x = np.divmod(np.arange((rows.stop - rows.start) * width), width)
+    indices = np.stack((x + cols.start, y + rows.start),
+                       axis=1).astype(IndexType)
+    return indices
+
+
+class ImageWindow(NamedTuple):
     """
-    Create an iterator over each row of a strip.
+    A rectangular window of an image to query.
+
+    If there is a footprint, only the pixels of the window it marks (such
+    as those inside a polygon) are queried.
+    """
+
+    rows: FixedSlice
+    cols: FixedSlice
+    footprint: Optional[np.ndarray] = None
+
+
+def _edge_overlap(edges: np.ndarray, low: float, high: float) -> FixedSlice:
+    """Get the pixels whose edges overlap the interval (low, high)."""
+    pixel_low = np.minimum(edges[:-1], edges[1:])
+    pixel_high = np.maximum(edges[:-1], edges[1:])
+    idx = np.flatnonzero(np.logical_and(pixel_low < high, pixel_high > low))
+    if idx.shape[0] == 0:
+        return FixedSlice(0, 0)
+    return FixedSlice(int(idx[0]), int(idx[-1]) + 1)
+
+
+def window_slices(image_spec: ImageSpec,
+                  bounds: Tuple[float, float, float, float]
+                  ) -> Tuple[FixedSlice, FixedSlice]:
+    """
+    Get the rows and columns of the pixels overlapping a bounding box.
 
     Parameters
     ----------
     image_spec : ImageSpec
         The imagespec of the full-sized image.
-    strip : int
-        The index of the strip. 1 <= strip <= nstrips.
-    nstrips : int
-        The total number of strips into which to divide the image.
-    batchsize : int
-        The (maximum) number of points in each batch from the iterator.
+    bounds : Tuple[float, float, float, float]
+        The xmin, ymin, xmax and ymax of the box in world coordinates.
 
     Returns
     -------
-    it : Iterator[np.ndarray, np.ndarray]
-        The indices of each batch as x, y arrays.
-    n_total : int
-        The total number of elements that the iterator passes over.
+    rows : FixedSlice
+        The rows of the pixels (empty if the box is outside the image).
+    cols : FixedSlice
+        The columns of the pixels.
 
     """
-    assert nstrips > 0
-    assert strip >= 1 and strip <= nstrips
-    assert batchsize > 0
-    slices = _strip_slices(image_spec.height, nstrips)
-    s = slices[strip - 1]   # indexed from one
-    n_total = (s.stop - s.start) * image_spec.width
-    it = _indices_query(image_spec.width, image_spec.height, batchsize,
-                        row_slice=s)
-    return it, n_total
+    xmin, ymin, xmax, ymax = bounds
+    rows = _edge_overlap(image_spec.y_coordinates, ymin, ymax)
+    cols = _edge_overlap(image_spec.x_coordinates, xmin, xmax)
+    return rows, cols
 
 
-def _strip_slices(total_size: int, nstrips: int) -> List[FixedSlice]:
+def window_image_spec(image_spec: ImageSpec,
+                      window: ImageWindow
+                      ) -> ImageSpec:
+    """Create an imagespec for a window of a larger image."""
+    # coordinates are of all pixel edges so need to go one past the end
+    x_coords = image_spec.x_coordinates[window.cols.start:
+                                        window.cols.stop + 1]
+    y_coords = image_spec.y_coordinates[window.rows.start:
+                                        window.rows.stop + 1]
+    new_spec = ImageSpec(x_coords, y_coords, image_spec.crs)
+    return new_spec
+
+
+def tile_slices(height: int,
+                width: int,
+                ntiles_y: int,
+                ntiles_x: int
+                ) -> List[Tuple[FixedSlice, FixedSlice]]:
+    """
+    Divide an image into a grid of tiles.
+
+    Parameters
+    ----------
+    height : int
+        The height of the image in pixels.
+    width : int
+        The width of the image in pixels.
+    ntiles_y : int
+        The number of rows of tiles.
+    ntiles_x : int
+        The number of columns of tiles.
+
+    Returns
+    -------
+    tiles : List[Tuple[FixedSlice, FixedSlice]]
+        The rows and columns of each tile, in row-major order.
+
+    """
+    tiles = [(r, c) for r in strip_slices(height, ntiles_y)
+             for c in strip_slices(width, ntiles_x)]
+    return tiles
+
+
+def tile_window(tile: int,
+                ntiles_y: int,
+                ntiles_x: int,
+                image_spec: ImageSpec
+                ) -> ImageWindow:
+    """
+    Get the window of an indexed tile of a larger image.
+
+    Parameters
+    ----------
+    tile : int
+        The index of the tile in row-major order.
+        1 <= tile <= ntiles_y * ntiles_x.
+    ntiles_y : int
+        The number of rows of tiles. Must be greater than 0.
+    ntiles_x : int
+        The number of columns of tiles. Must be greater than 0.
+    image_spec : ImageSpec
+        The imagespec of the full-sized image that is being divided.
+
+    Returns
+    -------
+    window : ImageWindow
+        The window of the tile.
+
+    """
+    assert ntiles_y > 0 and ntiles_x > 0
+    assert tile >= 1 and tile <= ntiles_y * ntiles_x
+    # tiles are indexed from one
+    rows, cols = tile_slices(image_spec.height, image_spec.width,
+                             ntiles_y, ntiles_x)[tile - 1]
+    window = ImageWindow(FixedSlice(int(rows.start), int(rows.stop)),
+                         FixedSlice(int(cols.start), int(cols.stop)))
+    return window
+
+
+def strip_slices(total_size: int, nstrips: int) -> List[FixedSlice]:
     """Compute the slices corresponding to every strip along a dimension."""
     assert nstrips > 0
     assert total_size >= nstrips
@@ -354,27 +499,42 @@ def _strip_slices(total_size: int, nstrips: int) -> List[FixedSlice]:
     return slices
 
 
-def _array_pair_it(x: Iterable[Any]) -> np.ndarray:
-    """Get the x and y coordinate arrays from the batch iterator."""
-    a = np.array(x)[:, ::-1]
-    return a
+def balanced_strip_slices(row_counts: np.ndarray,
+                          nstrips: int
+                          ) -> List[FixedSlice]:
+    """
+    Divide the rows of an image into strips holding equal work.
 
+    The work of a row is its number of valid pixels, so strips through
+    nodata (ocean, or outside a survey) get more rows than those through
+    data. Every strip has at least one row.
 
-def _indices_query(image_width: int,
-                   image_height: int,
-                   batchsize: int,
-                   column_slice: Optional[FixedSlice] = None,
-                   row_slice: Optional[FixedSlice] = None
-                   ) -> Iterable[np.ndarray]:
-    """Create a generator of batches of coordinates from an image."""
-    column_slice = column_slice if column_slice else FixedSlice(0, image_width)
-    row_slice = row_slice if row_slice else FixedSlice(0, image_height)
+    Parameters
+    ----------
+    row_counts : np.ndarray
+        The number of valid pixels in each row of the image.
+    nstrips : int
+        The number of strips. Must be greater than 0.
 
-    height_ind = np.arange(row_slice.start, row_slice.stop, dtype=IndexType)
-    width_ind = np.arange(column_slice.start, column_slice.stop,
-                          dtype=IndexType)
+    Returns
+    -------
+    slices : List[FixedSlice]
+        The rows of each strip, in order.
 
-    coords_it = product(height_ind, width_ind)
-    batch_it = iteration.batch(coords_it, batchsize)
-    array_it = map(_array_pair_it, batch_it)
-    return array_it
+    """
+    total_size = row_counts.shape[0]
+    assert nstrips > 0
+    assert total_size >= nstrips
+    work = np.cumsum(row_counts)
+    if work[-1] == 0:
+        return strip_slices(total_size, nstrips)
+    # cut after the row whose cumulative work first reaches each quantile
+    i = np.arange(1, nstrips)
+    cuts = np.searchsorted(work, work[-1] * i / nstrips, side="left") + 1
+    # keep at least one row in each strip
+    cuts = np.maximum.accumulate(cuts - i) + i
+    cuts = np.minimum(cuts, total_size - nstrips + i)
+    indices = np.concatenate(([0], cuts, [total_size]))
+    slices = [FixedSlice(int(a), int(b))
+              for a, b in zip(indices[:-1], indices[1:])]
+    return slices
@@ -17,6 +17,7 @@
 import os.path
 import pickle
 from collections import OrderedDict
+from copy import copy
 from typing import Any, Dict, List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
@@ -65,7 +66,8 @@ Feature = Union[CategoricalFeature, ContinuousFeature]
 class ContinuousFeatureSet:
 
     def __init__(self, labels: List[str], missing: ContinuousType,
-                 stats: Optional[Tuple[np.ndarray, np.ndarray]]) -> None:
+                 stats: Optional[Tuple[np.ndarray, np.ndarray]],
+                 dtype: np.dtype = ContinuousType) -> None:
 
         D = len(labels)
         if stats is None:
@@ -77,6 +79,7 @@ class ContinuousFeatureSet:
             means, sds = stats
 
         self._missing = missing
+        self._dtype = np.dtype(dtype)
         # hard-code that each feature has 1 band for now
         self._columns = OrderedDict([
             (l, ContinuousFeature(1, np.array([m]), np.array([v])))
@@ -92,16 +95,35 @@ class ContinuousFeatureSet:
     def missing_value(self) -> ContinuousType:
         return self._missing
 
+    @property
+    def dtype(self) -> np.dtype:
+        """Get the datatype the features are stored and serialised as."""
+        # Feature sets saved before compact storage have no dtype
+        return getattr(self, "_dtype", np.dtype(ContinuousType))
+
     def __len__(self) -> int:
         return self._n
 
+    def select(self, labels: List[str]) -> Optional["ContinuousFeatureSet"]:
+        """Get the feature set restricted to the given labels (or None)."""
+        columns = OrderedDict([(k, v) for k, v in self._columns.items()
+                               if k in labels])
+        if len(columns) == 0:
+            return None
+        new = copy(self)
+        new._columns = columns
+        new._n = len(columns)
+        return new
+
 
 class CategoricalFeatureSet:
 
     def __init__(self, labels: List[str], missing: CategoricalType,
                  nvalues: np.ndarray, mappings: List[np.ndarray],
-                 counts: np.ndarray) -> None:
+                 counts: np.ndarray,
+                 dtype: np.dtype = CategoricalType) -> None:
         self._missing = missing
+        self._dtype = np.dtype(dtype)
         # hard-code that each feature has 1 band for now
         self._columns = OrderedDict([
             (l, CategoricalFeature(n, 1, m, c))
@@ -117,9 +139,26 @@ class CategoricalFeatureSet:
     def missing_value(self) -> CategoricalType:
         return self._missing
 
+    @property
+    def dtype(self) -> np.dtype:
+        """Get the datatype the features are stored and serialised as."""
+        # Feature sets saved before compact storage have no dtype
+        return getattr(self, "_dtype", np.dtype(CategoricalType))
+
     def __len__(self) -> int:
         return self._n
 
+    def select(self, labels: List[str]) -> Optional["CategoricalFeatureSet"]:
+        """Get the feature set restricted to the given labels (or None)."""
+        columns = OrderedDict([(k, v) for k, v in self._columns.items()
+                               if k in labels])
+        if len(columns) == 0:
+            return None
+        new = copy(self)
+        new._columns = columns
+        new._n = len(columns)
+        return new
+
 
 class FeatureSet(PickleObj):
 
@@ -137,6 +176,26 @@ class FeatureSet(PickleObj):
     def __len__(self) -> int:
         return self._N
 
+    @property
+    def labels(self) -> List[str]:
+        """Get the labels of every continuous then categorical band."""
+        labels = []
+        if self.continuous:
+            labels.extend(self.continuous.columns.keys())
+        if self.categorical:
+            labels.extend(self.categorical.columns.keys())
+        return labels
+
+    def select(self, labels: List[str]) -> "FeatureSet":
+        """Get the feature set restricted to the bands with given labels."""
+        continuous = self.continuous.select(labels) \
+            if self.continuous else None
+        categorical = self.categorical.select(labels) \
+            if self.categorical else None
+        new = FeatureSet(continuous, categorical, self.image, self._N,
+                         self.halfwidth)
+        return new
+
 
 class CategoricalTarget(PickleObj):
 
@@ -68,6 +68,7 @@ class _Task(Process):
                     self.out_queue.put((task_id, out_data))
                 except queue.Empty:
                     pass
+            self.f.close()
 
 
 def task_list(task_list: List[Any],
@@ -93,6 +94,7 @@ def _task_list_0(task_list: List[Any],
                 output = worker(data)
                 yield output
                 pbar.update()
+    worker.close()
 
 
 def _task_list_multi(task_list: List[Any],
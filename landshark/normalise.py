@@ -15,37 +15,74 @@
 # limitations under the License.
 
 import logging
-from typing import Optional, Tuple
+from types import TracebackType
+from typing import List, Optional, Tuple
 
 import numpy as np
-from tqdm import tqdm
 
 from landshark import iteration
-from landshark.basetypes import ContinuousArraySource, ContinuousType, Worker
+from landshark.basetypes import (ContinuousArraySource, ContinuousType,
+                                 FixedSlice, Reader, Worker)
+from landshark.multiproc import task_list
+from landshark.quantile import QuantileSketch
 from landshark.util import to_masked
 
 log = logging.getLogger(__name__)
 
+# The interquartile range of a normal distribution in standard deviations
+IQR_PER_SD = 1.349
+
 
 class StatCounter:
-    """Class that computes online mean and variance."""
+    """Class that computes online mean and variance.
+
+    Counters for separate blocks of data can be merged, so blocks can be
+    summarised in parallel and then combined. If sketch is True a quantile
+    sketch of each feature is kept as well. The sketches are seeded by the
+    seed and the feature, so counters of separate blocks should be given
+    separate seeds for their random compactions to be independent.
+    """
 
-    def __init__(self, n_features: int) -> None:
+    def __init__(self,
+                 n_features: int,
+                 sketch: bool = False,
+                 seed: int = 0
+                 ) -> None:
         """Initialise the counters."""
         self._mean = np.zeros(n_features)
         self._m2 = np.zeros(n_features)
         self._n = np.zeros(n_features, dtype=int)
+        self._sketches = [QuantileSketch(seed=(seed, i))
+                          for i in range(n_features)] if sketch else None
 
     def update(self, array: np.ma.MaskedArray) -> None:
         """Update calclulations with new data."""
         assert array.ndim == 2
         assert array.shape[0] > 1
+        valid = ~np.ma.getmaskarray(array)
+        self._add_block(np.ma.getdata(array), valid)
 
-        new_n = np.ma.count(array, axis=0)
-        new_mean = (np.ma.mean(array, axis=0)).data
-        new_mean[new_n == 0] = 0.  # enforce this condition
-        new_m2 = (np.ma.var(array, axis=0, ddof=0) * new_n).data
+    def merge(self, other: "StatCounter") -> None:
+        """Update calculations with the data counted by another counter."""
+        self._combine(other._n, other._mean, other._m2)
+        if self._sketches is not None:
+            assert other._sketches is not None
+            for s, o in zip(self._sketches, other._sketches):
+                s.merge(o)
 
+    def _add_block(self, x: np.ndarray, valid: np.ndarray) -> None:
+        """Update calculations with the valid values of a 2D block."""
+        self._combine(*_block_stats(x, valid))
+        if self._sketches is not None:
+            for s, c, v in zip(self._sketches, x.T, valid.T):
+                s.update(c[v])
+
+    def _combine(self,
+                 new_n: np.ndarray,
+                 new_mean: np.ndarray,
+                 new_m2: np.ndarray
+                 ) -> None:
+        """Combine the statistics of a new block (Chan et al. 1979)."""
         add_n = new_n + self._n
         if any(add_n == 0):  # catch any totally masked images
             add_n[add_n == 0] = 1
@@ -76,39 +113,291 @@ class StatCounter:
         """Get the count of each feature."""
         return self._n
 
+    @property
+    def sketched(self) -> bool:
+        """Whether the counter keeps quantile sketches."""
+        return self._sketches is not None
+
+    def split(self) -> List["StatCounter"]:
+        """Split into a counter for each feature."""
+        counters = []
+        for i in range(self._n.shape[0]):
+            c = StatCounter(1)
+            c._mean, c._m2, c._n = (self._mean[i:i + 1], self._m2[i:i + 1],
+                                    self._n[i:i + 1])
+            if self._sketches is not None:
+                c._sketches = self._sketches[i:i + 1]
+            counters.append(c)
+        return counters
+
+    @staticmethod
+    def stack(counters: List["StatCounter"]) -> "StatCounter":
+        """Join counters of separate features (the inverse of split)."""
+        c = StatCounter(0)
+        c._mean = np.concatenate([k._mean for k in counters])
+        c._m2 = np.concatenate([k._m2 for k in counters])
+        c._n = np.concatenate([k._n for k in counters])
+        if all(k.sketched for k in counters):
+            c._sketches = [s for k in counters for s in k._sketches]
+        return c
+
+    def quantiles(self, q: List[float]) -> np.ndarray:
+        """Get estimated quantiles of each feature, shape (len(q), n)."""
+        assert self._sketches is not None
+        values = np.array([s.quantile(q) for s in self._sketches]).T
+        return values
+
+    @property
+    def median(self) -> np.ndarray:
+        """Get the estimated median of each feature."""
+        return self.quantiles([0.5])[0]
+
+    @property
+    def robust_sd(self) -> np.ndarray:
+        """Get the interquartile range scaled to match sd for normal data."""
+        q25, q75 = self.quantiles([0.25, 0.75])
+        sd = (q75 - q25) / IQR_PER_SD
+        return sd
+
+
+def _block_stats(x: np.ndarray,
+                 valid: np.ndarray
+                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Count, mean and sum of squared deviations of the valid x per column.
+
+    Uses plain reductions with invalid entries zeroed rather than masked
+    array operations, which are much slower.
+    """
+    n = np.sum(valid, axis=0)
+    total = np.sum(np.where(valid, x, 0), axis=0, dtype=np.float64)
+    mean = total / np.maximum(n, 1)  # 0 for totally masked columns
+    dev = np.where(valid, x - mean, 0)
+    m2 = np.sum(dev * dev, axis=0, dtype=np.float64)
+    return n, mean, m2
+
+
+class _OffsetReader(Reader):
+    """Read slices of a source along with the row at which they start."""
+
+    def __init__(self, src: ContinuousArraySource) -> None:
+        self._src = src
+
+    def __enter__(self) -> None:
+        self._src.__enter__()
+
+    def __exit__(self, ex_type: type, ex_val: Exception,
+                 ex_tb: TracebackType) -> None:
+        self._src.__exit__(ex_type, ex_val, ex_tb)
+
+    def __call__(self, s: FixedSlice) -> Tuple[int, np.ndarray]:
+        return s.start, self._src(s)
+
+
+class _StatsWorker(Worker):
+    """Summarise a block of continuous data with a StatCounter.
+
+    The sketches of each block are seeded by its starting row (plus one,
+    to differ from the counter the blocks are merged into).
+    """
+
+    def __init__(self,
+                 missing: Optional[ContinuousType],
+                 sketch: bool = False
+                 ) -> None:
+        self._missing = missing
+        self._sketch = sketch
+
+    def __call__(self, block: Tuple[int, np.ndarray]) -> StatCounter:
+        start, x = block
+        bs = x.reshape((-1, x.shape[-1]))
+        valid = bs != self._missing if self._missing is not None \
+            else np.ones(bs.shape, dtype=bool)
+        stats = StatCounter(bs.shape[-1], self._sketch, seed=start + 1)
+        stats._add_block(bs, valid)
+        return stats
+
 
 class Normaliser(Worker):
+    """Normalise data, optionally casting it to a compact storage dtype.
+
+    When casting, missing values are replaced by the smallest value of the
+    new dtype (see `storage_missing`), and normalised values beyond the
+    range of the new dtype are clipped to it with a warning rather than
+    becoming infinite. If clip bounds are given the data are first clipped
+    to them.
+    """
 
     def __init__(self,
                  mean: np.ndarray,
                  sd: np.ndarray,
-                 missing: Optional[ContinuousType]
+                 missing: Optional[ContinuousType],
+                 dtype: np.dtype = ContinuousType,
+                 clip: Optional[Tuple[np.ndarray, np.ndarray]] = None
                  ) -> None:
         self._mean = mean
         self._sd = sd
         self._missing = missing
+        self._dtype = dtype
+        self._clip = clip
 
     def __call__(self, x: np.ndarray) -> np.ndarray:
         xm = to_masked(x, self._missing)
+        if self._clip is not None:
+            lower, upper = self._clip
+            valid = ~np.ma.getmaskarray(xm)
+            np.maximum(xm.data, lower, out=xm.data, where=valid)
+            np.minimum(xm.data, upper, out=xm.data, where=valid)
         xm -= self._mean
         xm /= self._sd
-        return xm.data
+        if np.dtype(self._dtype) == xm.dtype:
+            return xm.data
+        _clip_to_dtype(xm, self._dtype)
+        missing = storage_missing(self._missing, self._dtype)
+        x_new = xm.filled(missing).astype(self._dtype)
+        return x_new
 
 
-def get_stats(src: ContinuousArraySource,
-              batchrows: int
-              ) -> Tuple[np.ndarray, np.ndarray]:
+def _clip_to_dtype(xm: np.ma.MaskedArray, dtype: np.dtype) -> None:
+    """Clip the valid values of xm in place to the finite range of dtype.
+
+    The lower bound is just above the smallest value of dtype, which marks
+    missing data in storage.
+    """
+    info = np.finfo(dtype)
+    lower = np.nextafter(np.array(info.min, dtype=dtype),
+                         np.array(0, dtype=dtype))
+    upper = info.max
+    valid = ~np.ma.getmaskarray(xm)
+    outside = valid & ((xm.data < lower) | (xm.data > upper))
+    n_outside = np.count_nonzero(outside)
+    if n_outside > 0:
+        log.warning("Clipping {} normalised values outside the range of "
+                    "{} to [{:.6g}, {:.6g}]".format(n_outside, info.dtype,
+                                                    lower, upper))
+        np.maximum(xm.data, lower, out=xm.data, where=valid)
+        np.minimum(xm.data, upper, out=xm.data, where=valid)
+
+
+def storage_missing(missing: Optional[ContinuousType],
+                    dtype: np.dtype
+                    ) -> Optional[ContinuousType]:
+    """Get the missing value for continuous data stored as dtype."""
+    if missing is None:
+        return None
+    new_missing = np.finfo(dtype).min
+    return new_missing
+
+
+def compute_stats(src: ContinuousArraySource,
+                  batchrows: int,
+                  n_workers: int = 0,
+                  sample: float = 1.0,
+                  seed: int = 0,
+                  sketch: bool = False
+                  ) -> StatCounter:
+    """
+    Compute statistics of each continuous band in one pass over the data.
+
+    Parameters
+    ----------
+    src : ContinuousArraySource
+        The source of the continuous data.
+    batchrows : int
+        The number of rows in each batch read from src.
+    n_workers : int
+        The number of additional worker processes.
+    sample : float
+        The fraction of the row batches to use. If less than 1, one batch
+        is picked at random from each of that many equal strata of rows,
+        and a 95% confidence bound on each mean is logged.
+    seed : int
+        The random seed used to pick the sampled batches.
+    sketch : bool
+        Whether to also keep quantile sketches of each band.
+
+    Returns
+    -------
+    stats : StatCounter
+        The merged statistics of every batch.
+
+    """
     log.info("Computing continuous feature statistics")
     n_rows = src.shape[0]
     n_cols = src.shape[-1]
-    stats = StatCounter(n_cols)
-    with tqdm(total=n_rows) as pbar:
-        with src:
-            for s in iteration.batch_slices(batchrows, n_rows):
-                x = src(s)
-                bs = x.reshape((-1, x.shape[-1]))
-                bm = to_masked(bs, src.missing)
-                stats.update(bm)
-                pbar.update(x.shape[0])
+    slices = list(iteration.batch_slices(batchrows, n_rows))
+    n_batches = len(slices)
+    if sample < 1.0:
+        slices = _stratified_sample(slices, sample, seed)
+        log.info("Sampling statistics from {} of {} row batches".format(
+            len(slices), n_batches))
+    worker = _StatsWorker(src.missing, sketch)
+    out_it = task_list(slices, _OffsetReader(src), worker, n_workers)
+    stats = StatCounter(n_cols, sketch)
+    block_counts, block_means = [], []
+    for block_stats in out_it:
+        stats.merge(block_stats)
+        block_counts.append(block_stats.count)
+        block_means.append(block_stats._mean)
+    if len(slices) < n_batches:
+        mean, sd = stats.mean, stats.sd
+        bound = _sample_bound(np.array(block_counts), np.array(block_means),
+                              mean, len(slices) / n_batches)
+        for c, m, s, b in zip(src.columns, mean, sd, bound):
+            log.info("{}: mean {:.6g} +/- {:.3g} (95% confidence), "
+                     "sd {:.6g}".format(c, m, b, s))
+    return stats
+
+
+def get_stats(src: ContinuousArraySource,
+              batchrows: int,
+              n_workers: int = 0,
+              sample: float = 1.0,
+              seed: int = 0
+              ) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute the mean and standard deviation of each continuous band.
+
+    See `compute_stats` for the parameters.
+    """
+    stats = compute_stats(src, batchrows, n_workers, sample, seed)
     mean, sd = stats.mean, stats.sd
     return mean, sd
+
+
+def _stratified_sample(slices: List[FixedSlice],
+                       fraction: float,
+                       seed: int
+                       ) -> List[FixedSlice]:
+    """Pick one slice at random from each of fraction * len(slices) strata.
+
+    At least two slices are picked (when there are two) so that the
+    sampling error can be estimated.
+    """
+    n = len(slices)
+    k = min(n, max(2, int(np.ceil(fraction * n))))
+    bounds = np.linspace(0, n, k + 1).astype(int)
+    rnd = np.random.RandomState(seed)
+    picks = [rnd.randint(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+    sample = [slices[i] for i in picks]
+    return sample
+
+
+def _sample_bound(counts: np.ndarray,
+                  means: np.ndarray,
+                  mean: np.ndarray,
+                  fraction: float
+                  ) -> np.ndarray:
+    """95% confidence bound on the mean estimated from sampled blocks.
+
+    Treats the blocks as clusters, so the bound reflects the spatial
+    correlation of pixels within a block. Uses the variance of the ratio
+    estimator with a finite population correction.
+    """
+    k = counts.shape[0]
+    if k < 2:
+        return np.full(mean.shape, np.inf)
+    nbar = np.maximum(np.mean(counts, axis=0), 1)
+    resid = counts * (means - mean)
+    var = (1. - fraction) * np.sum(resid ** 2, axis=0) / \
+        (k * (k - 1) * nbar ** 2)
+    bound = 1.96 * np.sqrt(var)
+    return bound
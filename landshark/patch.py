@@ -15,25 +15,26 @@
 # limitations under the License.
 
 import logging
-from typing import List, NamedTuple, Tuple
+from typing import NamedTuple
 
 import numpy as np
 
 log = logging.getLogger(__name__)
 
 
-class PatchRowRW(NamedTuple):
-    idx: int
-    x: slice
-    y: int
-    xp: slice
-    yp: int
+class PatchIndices(NamedTuple):
+    """
+    The image pixels covered by a set of square patches, as arrays.
 
+    Patch i covers image rows y[i] and image columns x[i], each an array of
+    the patch width. Rows and columns outside the image are included, with
+    y_valid and x_valid False.
+    """
 
-class PatchMaskRowRW(NamedTuple):
-    idx: int
-    xp: slice
-    yp: int
+    y: np.ndarray
+    x: np.ndarray
+    y_valid: np.ndarray
+    x_valid: np.ndarray
 
 
 def patches(x_coords: np.ndarray,
@@ -41,21 +42,13 @@ def patches(x_coords: np.ndarray,
             halfwidth: int,
             image_width: int,
             image_height: int
-            ) -> Tuple[List[PatchRowRW], List[PatchMaskRowRW]]:
+            ) -> PatchIndices:
     """
-    Generate the Read and write ops for patches given a set of coords.
-
-    This function describes read and write operations in terms of a single
-    index in y (row) followed by a contiguous slice in x. Patches are made
-    up of many of these structs (PatchRowRW) (1 for each row in the patch).
-    The output gives the read location in the image, and the write location
-    in the patch array.
-
-    The function also outputs the write operations for the image *mask*,
-    ie what writes should be done on a 'False' mask to turn missing values into
-    true. This is generally much more efficient that using the patch writes
-    to write false into a 'True' mask.
+    Plan the reads of patches centred on a set of pixels.
 
+    The plan holds the image row and column of every row and column of each
+    patch, and whether each is inside the image. Patches are assembled
+    from it with `gather`, and masked with `patch_mask`.
 
     Parameters
     ----------
@@ -76,9 +69,9 @@ def patches(x_coords: np.ndarray,
 
     Returns
     -------
-    result : Tuple[List[PatchRowRW], List[PatchMaskRowRW]]
-        The list of patch row read/writes and mask writes corresponding to
-        the patches requested.
+    result : PatchIndices
+        The (npatches, 2 * halfwidth + 1) arrays of rows and columns of the
+        patches, and their validity.
 
     """
     assert x_coords.shape[0] == y_coords.shape[0]
@@ -87,89 +80,57 @@ def patches(x_coords: np.ndarray,
     assert halfwidth >= 0
     assert image_width > 0
 
-    ncoords = x_coords.shape[0]
-    xmins = x_coords - halfwidth
-    ymins = y_coords - halfwidth
-    n = halfwidth * 2 + 1
-    xmaxs = xmins + n - 1  # INCLUSIVE
-
-    # What lines to read?
-    y_reads = (ymins[np.newaxis, :] + np.arange(n)[:, np.newaxis]).flatten()
-    patch_indices = np.tile(np.arange(ncoords), n)
-    order = np.lexsort((patch_indices, y_reads))
-
-    y_reads_sorted = y_reads[order]
-    patch_indices_sorted = patch_indices[order]
-
-    patch_rws = _patch_reads(n, y_reads_sorted, xmins, xmaxs, ymins,
-                             patch_indices_sorted, image_width, image_height)
-    mask_ws = _mask_patches(n, y_reads_sorted, xmins, xmaxs, ymins,
-                            patch_indices_sorted, image_width, image_height)
-    return patch_rws, mask_ws
-
-
-def _patch_reads(n: int,
-                 y_reads: np.ndarray,
-                 xmins: np.ndarray,
-                 xmaxs: np.ndarray,
-                 ymins: np.ndarray,
-                 patch_indices: np.ndarray,
-                 image_width: int,
-                 image_height: int
-                 ) -> List[PatchRowRW]:
-    """Compute the read and writes for the patches."""
-    y_mask = np.logical_and(y_reads >= 0, y_reads < image_height)
-
-    x_starts = np.maximum(xmins, 0)
-    x_stops = np.minimum(xmaxs + 1, image_width)
-
-    # patch space
-    y_patch_reads = y_reads - ymins[patch_indices]
-    x_patch_starts = x_starts - xmins
-    x_patch_stops = x_stops - xmins
-
-    patch_rw_list = []
-    for i, m, y, yp in zip(patch_indices, y_mask, y_reads, y_patch_reads):
-        if m:
-            r = PatchRowRW(i, slice(x_starts[i], x_stops[i]), y,
-                           slice(x_patch_starts[i], x_patch_stops[i]), yp)
-            patch_rw_list.append(r)
-    return patch_rw_list
-
-
-def _mask_patches(n: int,
-                  y_reads: np.ndarray,
-                  xmins: np.ndarray,
-                  xmaxs: np.ndarray,
-                  ymins: np.ndarray,
-                  patch_indices: np.ndarray,
-                  image_width: int,
-                  image_height: int
-                  ) -> List[PatchMaskRowRW]:
-    """Compute the inverse writes for the mask for the patches."""
-    # Inverse (mask) writes
-    inv_y_mask = np.logical_or(y_reads < 0, y_reads >= image_height)
-    x_premask = xmins < 0
-    x_postmask = xmaxs >= image_width
-    y_patch_reads = y_reads - ymins[patch_indices]
-
-    # There can be two x writes in general: pre- and post-image.
-    x_patch_prestarts = np.zeros_like(xmins, dtype=int)
-    x_patch_prestops = -1 * xmins
-    x_patch_poststarts = np.full(xmins.shape, image_width) - xmins
-    x_patch_poststops = (xmaxs + 1) - xmins
-
-    mask_w_list = []
-    for i, m, yp in zip(patch_indices, inv_y_mask, y_patch_reads):
-        if m:
-            mask_w_list.append(PatchMaskRowRW(i, slice(0, n), yp))
-        else:
-            if x_premask[i]:
-                mask_w_list.append(PatchMaskRowRW(i,
-                                   slice(x_patch_prestarts[i],
-                                         x_patch_prestops[i]), yp))
-            if x_postmask[i]:
-                mask_w_list.append(PatchMaskRowRW(i,
-                                   slice(x_patch_poststarts[i],
-                                         x_patch_poststops[i]), yp))
-    return mask_w_list
+    offsets = np.arange(-halfwidth, halfwidth + 1)
+    y = y_coords[:, np.newaxis] + offsets
+    x = x_coords[:, np.newaxis] + offsets
+    y_valid = np.logical_and(y >= 0, y < image_height)
+    x_valid = np.logical_and(x >= 0, x < image_width)
+    result = PatchIndices(y, x, y_valid, x_valid)
+    return result
+
+
+def patch_mask(p: PatchIndices) -> np.ndarray:
+    """Get the (npatches, n, n) mask of patch pixels outside the image."""
+    mask = ~np.logical_and(p.y_valid[:, :, np.newaxis],
+                           p.x_valid[:, np.newaxis, :])
+    return mask
+
+
+def patch_rows(p: PatchIndices) -> np.ndarray:
+    """Get the image rows read by the patches, sorted and unique."""
+    rows = np.unique(p.y[p.y_valid])
+    return rows
+
+
+def gather(p: PatchIndices,
+           block: np.ndarray,
+           block_rows: np.ndarray,
+           block_col: int = 0
+           ) -> np.ndarray:
+    """
+    Assemble patches from a block of image rows with one vectorised gather.
+
+    Parameters
+    ----------
+    p : PatchIndices
+        The patches to assemble.
+    block : np.ndarray
+        Image data holding every pixel of the patches inside the image,
+        shape (len(block_rows), ncols, ...).
+    block_rows : np.ndarray
+        The (sorted) image row of each row of block.
+    block_col : int
+        The image column of the first column of block.
+
+    Returns
+    -------
+    data : np.ndarray
+        The (npatches, n, n, ...) patches, zero outside the image.
+
+    """
+    rows = np.searchsorted(block_rows, p.y)
+    rows = np.minimum(rows, block.shape[0] - 1)
+    cols = np.clip(p.x - block_col, 0, block.shape[1] - 1)
+    data = block[rows[:, :, np.newaxis], cols[:, np.newaxis, :]]
+    data[patch_mask(p)] = 0
+    return data
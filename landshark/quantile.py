@@ -0,0 +1,122 @@
+"""Mergeable streaming quantile sketches."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles of a stream of values in bounded memory.
+
+    This is a KLL style sketch (Karnin, Lang and Liberty 2016). Values are
+    kept in a hierarchy of buffers where a value at level h stands for 2^h
+    of the original values. A full buffer is compacted by sorting it and
+    promoting every other value (from a random offset) to the next level.
+    Sketches of separate parts of a stream can be merged, so they can be
+    built in parallel.
+
+    Parameters
+    ----------
+    k : int
+        The capacity of the top buffer. The rank error of the quantiles is
+        roughly proportional to 1 / k.
+    seed : Optional[Union[int, Tuple[int, ...]]]
+        The random seed for choosing which values to promote. Sketches
+        that will be merged should have different seeds.
+
+    """
+
+    def __init__(self,
+                 k: int = 200,
+                 seed: Optional[Union[int, Tuple[int, ...]]] = None
+                 ) -> None:
+        """Initialise an empty sketch."""
+        self._k = k
+        self._levels: List[np.ndarray] = [np.empty(0)]
+        self._rnd = np.random.RandomState(seed)
+        self._n = 0
+
+    def __len__(self) -> int:
+        """Get the number of values added to the sketch."""
+        return self._n
+
+    def update(self, x: np.ndarray) -> None:
+        """Add the values in x to the sketch."""
+        x = np.ravel(x)
+        self._levels[0] = np.concatenate((self._levels[0], x))
+        self._n += x.shape[0]
+        self._compress()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add the values summarised by another sketch to this one."""
+        for h, buf in enumerate(other._levels):
+            if h == len(self._levels):
+                self._levels.append(np.empty(0))
+            self._levels[h] = np.concatenate((self._levels[h], buf))
+        self._n += other._n
+        self._compress()
+
+    def quantile(self, q: np.ndarray) -> np.ndarray:
+        """
+        Estimate quantiles of the values added to the sketch.
+
+        Parameters
+        ----------
+        q : np.ndarray
+            The quantiles to estimate, each between 0 and 1.
+
+        Returns
+        -------
+        values : np.ndarray
+            The estimated quantiles, NaN if the sketch is empty.
+
+        """
+        q = np.asarray(q, dtype=float)
+        if self._n == 0:
+            return np.full(q.shape, np.nan)
+        values = np.concatenate(self._levels)
+        weights = np.concatenate([np.full(buf.shape[0], 2. ** h)
+                                  for h, buf in enumerate(self._levels)])
+        order = np.argsort(values, kind="mergesort")
+        cum_weights = np.cumsum(weights[order])
+        idx = np.searchsorted(cum_weights, q * cum_weights[-1])
+        idx = np.minimum(idx, values.shape[0] - 1)
+        return values[order][idx]
+
+    def _capacity(self, h: int) -> int:
+        """Get the capacity of level h, decreasing geometrically down."""
+        depth = len(self._levels) - 1 - h
+        capacity = max(2, int(np.ceil(self._k * (2. / 3.) ** depth)))
+        return capacity
+
+    def _compress(self) -> None:
+        """Compact every buffer that is over capacity, from the bottom up."""
+        h = 0
+        while h < len(self._levels):
+            buf = self._levels[h]
+            if buf.shape[0] > self._capacity(h):
+                if h + 1 == len(self._levels):
+                    self._levels.append(np.empty(0))
+                buf = np.sort(buf)
+                n_even = buf.shape[0] - buf.shape[0] % 2
+                offset = self._rnd.randint(2)
+                promoted = buf[offset:n_even:2]
+                self._levels[h] = buf[n_even:]
+                self._levels[h + 1] = np.concatenate(
+                    (self._levels[h + 1], promoted))
+            h += 1
@@ -0,0 +1,150 @@
+"""Regions of interest for query extraction, from a box or polygons."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os.path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import shapefile
+from rasterio.features import rasterize
+
+from landshark import errors
+from landshark.image import (ImageSpec, ImageWindow, window_image_spec,
+                             window_slices)
+
+log = logging.getLogger(__name__)
+
+SHAPEFILE_EXTENSIONS = (".shp",)
+GEOJSON_EXTENSIONS = (".json", ".geojson")
+ROI_EXTENSIONS = SHAPEFILE_EXTENSIONS + GEOJSON_EXTENSIONS
+
+Bounds = Tuple[float, float, float, float]
+
+
+def _geojson_geometries(obj: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Get the geometries of a GeoJSON feature collection or feature."""
+    if obj["type"] == "FeatureCollection":
+        return [f["geometry"] for f in obj["features"] if f["geometry"]]
+    if obj["type"] == "Feature":
+        return [obj["geometry"]] if obj["geometry"] else []
+    return [obj]
+
+
+def read_roi(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the polygons of a region of interest.
+
+    Parameters
+    ----------
+    path : str
+        A shapefile or GeoJSON file, in the coordinates of the features.
+
+    Returns
+    -------
+    geometries : List[Dict[str, Any]]
+        The shapes as GeoJSON-like geometry dicts.
+
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in SHAPEFILE_EXTENSIONS:
+        with shapefile.Reader(path) as sf:
+            geometries = [s.__geo_interface__ for s in sf.iterShapes()]
+    elif ext in GEOJSON_EXTENSIONS:
+        with open(path) as f:
+            geometries = _geojson_geometries(json.load(f))
+    else:
+        raise errors.UnknownRoiFormat(path, ROI_EXTENSIONS)
+    log.info("Region of interest has {} shapes".format(len(geometries)))
+    return geometries
+
+
+def _vertices(coords: Any) -> List[Tuple[float, float]]:
+    """Get the (x, y) positions in nested GeoJSON coordinate lists."""
+    if len(coords) == 0:
+        return []
+    if not isinstance(coords[0], (list, tuple)):
+        return [(coords[0], coords[1])]
+    return [v for c in coords for v in _vertices(c)]
+
+
+def _geometry_vertices(geometry: Dict[str, Any]
+                       ) -> List[Tuple[float, float]]:
+    """Get every vertex of a geometry."""
+    if geometry["type"] == "GeometryCollection":
+        return [v for g in geometry["geometries"]
+                for v in _geometry_vertices(g)]
+    return _vertices(geometry["coordinates"])
+
+
+def roi_bounds(geometries: List[Dict[str, Any]]) -> Bounds:
+    """Get the xmin, ymin, xmax and ymax of a set of geometries."""
+    coords = np.array([v for g in geometries for v in _geometry_vertices(g)],
+                      dtype=np.float64)
+    xmin, ymin = coords.min(axis=0)
+    xmax, ymax = coords.max(axis=0)
+    return float(xmin), float(ymin), float(xmax), float(ymax)
+
+
+def query_window(image_spec: ImageSpec,
+                 bbox: Optional[Bounds] = None,
+                 roi: Optional[str] = None
+                 ) -> Tuple[ImageWindow, ImageSpec]:
+    """
+    Get the window of the features to query for a box or polygons.
+
+    A box queries every pixel it overlaps. Polygons query the pixels
+    whose centres they contain, within the window of their bounds.
+
+    Parameters
+    ----------
+    image_spec : ImageSpec
+        The imagespec of the features.
+    bbox : Optional[Bounds]
+        The xmin, ymin, xmax and ymax of a box in world coordinates.
+    roi : Optional[str]
+        A shapefile or GeoJSON file of polygons (one of bbox or roi must
+        be given).
+
+    Returns
+    -------
+    window : ImageWindow
+        The rows and columns of the window, with the polygons' footprint.
+    window_spec : ImageSpec
+        The imagespec of the window.
+
+    """
+    assert (bbox is None) != (roi is None)
+    geometries = read_roi(roi) if roi else []
+    if roi and not geometries:
+        raise errors.EmptyRoi(roi)
+    bounds = bbox if bbox else roi_bounds(geometries)
+    rows, cols = window_slices(image_spec, bounds)
+    if rows.stop <= rows.start or cols.stop <= cols.start:
+        raise errors.RoiOutsideImage(bounds)
+    window = ImageWindow(rows, cols)
+    window_spec = window_image_spec(image_spec, window)
+    if geometries:
+        footprint = rasterize([(g, 1) for g in geometries],
+                              out_shape=(window_spec.height,
+                                         window_spec.width),
+                              transform=window_spec.affine, fill=0,
+                              dtype=np.uint8).astype(bool)
+        window = ImageWindow(rows, cols, footprint)
+    log.info("Querying rows {} to {} and columns {} to {}".format(
+        rows.start, rows.stop, cols.start, cols.stop))
+    return window, window_spec
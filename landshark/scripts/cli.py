@@ -26,8 +26,9 @@ from landshark.model import predict as predict_fn
 from landshark.model import train_test
 from landshark.saver import overwrite_model_dir
 from landshark.scripts.logger import configure_logging
-from landshark.tfread import setup_query, setup_training
-from landshark.tifwrite import write_geotiffs
+from landshark.tfread import (query_valid_path, setup_query,
+                              setup_training)
+from landshark.tifwrite import target_outputs, write_geotiffs
 from landshark.util import mb_to_points
 
 log = logging.getLogger(__name__)
@@ -146,7 +147,9 @@ def predict_entrypoint(config: str, checkpoint: str, data: str,
     y_dash_it = predict_fn(checkpoint, sys.modules[cf], train_metadata,
                            query_records, params)
     write_geotiffs(y_dash_it, checkpoint, feature_metadata.image,
-                   tag="{}of{}".format(strip, nstrips))
+                   tag="{}of{}".format(strip, nstrips),
+                   valid_path=query_valid_path(data),
+                   outputs=target_outputs(train_metadata.targets))
 
 
 if __name__ == "__main__":
@@ -14,10 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import logging
 import os
 from multiprocessing import cpu_count
-from typing import NamedTuple, Tuple
+from typing import List, NamedTuple, Optional, Tuple
 
 import click
 
@@ -25,10 +26,14 @@ from landshark import __version__, errors
 from landshark import metadata as meta
 from landshark.dataprocess import (ProcessQueryArgs, ProcessTrainingArgs,
                                    write_querydata, write_trainingdata)
-from landshark.featurewrite import read_feature_metadata, read_target_metadata
+from landshark.basetypes import FixedSlice
+from landshark.featurewrite import (read_feature_metadata,
+                                    read_target_metadata, read_valid_counts)
 from landshark.hread import CategoricalH5ArraySource, ContinuousH5ArraySource
-from landshark.image import strip_image_spec
+from landshark.image import (ImageSpec, ImageWindow, balanced_strip_slices,
+                             strip_image_spec, tile_window, window_image_spec)
 from landshark.kfold import KFolds
+from landshark.roi import query_window
 from landshark.scripts.logger import configure_logging
 from landshark.util import mb_to_points
 
@@ -40,6 +45,8 @@ class CliArgs(NamedTuple):
 
     nworkers: int
     batchMB: float
+    cacheMB: float
+    resident: bool
 
 
 @click.group()
@@ -52,14 +59,22 @@ class CliArgs(NamedTuple):
 @click.option("--batch-mb", type=float, default=10,
               help="Approximate size in megabytes of data read per "
               "worker per iteration")
+@click.option("--cache-mb", type=float, default=100,
+              help="Approximate size in megabytes of the cache of decoded "
+              "feature tiles kept by each worker (0 to disable)")
+@click.option("--resident", is_flag=True,
+              help="Decode the features needed once into memory shared "
+              "by all workers. They must fit in RAM")
 @click.pass_context
 def cli(ctx: click.Context,
         verbosity: str,
         batch_mb: float,
-        nworkers: int
+        nworkers: int,
+        cache_mb: float,
+        resident: bool
         ) -> int:
     """Extract features and targets for training, testing and prediction."""
-    ctx.obj = CliArgs(nworkers, batch_mb)
+    ctx.obj = CliArgs(nworkers, batch_mb, cache_mb, resident)
     configure_logging(verbosity)
     return 0
 
@@ -79,6 +94,11 @@ def cli(ctx: click.Context,
 @click.option("--halfwidth", type=int, default=0,
               help="half width of patch size. Patch side length is "
               "2 x halfwidth + 1")
+@click.option("--include", type=str, multiple=True,
+              help="Only extract this band (can be given multiple times). "
+              "All bands are extracted if not given")
+@click.option("--exclude", type=str, multiple=True,
+              help="Do not extract this band (can be given multiple times)")
 @click.pass_context
 def traintest(ctx: click.Context,
               targets: str,
@@ -86,13 +106,17 @@ def traintest(ctx: click.Context,
               random_seed: int,
               name: str,
               features: str,
-              halfwidth: int
+              halfwidth: int,
+              include: Tuple[str, ...],
+              exclude: Tuple[str, ...]
               ) -> None:
     """Extract training and testing data to train and validate a model."""
     fold, nfolds = split
     catching_f = errors.catch_and_exit(traintest_entrypoint)
     catching_f(targets, fold, nfolds, random_seed, name, halfwidth,
-               ctx.obj.nworkers, features, ctx.obj.batchMB)
+               ctx.obj.nworkers, features, ctx.obj.batchMB,
+               list(include), list(exclude), ctx.obj.cacheMB,
+               ctx.obj.resident)
 
 
 def traintest_entrypoint(targets: str,
@@ -103,10 +127,17 @@ def traintest_entrypoint(targets: str,
                          halfwidth: int,
                          nworkers: int,
                          features: str,
-                         batchMB: float
+                         batchMB: float,
+                         include: Optional[List[str]] = None,
+                         exclude: Optional[List[str]] = None,
+                         cache_mb: float = 0.,
+                         resident: bool = False
                          ) -> None:
     """Get training data."""
     feature_metadata = read_feature_metadata(features)
+    bands = _select_bands(feature_metadata, include, exclude)
+    if bands:
+        feature_metadata = feature_metadata.select(bands)
     feature_metadata.halfwidth = halfwidth
     target_metadata = read_target_metadata(targets)
 
@@ -136,7 +167,10 @@ def traintest_entrypoint(targets: str,
                                folds=kfolds,
                                directory=directory,
                                batchsize=points_per_batch,
-                               nworkers=nworkers)
+                               nworkers=nworkers,
+                               bands=bands,
+                               cache_mb=cache_mb,
+                               resident=resident)
     write_trainingdata(args)
     training_metadata = meta.Training(targets=target_metadata,
                                       features=feature_metadata,
@@ -148,9 +182,21 @@ def traintest_entrypoint(targets: str,
 
 
 @cli.command()
-@click.option("--strip", type=int, nargs=2, default=(1, 1),
+@click.option("--strip", type=int, nargs=2, default=None,
               help="Horizontal strip of the image, eg --strip 3 5 is the "
               "third strip of 5")
+@click.option("--balance/--no-balance", is_flag=True, default=False,
+              help="Divide the image into strips holding equal numbers of "
+              "pixels with data, rather than equal numbers of rows")
+@click.option("--tile", type=int, nargs=3, default=None,
+              help="Tile of the image, eg --tile 3 2 4 is the third of "
+              "2 x 4 tiles, numbered along the rows")
+@click.option("--bbox", type=float, nargs=4, default=None,
+              help="Only query the box XMIN YMIN XMAX YMAX (in the "
+              "coordinates of the features)")
+@click.option("--roi", type=click.Path(exists=True),
+              help="Only query inside the polygons of a shapefile or "
+              "GeoJSON file (in the coordinates of the features)")
 @click.option("--name", type=str, required=True,
               help="The name of the output from this command.")
 @click.option("--features", type=click.Path(exists=True), required=True,
@@ -158,34 +204,68 @@ def traintest_entrypoint(targets: str,
 @click.option("--halfwidth", type=int, default=0,
               help="half width of patch size. Patch side length is "
               "2 x halfwidth + 1")
+@click.option("--include", type=str, multiple=True,
+              help="Only extract this band (can be given multiple times). "
+              "All bands are extracted if not given")
+@click.option("--exclude", type=str, multiple=True,
+              help="Do not extract this band (can be given multiple times)")
 @click.pass_context
 def query(ctx: click.Context,
-          strip: Tuple[int, int],
+          strip: Optional[Tuple[int, int]],
+          balance: bool,
+          tile: Optional[Tuple[int, int, int]],
+          bbox: Optional[Tuple[float, float, float, float]],
+          roi: Optional[str],
           name: str,
           features: str,
-          halfwidth: int
+          halfwidth: int,
+          include: Tuple[str, ...],
+          exclude: Tuple[str, ...]
           ) -> None:
     """Extract query data for making prediction images."""
     catching_f = errors.catch_and_exit(query_entrypoint)
     catching_f(features, ctx.obj.batchMB, ctx.obj.nworkers,
-               halfwidth, strip, name)
+               halfwidth, strip, name, list(include), list(exclude),
+               ctx.obj.cacheMB, ctx.obj.resident, bbox, roi, tile,
+               balance)
 
 
 def query_entrypoint(features: str,
                      batchMB: float,
                      nworkers: int,
                      halfwidth: int,
-                     strip: Tuple[int, int],
-                     name: str
+                     strip: Optional[Tuple[int, int]],
+                     name: str,
+                     include: Optional[List[str]] = None,
+                     exclude: Optional[List[str]] = None,
+                     cache_mb: float = 0.,
+                     resident: bool = False,
+                     bbox: Optional[Tuple[float, float, float, float]] = None,
+                     roi: Optional[str] = None,
+                     tile: Optional[Tuple[int, int, int]] = None,
+                     balance: bool = False
                      ) -> int:
-    """Entrypoint for extracting query data."""
-    strip_idx, totalstrips = strip
+    """Entrypoint for extracting query data.
+
+    The query is a strip (of equal rows, or if balanced of equal valid
+    pixels) or a tile of the image, or the window of a bounding box or of
+    the polygons of a region of interest (queried as its only strip).
+    """
+    if sum(bool(k) for k in (strip, tile, bbox, roi)) > 1:
+        raise errors.QueryRegionCount()
+    if balance and (tile or bbox or roi):
+        raise errors.BalanceWithoutStrips()
+    strip_idx, totalstrips = strip if strip else (1, 1)
+    if tile:
+        strip_idx, totalstrips = tile[0], tile[1] * tile[2]
     assert strip_idx > 0 and strip_idx <= totalstrips
 
     """Grab a chunk for prediction."""
     log.info("Using {} worker processes".format(nworkers))
 
-    dirname = "query_{}_strip{}of{}".format(name, strip_idx, totalstrips)
+    part = "tile" if tile else "balanced_strip" if balance else "strip"
+    dirname = "query_{}{}_{}{}of{}".format(
+        name, _region_name(bbox, roi), part, strip_idx, totalstrips)
     directory = os.path.join(os.getcwd(), dirname)
     try:
         os.makedirs(directory)
@@ -193,6 +273,9 @@ def query_entrypoint(features: str,
         pass
 
     feature_metadata = read_feature_metadata(features)
+    bands = _select_bands(feature_metadata, include, exclude)
+    if bands:
+        feature_metadata = feature_metadata.select(bands)
     feature_metadata.halfwidth = halfwidth
     ndim_con = len(feature_metadata.continuous.columns) \
         if feature_metadata.continuous else 0
@@ -201,13 +284,25 @@ def query_entrypoint(features: str,
     points_per_batch = mb_to_points(batchMB, ndim_con, ndim_cat,
                                     halfwidth=halfwidth)
 
-    strip_imspec = strip_image_spec(strip_idx, totalstrips,
-                                    feature_metadata.image)
+    window = None
+    if bbox or roi:
+        window, _ = query_window(feature_metadata.image, bbox, roi)
+    elif tile:
+        window = tile_window(tile[0], tile[1], tile[2], feature_metadata.image)
+    elif balance:
+        window = _balanced_strip(features, strip_idx, totalstrips,
+                                 feature_metadata.image)
+    if window is not None:
+        strip_imspec = window_image_spec(feature_metadata.image, window)
+    else:
+        strip_imspec = strip_image_spec(strip_idx, totalstrips,
+                                        feature_metadata.image)
     tag = "query.{}of{}".format(strip_idx, totalstrips)
 
     qargs = ProcessQueryArgs(name, features, feature_metadata.image,
                              strip_idx, totalstrips, strip_imspec, halfwidth,
-                             directory, points_per_batch, nworkers, tag)
+                             directory, points_per_batch, nworkers, tag,
+                             bands, cache_mb, resident, window)
 
     write_querydata(qargs)
     feature_metadata.image = strip_imspec
@@ -216,5 +311,69 @@ def query_entrypoint(features: str,
     return 0
 
 
+def _region_name(bbox: Optional[Tuple[float, float, float, float]],
+                 roi: Optional[str]
+                 ) -> str:
+    """Get the part of a query directory name naming its region, if any.
+
+    A region of interest is named by its file, and a bounding box by a
+    short hash of its bounds, so different regions don't share a
+    directory.
+    """
+    if roi:
+        stem = os.path.splitext(os.path.basename(roi))[0]
+        return "_roi_{}".format(stem)
+    if bbox:
+        bounds = ",".join(repr(float(b)) for b in bbox)
+        digest = hashlib.sha1(bounds.encode()).hexdigest()[:8]
+        return "_bbox_{}".format(digest)
+    return ""
+
+
+def _balanced_strip(features: str,
+                    strip: int,
+                    nstrips: int,
+                    image_spec: ImageSpec
+                    ) -> Optional[ImageWindow]:
+    """
+    Get the window of a strip holding an equal share of the valid pixels.
+
+    The strip is cut from the valid pixel counts of each row written at
+    import. Returns None (for strips of equal rows) if there are none.
+    """
+    counts = read_valid_counts(features)
+    if counts is None:
+        log.warning("Feature file has no valid pixel counts, so the strips "
+                    "hold equal numbers of rows")
+        return None
+    rows = balanced_strip_slices(counts, nstrips)[strip - 1]
+    log.info("Balanced strip {} of {} holds rows {} to {} with {} of {} "
+             "valid pixels".format(strip, nstrips, rows.start, rows.stop,
+                                   counts[rows.start:rows.stop].sum(),
+                                   counts.sum()))
+    window = ImageWindow(rows, FixedSlice(0, image_spec.width))
+    return window
+
+
+def _select_bands(feature_metadata: meta.FeatureSet,
+                  include: Optional[List[str]],
+                  exclude: Optional[List[str]]
+                  ) -> Optional[List[str]]:
+    """Get the bands to extract, or None if extracting all of them."""
+    if not (include or exclude):
+        return None
+    labels = feature_metadata.labels
+    unknown = [k for k in (include or []) + (exclude or [])
+               if k not in labels]
+    if unknown:
+        raise errors.UnknownBands(unknown)
+    bands = [k for k in labels if (not include or k in include) and
+             k not in (exclude or [])]
+    if not bands:
+        raise errors.NoBandsSelected()
+    log.info("Extracting {} of {} bands".format(len(bands), len(labels)))
+    return bands
+
+
 if __name__ == "__main__":
     cli()
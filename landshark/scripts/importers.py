@@ -17,7 +17,8 @@
 import logging
 import os.path
 from multiprocessing import cpu_count
-from typing import List, NamedTuple, Tuple
+from tempfile import TemporaryDirectory
+from typing import List, NamedTuple, Optional, Tuple
 
 import click
 import numpy as np
@@ -25,16 +26,25 @@ import tables
 
 from landshark import __version__, errors
 from landshark import metadata as meta
-from landshark.category import get_maps
-from landshark.featurewrite import (write_categorical, write_continuous,
-                                    write_coordinates, write_feature_metadata,
-                                    write_target_metadata)
+from landshark.basetypes import ContinuousType
+from landshark.category import compact_dtype, get_maps, mapped_missing
+from landshark.featurewrite import (append_feature_metadata, column_groups,
+                                    read_feature_metadata, write_categorical,
+                                    write_continuous, write_coordinates,
+                                    write_feature_metadata,
+                                    write_shard_index, write_target_metadata)
 from landshark.fileio import tifnames
-from landshark.normalise import get_stats
+from landshark.image import ImageSpec
+from landshark.normalise import compute_stats, get_stats, storage_missing
 from landshark.scripts.logger import configure_logging
 from landshark.shpread import (CategoricalShpArraySource,
                                ContinuousShpArraySource,
                                CoordinateShpArraySource)
+from landshark.shuffle import bucket_shuffle
+from landshark.statscache import StatsCache, cached_maps, cached_stats
+from landshark.tableread import (CategoricalTableArraySource,
+                                 ContinuousTableArraySource,
+                                 CoordinateTableArraySource)
 from landshark.tifread import (CategoricalStackSource, ContinuousStackSource,
                                shared_image_spec)
 from landshark.util import mb_to_points, mb_to_rows
@@ -83,13 +93,49 @@ def cli(ctx: click.Context,
               help="Name of output file")
 @click.option("--ignore-crs/--no-ignore-crs", is_flag=True, default=False,
               help="Ignore CRS (projection and datum) information")
+@click.option("--bands-per-group", type=click.IntRange(0, None), default=0,
+              help="Store bands in column groups of at most this many bands "
+              "so extraction can read a subset of bands. 0 puts all bands "
+              "of a type in one group")
+@click.option("--continuous-dtype", type=click.Choice(["float32", "float16"]),
+              default="float32", help="Storage type of the continuous "
+              "bands. float16 halves storage and extraction I/O but "
+              "requires normalisation")
+@click.option("--shards", type=click.IntRange(1, None), default=1,
+              help="Split the feature data by rows into this many shard "
+              "files next to a small index file, spreading I/O across "
+              "parallel filesystem targets")
+@click.option("--stats-sample", type=float, default=1.0,
+              help="Fraction (0, 1] of row batches from which to estimate "
+              "the normalisation statistics, sampled across the image. "
+              "1 uses every pixel")
+@click.option("--robust/--no-robust", is_flag=True, default=False,
+              help="Normalise continuous bands by their median and "
+              "interquartile range rather than mean and standard deviation")
+@click.option("--clip-percentile", type=float, default=0.,
+              help="Clip normalised continuous bands to this percentile and "
+              "its complement, e.g. 1 clips to the 1st and 99th percentiles")
+@click.option("--stats-cache", type=click.Path(dir_okay=False),
+              default=None, help="File in which to cache band statistics "
+              "and categories, so unchanged tifs are not analysed again")
+@click.option("--stats-cache-hash/--no-stats-cache-hash", is_flag=True,
+              default=False, help="Identify unchanged tifs in the stats "
+              "cache by a hash of their contents rather than mtime")
 @click.pass_context
 def tifs(ctx: click.Context,
          categorical: Tuple[str, ...],
          continuous: Tuple[str, ...],
          normalise: bool,
          name: str,
-         ignore_crs: bool
+         ignore_crs: bool,
+         bands_per_group: int,
+         continuous_dtype: str,
+         shards: int,
+         stats_sample: float,
+         robust: bool,
+         clip_percentile: float,
+         stats_cache: Optional[str],
+         stats_cache_hash: bool
          ) -> None:
     """Build a tif stack from a set of input files."""
     nworkers = ctx.obj.nworkers
@@ -98,7 +144,9 @@ def tifs(ctx: click.Context,
     con_list = list(continuous)
     catching_f = errors.catch_and_exit(tifs_entrypoint)
     catching_f(nworkers, batchMB, cat_list,
-               con_list, normalise, name, ignore_crs)
+               con_list, normalise, name, ignore_crs, bands_per_group,
+               np.dtype(continuous_dtype), shards, stats_sample, robust,
+               clip_percentile, stats_cache, stats_cache_hash)
 
 
 def tifs_entrypoint(nworkers: int,
@@ -107,9 +155,21 @@ def tifs_entrypoint(nworkers: int,
                     continuous: List[str],
                     normalise: bool,
                     name: str,
-                    ignore_crs: bool
+                    ignore_crs: bool,
+                    bands_per_group: int = 0,
+                    continuous_dtype: np.dtype = ContinuousType,
+                    shards: int = 1,
+                    stats_sample: float = 1.0,
+                    robust: bool = False,
+                    clip_percentile: float = 0.,
+                    stats_cache: Optional[str] = None,
+                    stats_cache_hash: bool = False
                     ) -> None:
     """Entrypoint for tifs without click cruft."""
+    if not 0. < stats_sample <= 1.:
+        raise errors.InvalidFraction("stats-sample", stats_sample)
+    if not 0. <= clip_percentile < 50.:
+        raise errors.InvalidClipPercentile(clip_percentile)
     out_filename = os.path.join(os.getcwd(), "features_{}.hdf5".format(name))
 
     con_filenames = tifnames(continuous)
@@ -125,30 +185,26 @@ def tifs_entrypoint(nworkers: int,
     N_con, N_cat = None, None
     con_meta, cat_meta = None, None
     spec = shared_image_spec(all_filenames, ignore_crs)
+    if shards > spec.height:
+        raise errors.TooManyShards(shards, spec.height)
+    cache = StatsCache(stats_cache, stats_cache_hash) if stats_cache \
+        else None
 
     with tables.open_file(out_filename, mode="w", title=name) as outfile:
+        if shards > 1:
+            write_shard_index(outfile, spec.height, shards)
         if has_con:
             con_source = ContinuousStackSource(spec, con_filenames)
-            ndims_con = con_source.shape[-1]
-            con_rows_per_batch = mb_to_rows(batchMB, spec.width, ndims_con, 0)
             N_con = con_source.shape[0] * con_source.shape[1]
             N = N_con
-            log.info("Continuous missing value set to {}".format(
-                con_source.missing))
-            stats = None
-            if normalise:
-                stats = get_stats(con_source, con_rows_per_batch)
-                sd = stats[1]
-                if any(sd == 0.0):
-                    raise errors.ZeroDeviation(sd, con_source.columns)
-                log.info("Writing normalised continuous data to output file")
-            else:
-                log.info("Writing unnormalised continuous data to output file")
-            con_meta = meta.ContinuousFeatureSet(labels=con_source.columns,
-                                                 missing=con_source.missing,
-                                                 stats=stats)
-            write_continuous(con_source, outfile, nworkers, con_rows_per_batch,
-                             stats)
+            con_meta = _import_continuous(con_source, outfile, nworkers,
+                                          batchMB, normalise,
+                                          bands_per_group=bands_per_group,
+                                          dtype=continuous_dtype,
+                                          stats_sample=stats_sample,
+                                          robust=robust,
+                                          clip_percentile=clip_percentile,
+                                          cache=cache)
 
         if has_cat:
             cat_source = CategoricalStackSource(spec, cat_filenames)
@@ -156,33 +212,272 @@ def tifs_entrypoint(nworkers: int,
             N = N_cat
             if N_con and N_cat != N_con:
                 raise errors.ConCatNMismatch(N_con, N_cat)
-
-            ndims_cat = cat_source.shape[-1]
-            cat_rows_per_batch = mb_to_rows(batchMB, spec.width, 0, ndims_cat)
-            log.info("Categorical missing value set to {}".format(
-                cat_source.missing))
-            catdata = get_maps(cat_source, cat_rows_per_batch)
-            maps, counts = catdata.mappings, catdata.counts
-            ncats = np.array([len(m) for m in maps])
-            log.info("Writing mapped categorical data to output file")
-            cat_meta = meta.CategoricalFeatureSet(labels=cat_source.columns,
-                                                  missing=cat_source.missing,
-                                                  nvalues=ncats,
-                                                  mappings=maps,
-                                                  counts=counts)
-            write_categorical(cat_source, outfile, nworkers,
-                              cat_rows_per_batch, maps)
+            cat_meta = _import_categorical(cat_source, outfile, nworkers,
+                                           batchMB,
+                                           bands_per_group=bands_per_group,
+                                           cache=cache)
         m = meta.FeatureSet(continuous=con_meta, categorical=cat_meta,
                             image=spec, N=N, halfwidth=0)
         write_feature_metadata(m, outfile)
     log.info("Tif import complete")
 
 
+def _import_continuous(con_source: ContinuousStackSource,
+                       outfile: tables.File,
+                       nworkers: int,
+                       batchMB: float,
+                       normalise: bool,
+                       group: int = 0,
+                       bands_per_group: int = 0,
+                       dtype: np.dtype = ContinuousType,
+                       stats_sample: float = 1.0,
+                       robust: bool = False,
+                       clip_percentile: float = 0.,
+                       cache: Optional[StatsCache] = None
+                       ) -> meta.ContinuousFeatureSet:
+    """Compute statistics for and write a stack of continuous bands.
+
+    If robust, the stored means and sds are the medians and interquartile
+    ranges (scaled to match sd for normal data) used for normalisation.
+    Statistics are taken from cache where possible unless sampling.
+    """
+    if not normalise and np.dtype(dtype) != ContinuousType:
+        raise errors.UnnormalisedCompactType()
+    ndims_con = con_source.shape[-1]
+    con_rows_per_batch = mb_to_rows(batchMB, con_source.shape[1],
+                                    ndims_con, 0)
+    log.info("Continuous missing value set to {}".format(
+        con_source.missing))
+    stats, clip = None, None
+    if normalise:
+        sketch = robust or clip_percentile > 0.
+        if cache is not None and stats_sample == 1.:
+            counter = cached_stats(cache, con_source, con_rows_per_batch,
+                                   nworkers, sketch)
+        else:
+            counter = compute_stats(con_source, con_rows_per_batch,
+                                    nworkers, stats_sample, sketch=sketch)
+        stats = (counter.median, counter.robust_sd) if robust \
+            else (counter.mean, counter.sd)
+        if clip_percentile > 0.:
+            q = clip_percentile / 100.
+            lower, upper = counter.quantiles([q, 1. - q])
+            clip = (lower, upper)
+            log.info("Clipping continuous bands to [{}, {}]".format(
+                lower, upper))
+        sd = stats[1]
+        if any(sd == 0.0):
+            raise errors.ZeroDeviation(sd, con_source.columns)
+        log.info("Writing normalised continuous data to output file")
+    else:
+        log.info("Writing unnormalised continuous data to output file")
+    con_meta = meta.ContinuousFeatureSet(
+        labels=con_source.columns,
+        missing=storage_missing(con_source.missing, dtype),
+        stats=stats,
+        dtype=dtype)
+    write_continuous(con_source, outfile, nworkers, con_rows_per_batch,
+                     stats, group, bands_per_group, dtype, clip)
+    return con_meta
+
+
+def _import_categorical(cat_source: CategoricalStackSource,
+                        outfile: tables.File,
+                        nworkers: int,
+                        batchMB: float,
+                        group: int = 0,
+                        bands_per_group: int = 0,
+                        dtype: Optional[np.dtype] = None,
+                        cache: Optional[StatsCache] = None
+                        ) -> meta.CategoricalFeatureSet:
+    """Compute category mappings for and write a stack of categorical bands.
+
+    The bands are stored in dtype if given, or otherwise the smallest type
+    that can hold the mapped categories.
+    """
+    ndims_cat = cat_source.shape[-1]
+    cat_rows_per_batch = mb_to_rows(batchMB, cat_source.shape[1],
+                                    0, ndims_cat)
+    log.info("Categorical missing value set to {}".format(
+        cat_source.missing))
+    catdata = cached_maps(cache, cat_source, cat_rows_per_batch, nworkers) \
+        if cache else get_maps(cat_source, cat_rows_per_batch, nworkers)
+    maps, counts = catdata.mappings, catdata.counts
+    ncats = np.array([len(m) for m in maps])
+    if dtype is None:
+        dtype = compact_dtype(ncats)
+    elif compact_dtype(ncats).itemsize > np.dtype(dtype).itemsize:
+        raise errors.CategoricalTypeOverflow(np.amax(ncats), dtype)
+    log.info("Writing mapped categorical data to output file as {}".format(
+        np.dtype(dtype)))
+    cat_meta = meta.CategoricalFeatureSet(
+        labels=cat_source.columns,
+        missing=mapped_missing(cat_source.missing, dtype),
+        nvalues=ncats,
+        mappings=maps,
+        counts=counts,
+        dtype=dtype)
+    write_categorical(cat_source, outfile, nworkers, cat_rows_per_batch,
+                      maps, group, bands_per_group, dtype)
+    return cat_meta
+
+
+@cli.command("add-bands")
+@click.option("--features", type=click.Path(exists=True), required=True,
+              help="Feature HDF5 file to which to add the bands")
+@click.option("--categorical", type=click.Path(exists=True), multiple=True,
+              help="Directory containing categorical geotifs")
+@click.option("--continuous", type=click.Path(exists=True), multiple=True,
+              help="Directory containing continuous geotifs")
+@click.option("--normalise/--no-normalise", is_flag=True, default=True,
+              help="Normalise the continuous tif bands. Only used if the "
+              "feature file has no continuous bands, otherwise new bands "
+              "follow the existing ones")
+@click.option("--ignore-crs/--no-ignore-crs", is_flag=True, default=False,
+              help="Ignore CRS (projection and datum) information")
+@click.option("--bands-per-group", type=click.IntRange(0, None), default=0,
+              help="Store the new bands in column groups of at most this "
+              "many bands. 0 puts all new bands of a type in one group")
+@click.option("--robust/--no-robust", is_flag=True, default=False,
+              help="Normalise new continuous bands by their median and "
+              "interquartile range rather than mean and standard deviation")
+@click.option("--clip-percentile", type=float, default=0.,
+              help="Clip new normalised continuous bands to this percentile "
+              "and its complement")
+@click.option("--stats-cache", type=click.Path(dir_okay=False),
+              default=None, help="File in which to cache band statistics "
+              "and categories, so unchanged tifs are not analysed again")
+@click.option("--stats-cache-hash/--no-stats-cache-hash", is_flag=True,
+              default=False, help="Identify unchanged tifs in the stats "
+              "cache by a hash of their contents rather than mtime")
+@click.pass_context
+def add_bands(ctx: click.Context,
+              features: str,
+              categorical: Tuple[str, ...],
+              continuous: Tuple[str, ...],
+              normalise: bool,
+              ignore_crs: bool,
+              bands_per_group: int,
+              robust: bool,
+              clip_percentile: float,
+              stats_cache: Optional[str],
+              stats_cache_hash: bool
+              ) -> None:
+    """Add tif bands to an existing feature file."""
+    nworkers = ctx.obj.nworkers
+    batchMB = ctx.obj.batchMB
+    cat_list = list(categorical)
+    con_list = list(continuous)
+    catching_f = errors.catch_and_exit(add_bands_entrypoint)
+    catching_f(nworkers, batchMB, features, cat_list, con_list, normalise,
+               ignore_crs, bands_per_group, robust, clip_percentile,
+               stats_cache, stats_cache_hash)
+
+
+def add_bands_entrypoint(nworkers: int,
+                         batchMB: float,
+                         features: str,
+                         categorical: List[str],
+                         continuous: List[str],
+                         normalise: bool,
+                         ignore_crs: bool,
+                         bands_per_group: int = 0,
+                         robust: bool = False,
+                         clip_percentile: float = 0.,
+                         stats_cache: Optional[str] = None,
+                         stats_cache_hash: bool = False
+                         ) -> None:
+    """Entrypoint for add-bands without click cruft."""
+    if not 0. <= clip_percentile < 50.:
+        raise errors.InvalidClipPercentile(clip_percentile)
+    cache = StatsCache(stats_cache, stats_cache_hash) if stats_cache \
+        else None
+    con_filenames = tifnames(continuous)
+    cat_filenames = tifnames(categorical)
+    log.info("Found {} continuous TIF files".format(len(con_filenames)))
+    log.info("Found {} categorical TIF files".format(len(cat_filenames)))
+    all_filenames = con_filenames + cat_filenames
+    if not len(all_filenames) > 0:
+        raise errors.NoTifFilesFound()
+
+    stored = read_feature_metadata(features)
+    spec = shared_image_spec(all_filenames, ignore_crs)
+    _check_image_spec(features, spec, stored.image, ignore_crs)
+
+    con_meta, cat_meta = None, None
+    with tables.open_file(features, mode="a") as outfile:
+        if len(con_filenames) > 0:
+            con_source = ContinuousStackSource(spec, con_filenames)
+            _check_new_bands(features, con_source.columns, stored)
+            dtype = ContinuousType
+            if stored.continuous:
+                normalise = stored.continuous.normalised
+                dtype = stored.continuous.dtype
+            group = len(column_groups(outfile, "continuous_data"))
+            con_meta = _import_continuous(con_source, outfile, nworkers,
+                                          batchMB, normalise, group,
+                                          bands_per_group, dtype,
+                                          robust=robust,
+                                          clip_percentile=clip_percentile,
+                                          cache=cache)
+        if len(cat_filenames) > 0:
+            cat_source = CategoricalStackSource(spec, cat_filenames)
+            _check_new_bands(features, cat_source.columns, stored)
+            cat_dtype = stored.categorical.dtype \
+                if stored.categorical else None
+            group = len(column_groups(outfile, "categorical_data"))
+            cat_meta = _import_categorical(cat_source, outfile, nworkers,
+                                           batchMB, group, bands_per_group,
+                                           cat_dtype, cache)
+        m = meta.FeatureSet(continuous=con_meta, categorical=cat_meta,
+                            image=stored.image, N=len(stored),
+                            halfwidth=stored.halfwidth)
+        append_feature_metadata(m, outfile)
+    log.info("Added bands to {}".format(features))
+
+
+def _check_image_spec(path: str,
+                      spec: ImageSpec,
+                      stored: ImageSpec,
+                      ignore_crs: bool
+                      ) -> None:
+    """Make sure new tifs cover exactly the image of a feature file."""
+    if (spec.width, spec.height) != (stored.width, stored.height):
+        raise errors.ImageSpecMismatch(path, "shape")
+    if not (np.allclose(spec.x_coordinates, stored.x_coordinates) and
+            np.allclose(spec.y_coordinates, stored.y_coordinates)):
+        raise errors.ImageSpecMismatch(path, "coordinates")
+    if not ignore_crs and spec.crs != stored.crs:
+        raise errors.ImageSpecMismatch(path, "crs")
+
+
+def _check_new_bands(path: str,
+                     columns: List[str],
+                     stored: meta.FeatureSet
+                     ) -> None:
+    """Make sure none of the new bands are already in a feature file."""
+    existing = set()
+    if stored.continuous:
+        existing |= set(stored.continuous.columns.keys())
+    if stored.categorical:
+        existing |= set(stored.categorical.columns.keys())
+    clashes = [c for c in columns if c in existing]
+    if clashes:
+        raise errors.DuplicateBands(path, clashes)
+
+
 @cli.command()
 @click.option("--record", type=str, multiple=True, required=True,
               help="Label of record to extract as a target")
-@click.option("--shapefile", type=click.Path(exists=True), required=True,
+@click.option("--shapefile", type=click.Path(exists=True),
               help="Path to .shp file for reading")
+@click.option("--table", type=click.Path(exists=True),
+              help="Path to a CSV, Parquet or HDF5 table of points to read "
+              "instead of a shapefile")
+@click.option("--x-column", type=str, default="X",
+              help="Column of x coordinates in the table")
+@click.option("--y-column", type=str, default="Y",
+              help="Column of y coordinates in the table")
 @click.option("--name", type=str, required=True,
               help="Name of output file")
 @click.option("--every", type=int, default=1, help="Subsample (randomly)"
@@ -195,7 +490,10 @@ def tifs_entrypoint(nworkers: int,
               "for shuffling targets on import")
 @click.pass_context
 def targets(ctx: click.Context,
-            shapefile: str,
+            shapefile: Optional[str],
+            table: Optional[str],
+            x_column: str,
+            y_column: str,
             record: Tuple[str, ...],
             name: str,
             every: int,
@@ -203,45 +501,59 @@ def targets(ctx: click.Context,
             normalise: bool,
             random_seed: int
             ) -> None:
-    """Build target file from shapefile."""
+    """Build target file from a shapefile or a table of points."""
     record_list = list(record)
     categorical = dtype == "categorical"
+    nworkers = ctx.obj.nworkers
     batchMB = ctx.obj.batchMB
     catching_f = errors.catch_and_exit(targets_entrypoint)
-    catching_f(batchMB, shapefile, record_list, name, every, categorical,
-               normalise, random_seed)
+    catching_f(nworkers, batchMB, shapefile, record_list, name, every,
+               categorical, normalise, random_seed, table, x_column, y_column)
 
 
-def targets_entrypoint(batchMB: float,
-                       shapefile: str,
+def targets_entrypoint(nworkers: int,
+                       batchMB: float,
+                       shapefile: Optional[str],
                        records: List[str],
                        name: str,
                        every: int,
                        categorical: bool,
                        normalise: bool,
-                       random_seed: int
+                       random_seed: int,
+                       table: Optional[str] = None,
+                       x_column: str = "X",
+                       y_column: str = "Y"
                        ) -> None:
     """Targets entrypoint without click cruft."""
-    log.info("Loading shapefile targets")
+    if (shapefile is None) == (table is None):
+        raise errors.TargetSourceCount()
+    kind = "shapefile" if shapefile else "table"
+    log.info("Loading {} targets".format(kind))
     out_filename = os.path.join(os.getcwd(), "targets_{}.hdf5".format(name))
-    nworkers = 0  # shapefile reading breaks with concurrency
 
-    with tables.open_file(out_filename, mode="w", title=name) as h5file:
-        log.info("Reading shapefile point coordinates")
-        cocon_src = CoordinateShpArraySource(shapefile, random_seed)
+    with tables.open_file(out_filename, mode="w", title=name) as h5file, \
+            TemporaryDirectory(prefix="shuffle_", dir=os.getcwd()) as tmp:
+        log.info("Reading {} point coordinates".format(kind))
+        cocon_src = CoordinateShpArraySource(shapefile) if shapefile else \
+            CoordinateTableArraySource(table, x_column, y_column)
         cocon_batchsize = mb_to_points(batchMB, ndim_con=0,
                                        ndim_cat=0, ndim_coord=2)
+        cocon_src = bucket_shuffle(cocon_src, tmp, "coordinates",
+                                   random_seed, cocon_batchsize)
         write_coordinates(cocon_src, h5file, cocon_batchsize)
 
         if categorical:
-            log.info("Reading shapefile categorical records")
-            cat_source = CategoricalShpArraySource(
-                shapefile, records, random_seed)
+            log.info("Reading {} categorical records".format(kind))
+            cat_source = CategoricalShpArraySource(shapefile, records) \
+                if shapefile else \
+                CategoricalTableArraySource(table, records)
             cat_batchsize = mb_to_points(batchMB, ndim_con=0,
                                          ndim_cat=cat_source.shape[-1])
-            catdata = get_maps(cat_source, cat_batchsize)
+            catdata = get_maps(cat_source, cat_batchsize, nworkers)
             mappings, counts = catdata.mappings, catdata.counts
             ncats = np.array([len(m) for m in mappings])
+            cat_source = bucket_shuffle(cat_source, tmp, "categorical",
+                                        random_seed, cat_batchsize)
             write_categorical(cat_source, h5file, nworkers, cat_batchsize,
                               mappings)
             cat_meta = meta.CategoricalTarget(N=cat_source.shape[0],
@@ -251,14 +563,17 @@ def targets_entrypoint(batchMB: float,
                                               counts=counts)
             write_target_metadata(cat_meta, h5file)
         else:
-            log.info("Reading shapefile continuous records")
-            con_source = ContinuousShpArraySource(shapefile, records,
-                                                  random_seed)
+            log.info("Reading {} continuous records".format(kind))
+            con_source = ContinuousShpArraySource(shapefile, records) \
+                if shapefile else \
+                ContinuousTableArraySource(table, records)
             con_batchsize = mb_to_points(batchMB,
                                          ndim_con=con_source.shape[-1],
                                          ndim_cat=0)
-            mean, sd = get_stats(con_source, con_batchsize) \
-                if normalise else None, None
+            mean, sd = get_stats(con_source, con_batchsize, nworkers) \
+                if normalise else (None, None)
+            con_source = bucket_shuffle(con_source, tmp, "continuous",
+                                        random_seed, con_batchsize)
             write_continuous(con_source, h5file, nworkers, con_batchsize)
             con_meta = meta.ContinuousTarget(N=con_source.shape[0],
                                              labels=con_source.columns,
@@ -23,8 +23,9 @@ import click
 
 from landshark import __version__, errors, skmodel
 from landshark.scripts.logger import configure_logging
-from landshark.tfread import setup_query, setup_training
-from landshark.tifwrite import write_geotiffs
+from landshark.tfread import (query_valid_path, setup_query,
+                              setup_training)
+from landshark.tifwrite import target_outputs, write_geotiffs
 from landshark.util import mb_to_points
 
 log = logging.getLogger(__name__)
@@ -133,7 +134,9 @@ def predict_entrypoint(config: str,
     y_dash_it = skmodel.predict(checkpoint, train_metadata, query_records,
                                 points_per_batch)
     write_geotiffs(y_dash_it, checkpoint, query_metadata.image,
-                   tag="{}of{}".format(strip, nstrips))
+                   tag="{}of{}".format(strip, nstrips),
+                   valid_path=query_valid_path(data),
+                   outputs=target_outputs(train_metadata.targets))
 
 
 if __name__ == "__main__":
@@ -78,9 +78,16 @@ def deserialise(row: str,
     npatch_side = 2 * metadata.features.halfwidth + 1
     categorical = metadata.targets.dtype == CategoricalType
     y_type = tf.int32 if categorical else tf.float32
+    con_dtype = metadata.features.continuous.dtype \
+        if metadata.features.continuous else np.float32
+    cat_dtype = metadata.features.categorical.dtype \
+        if metadata.features.categorical else CategoricalType
     with tf.name_scope("Inputs"):
-        x_con = tf.decode_raw(raw_features["x_con"], tf.float32)
-        x_cat = tf.decode_raw(raw_features["x_cat"], tf.int32)
+        # Compact storage types are widened here, in the graph
+        x_con = tf.decode_raw(raw_features["x_con"], tf.as_dtype(con_dtype))
+        x_con = tf.cast(x_con, tf.float32)
+        x_cat = tf.decode_raw(raw_features["x_cat"], tf.as_dtype(cat_dtype))
+        x_cat = tf.cast(x_cat, tf.int32)
         x_con_mask = tf.decode_raw(raw_features["x_con_mask"], tf.uint8)
         x_cat_mask = tf.decode_raw(raw_features["x_cat_mask"], tf.uint8)
         x_con_mask = tf.cast(x_con_mask, tf.bool)
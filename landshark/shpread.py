@@ -16,8 +16,11 @@
 
 import datetime
 import logging
+import os.path
+import struct
+from types import TracebackType
 # for mypy type checking
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
 import shapefile
@@ -43,10 +46,12 @@ def _extract_type(python_type: type, field_length: int) -> np.dtype:
     return result
 
 
-def _get_recinfo(shp: shapefile.Reader) -> Tuple[List[str], List[np.dtype]]:
+def _get_recinfo(shp: shapefile.Reader,
+                 index: int = 0
+                 ) -> Tuple[List[str], List[np.dtype]]:
     field_list = shp.fields[1:]
     labels, type_strings, nbytes, decimals = zip(*field_list)
-    record0 = shp.record(0)
+    record0 = shp.record(index)
     types_from_data = [type(k) for k in record0]
     type_list = [_extract_type(t, l) for t, l in zip(types_from_data, nbytes)]
     return labels, type_list
@@ -68,32 +73,203 @@ def _get_dtype(labels: List[str], all_labels: List[str],
     return dtype
 
 
+def _component_path(filename: str, ext: str) -> Optional[str]:
+    """Find the file with extension ext belonging to a shapefile."""
+    base, file_ext = os.path.splitext(filename)
+    if file_ext.lower() not in (".shp", ".shx", ".dbf"):
+        base = filename
+    for e in (ext, ext.upper()):
+        if os.path.exists(base + e):
+            return base + e
+    return None
+
+
+def _kept_records(filename: str) -> Optional[np.ndarray]:
+    """
+    Get the indices of the records of a shapefile that aren't deleted.
+
+    pyshp skips records flagged as deleted in the DBF table, but not their
+    shapes, so the sources drop both to keep targets with their points.
+
+    Returns
+    -------
+    keep : Optional[np.ndarray]
+        The indices of the records to read, or None if none are deleted
+        (or the table can't be read this way).
+
+    """
+    path = _component_path(filename, ".dbf")
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        n_records, header_len, record_len = struct.unpack(
+            "<4xIHH", f.read(12))
+        file_size = os.fstat(f.fileno()).st_size
+    if record_len == 0 or file_size < header_len + n_records * record_len:
+        return None
+    dtype = np.dtype({"names": ["deleted"], "formats": ["S1"],
+                      "itemsize": record_len})
+    flags = np.memmap(path, dtype=dtype, mode="r", offset=header_len,
+                      shape=(n_records,))["deleted"]
+    deleted = flags == b"*"
+    if not np.any(deleted):
+        return None
+    log.info("Skipping {} deleted shapefile records".format(
+        np.count_nonzero(deleted)))
+    keep = np.flatnonzero(~deleted)
+    return keep
+
+
+def _map_dbf_columns(filename: str,
+                     labels: List[str]
+                     ) -> Optional[Tuple[np.ndarray, List[str]]]:
+    """
+    Memory map the records of a shapefile's DBF table.
+
+    The records are mapped as a numpy structured array built from the DBF
+    header, so slices of them can be read sequentially and parsed in bulk
+    with `_parse_dbf_columns`. Deleted records are included (see
+    `_kept_records`).
+
+    Parameters
+    ----------
+    filename : str
+        The path of the shapefile.
+    labels : List[str]
+        The names of the numeric fields to read.
+
+    Returns
+    -------
+    mapped : Optional[Tuple[np.ndarray, List[str]]]
+        The mapped records, and the names of the fields of labels in them.
+        None if the table can't be read this way (a missing file, an
+        unexpected layout or non-numeric fields).
+
+    """
+    path = _component_path(filename, ".dbf")
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        n_records, header_len, record_len = struct.unpack(
+            "<4xIHH", f.read(12))
+        f.seek(32)
+        descriptors = f.read(header_len - 32)
+        file_size = os.fstat(f.fileno()).st_size
+    fields = []
+    for i in range(0, len(descriptors) - 31, 32):
+        d = descriptors[i:i + 32]
+        if d[0:1] == b"\r":
+            break
+        name = d[:11].split(b"\0")[0].decode("latin-1")
+        fields.append((name, chr(d[11]), d[16]))
+    dtype = np.dtype([("deleted", "S1")] +
+                     [("f{}".format(i), "S{}".format(n))
+                      for i, (_, _, n) in enumerate(fields)])
+    if dtype.itemsize != record_len or \
+            file_size < header_len + n_records * record_len:
+        return None
+    names = [k for k, _, _ in fields]
+    keys = []
+    for label in labels:
+        if label not in names or fields[names.index(label)][1] not in "NF":
+            return None
+        keys.append("f{}".format(names.index(label)))
+    records = np.memmap(path, dtype=dtype, mode="r", offset=header_len,
+                        shape=(n_records,))
+    return records, keys
+
+
+def _parse_dbf_columns(records: np.ndarray, keys: List[str]) -> np.ndarray:
+    """Parse numeric DBF fields as float64, with blank values as NaN."""
+    data = np.empty((records.shape[0], len(keys)), dtype=np.float64)
+    for j, k in enumerate(keys):
+        column = np.char.strip(np.char.replace(records[k], b"*", b""))
+        column[column == b""] = b"nan"
+        data[:, j] = column.astype(np.float64)
+    return data
+
+
+def _map_shp_points(filename: str) -> Optional[np.ndarray]:
+    """
+    Memory map the records of a point shapefile.
+
+    Returns a structured array with x and y fields, or None unless every
+    shape is a plain 2D point.
+    """
+    path = _component_path(filename, ".shp")
+    if path is None:
+        return None
+    dtype = np.dtype([("number", ">i4"), ("length", ">i4"),
+                      ("type", "<i4"), ("x", "<f8"), ("y", "<f8")])
+    with open(path, "rb") as f:
+        header = f.read(100)
+        shape_type = struct.unpack("<i", header[32:36])[0]
+        body_size = os.fstat(f.fileno()).st_size - 100
+    if shape_type != 1 or body_size % dtype.itemsize != 0:
+        return None
+    records = np.memmap(path, dtype=dtype, mode="r", offset=100,
+                        shape=(body_size // dtype.itemsize,))
+    if np.any(records["type"] != 1):
+        return None
+    return records
+
+
 class _AbstractShpArraySource(ArraySource):
-    def __init__(self,
-                 filename: str,
-                 labels: List[str],
-                 random_seed: int
-                 ) -> None:
-        self._sf = shapefile.Reader(filename)
-        all_fields, all_dtypes = _get_recinfo(self._sf)
+    """Note the shapefile is only opened while reading (in the context).
+
+    This means the source can be used by forked worker processes, each
+    of which opens its own reader. Records are read in file order; see
+    `landshark.shuffle` for shuffling them.
+    """
+
+    def __init__(self, filename: str, labels: List[str]) -> None:
+        self._filename = filename
+        self._keep = _kept_records(filename)
+        with shapefile.Reader(filename) as sf:
+            first = 0 if self._keep is None else int(self._keep[0])
+            all_fields, all_dtypes = _get_recinfo(sf, first)
+            nrecords = sf.numRecords if self._keep is None \
+                else self._keep.shape[0]
         self._columns = labels
         self._column_indices = _get_indices(self._columns, all_fields)
         self._original_dtypes = [all_dtypes[i] for i in self._column_indices]
-        self._shape = (self._sf.numRecords, len(labels))
+        self._shape = (nrecords, len(labels))
         self._missing = None
         log.info("Shapefile contains {} records "
                  "of {} requested columns.".format(
                      self._shape[0], self._shape[1]))
         self._native = 1
-        rnd = np.random.RandomState(random_seed)
-        self._perm = rnd.permutation(self._shape[0])
+
+    def __enter__(self) -> None:
+        self._records = _map_dbf_columns(self._filename, self._columns)
+        if self._records is None:
+            log.info("Reading shapefile records one at a time")
+            # iterRecords skips deleted records
+            with shapefile.Reader(self._filename) as sf:
+                data = [[r[i] for i in self._column_indices]
+                        for r in sf.iterRecords()]
+            self._data = np.array(data, dtype=self.dtype)
+        elif self._keep is not None:
+            records, keys = self._records
+            self._records = records[self._keep], keys
+        super().__enter__()
+
+    def __exit__(self,
+                 ex_type: type,
+                 ex_val: Exception,
+                 ex_tb: TracebackType
+                 ) -> None:
+        del self._records
+        if hasattr(self, "_data"):
+            del self._data
+        super().__exit__(ex_type, ex_val, ex_tb)
 
     def _arrayslice(self, start: int, end: int) -> np.ndarray:
-        indices = self._perm[start: end]
-        records = (self._sf.record(r) for r in indices)
-        data = [[r[i] for i in self._column_indices] for r in records]
-        array = np.array(data, dtype=self.dtype)
-        return array
+        if self._records is None:
+            return self._data[start:end]
+        records, keys = self._records
+        array = _parse_dbf_columns(records[start:end], keys)
+        return array.astype(self.dtype)
 
 
 class ContinuousShpArraySource(_AbstractShpArraySource, ContinuousArraySource):
@@ -107,20 +283,44 @@ class CategoricalShpArraySource(_AbstractShpArraySource,
 
 class CoordinateShpArraySource(CoordinateArraySource):
 
-    def __init__(self, filename: str, random_seed: int)-> None:
-        self._sf = shapefile.Reader(filename)
-        self._shape = (self._sf.numRecords, 2)
+    def __init__(self, filename: str) -> None:
+        self._filename = filename
+        self._keep = _kept_records(filename)
+        with shapefile.Reader(filename) as sf:
+            nrecords = sf.numRecords if self._keep is None \
+                else self._keep.shape[0]
+        self._shape = (nrecords, 2)
         self._native = 1
         self._missing = None
         self._columns = ["X", "Y"]
-        rnd = np.random.RandomState(random_seed)
-        self._perm = rnd.permutation(self._shape[0])
+
+    def __enter__(self) -> None:
+        self._records = _map_shp_points(self._filename)
+        if self._records is None:
+            log.info("Reading shapefile points one at a time")
+            with shapefile.Reader(self._filename) as sf:
+                coords = [s.__geo_interface__["coordinates"]
+                          for s in sf.iterShapes()]
+            self._coords = np.array(coords, dtype=self.dtype)
+            if self._keep is not None:
+                self._coords = self._coords[self._keep]
+        elif self._keep is not None:
+            self._records = self._records[self._keep]
+        super().__enter__()
+
+    def __exit__(self,
+                 ex_type: type,
+                 ex_val: Exception,
+                 ex_tb: TracebackType
+                 ) -> None:
+        del self._records
+        if hasattr(self, "_coords"):
+            del self._coords
+        super().__exit__(ex_type, ex_val, ex_tb)
 
     def _arrayslice(self, start: int, end: int) -> np.ndarray:
-        indices = self._perm[start: end]
-        coords = [self._sf.shape(r).__geo_interface__["coordinates"]
-                  for r in indices]
-        array = np.array(coords, dtype=self.dtype).squeeze()
-        if array.ndim == 1:
-            array == array[:, np.newaxis]
-        return array
+        if self._records is None:
+            return self._coords[start:end]
+        records = self._records[start:end]
+        array = np.stack((records["x"], records["y"]), axis=-1)
+        return array.astype(self.dtype)
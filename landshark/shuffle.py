@@ -0,0 +1,231 @@
+"""Out-of-core shuffling of array sources through temporary buckets."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os.path
+from contextlib import ExitStack
+from types import TracebackType
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from landshark.basetypes import ArraySource
+from landshark.iteration import batch_slices
+
+log = logging.getLogger(__name__)
+
+# Rows that share one draw of random bucket ids. Fixed so that the ids
+# don't depend on how a source is batched.
+ID_BLOCK_ROWS = 1 << 16
+
+# Rows per bucket on average. Only one bucket is in memory at a time.
+BUCKET_ROWS = 1 << 20
+
+
+def n_buckets(n_rows: int) -> int:
+    """Get the number of buckets used to shuffle n_rows rows."""
+    return max(1, -(-n_rows // BUCKET_ROWS))
+
+
+class _BucketIds:
+    """
+    Random bucket ids of rows, drawn a block of ID_BLOCK_ROWS at a time.
+
+    The most recently drawn block is kept, so reading rows in order in
+    batches smaller than a block draws each block once.
+    """
+
+    def __init__(self, seed: int, nbuckets: int) -> None:
+        self._seed = seed
+        self._nbuckets = nbuckets
+        self._block: Tuple[int, Optional[np.ndarray]] = (-1, None)
+
+    def _load(self, b: int) -> np.ndarray:
+        """Get the ids of block b."""
+        if self._block[0] != b:
+            rnd = np.random.RandomState((self._seed, 0, b))
+            ids = rnd.randint(self._nbuckets, size=ID_BLOCK_ROWS,
+                              dtype=np.int32)
+            self._block = (b, ids)
+        block = self._block[1]
+        assert block is not None
+        return block
+
+    def __call__(self, start: int, stop: int) -> np.ndarray:
+        """Get the bucket of each row in [start, stop)."""
+        first = start // ID_BLOCK_ROWS
+        last = -(-stop // ID_BLOCK_ROWS)
+        ids_list = []
+        for b in range(first, last):
+            offset = b * ID_BLOCK_ROWS
+            a = max(start, offset) - offset
+            z = min(stop, offset + ID_BLOCK_ROWS) - offset
+            ids_list.append(self._load(b)[a:z])
+        ids = np.concatenate(ids_list) if ids_list else \
+            np.empty(0, dtype=np.int32)
+        return ids
+
+
+def bucket_ids(seed: int, start: int, stop: int, nbuckets: int
+               ) -> np.ndarray:
+    """
+    Get the random bucket of each row in [start, stop).
+
+    The ids depend only on the seed, the row and the number of buckets,
+    so sources of the same length are bucketed identically however they
+    are read.
+    """
+    ids = _BucketIds(seed, nbuckets)(start, stop)
+    return ids
+
+
+def _bucket_permutation(seed: int, bucket: int, size: int) -> np.ndarray:
+    """Get the permutation applied to the rows of a bucket."""
+    rnd = np.random.RandomState((seed, 1, bucket))
+    return rnd.permutation(size)
+
+
+class BucketArraySource(ArraySource):
+    """
+    The rows of a source shuffled into bucket files.
+
+    Reading goes through the buckets in order, shuffling each in memory
+    as it is loaded. Only the most recently used bucket is kept, so
+    sequential reads load every bucket once. The source only holds file
+    paths and sizes, so it can be pickled and read by worker processes.
+
+    Parameters
+    ----------
+    src : ArraySource
+        The source that was shuffled, for its properties.
+    paths : List[str]
+        The bucket files, holding raw rows of src.dtype.
+    counts : np.ndarray
+        The number of rows in each bucket.
+    seed : int
+        The seed of the shuffle.
+
+    """
+
+    def __init__(self,
+                 src: ArraySource,
+                 paths: List[str],
+                 counts: np.ndarray,
+                 seed: int
+                 ) -> None:
+        self._shape = src.shape
+        self._dtype = src.dtype
+        self._missing = src.missing
+        self._columns = src.columns
+        self._native = 1
+        self._paths = paths
+        self._seed = seed
+        self._offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    def __enter__(self) -> None:
+        self._bucket: Tuple[int, Optional[np.ndarray]] = (-1, None)
+        super().__enter__()
+
+    def __exit__(self,
+                 ex_type: type,
+                 ex_val: Exception,
+                 ex_tb: TracebackType
+                 ) -> None:
+        del self._bucket
+        super().__exit__(ex_type, ex_val, ex_tb)
+
+    def _load(self, i: int) -> np.ndarray:
+        """Get bucket i, shuffled."""
+        if self._bucket[0] != i:
+            x = np.fromfile(self._paths[i], dtype=self._dtype)
+            x = x.reshape((-1,) + self._shape[1:])
+            x = x[_bucket_permutation(self._seed, i, x.shape[0])]
+            self._bucket = (i, x)
+        data = self._bucket[1]
+        assert data is not None
+        return data
+
+    def _arrayslice(self, start: int, end: int) -> np.ndarray:
+        first = int(np.searchsorted(self._offsets, start, side="right")) - 1
+        last = int(np.searchsorted(self._offsets, end, side="left"))
+        data_list = []
+        for i in range(first, last):
+            a = max(start, self._offsets[i]) - self._offsets[i]
+            b = min(end, self._offsets[i + 1]) - self._offsets[i]
+            if b > a:
+                data_list.append(self._load(i)[a:b])
+        if len(data_list) == 1:
+            return data_list[0]
+        data = np.concatenate(data_list, axis=0) if data_list else \
+            np.empty((0,) + self._shape[1:], dtype=self._dtype)
+        return data
+
+
+def bucket_shuffle(src: ArraySource,
+                   directory: str,
+                   name: str,
+                   seed: int,
+                   batchrows: int
+                   ) -> BucketArraySource:
+    """
+    Shuffle the rows of a source with an external-memory bucket shuffle.
+
+    The source is read sequentially and each row is appended to a random
+    bucket file. Each bucket is then shuffled as it is read back. Sources
+    with the same number of rows are shuffled with the same permutation
+    for the same seed, so separate sources of the same points stay aligned.
+
+    Parameters
+    ----------
+    src : ArraySource
+        The source to shuffle.
+    directory : str
+        The directory for the bucket files. They are left for the caller
+        to remove.
+    name : str
+        A prefix for the bucket file names, unique within the directory.
+    seed : int
+        The random seed of the shuffle.
+    batchrows : int
+        The number of rows in each batch read from src.
+
+    Returns
+    -------
+    shuffled : BucketArraySource
+        The shuffled rows of src.
+
+    """
+    n_rows = src.shape[0]
+    nbuckets = n_buckets(n_rows)
+    log.info("Shuffling {} rows through {} buckets".format(n_rows, nbuckets))
+    paths = [os.path.join(directory, "{}_bucket{}.bin".format(name, i))
+             for i in range(nbuckets)]
+    counts = np.zeros(nbuckets, dtype=np.int64)
+    row_ids = _BucketIds(seed, nbuckets)
+    with ExitStack() as stack:
+        files = [stack.enter_context(open(p, "wb")) for p in paths]
+        with src:
+            for s in batch_slices(batchrows, n_rows):
+                x = np.ascontiguousarray(src(s), dtype=src.dtype)
+                ids = row_ids(s.start, s.stop)
+                order = np.argsort(ids, kind="mergesort")
+                bounds = np.searchsorted(ids[order], np.arange(nbuckets + 1))
+                x = x[order]
+                for i in np.flatnonzero(np.diff(bounds)):
+                    files[i].write(x[bounds[i]:bounds[i + 1]].tobytes())
+                counts += np.diff(bounds)
+    shuffled = BucketArraySource(src, paths, counts, seed)
+    return shuffled
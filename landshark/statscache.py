@@ -0,0 +1,191 @@
+"""Cache of per-band statistics and category counts between imports."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import logging
+import os
+import pickle
+from typing import Any, Dict, List, Optional, Tuple
+
+from landshark.category import CategoryInfo, get_maps
+from landshark.normalise import StatCounter, compute_stats
+from landshark.tifread import CategoricalStackSource, ContinuousStackSource
+
+log = logging.getLogger(__name__)
+
+FileId = Tuple[Any, ...]
+
+HASH_BLOCK_BYTES = 1 << 24
+
+
+class StatsCache:
+    """
+    Per-band statistics and category counts saved in a sidecar file.
+
+    Entries are keyed by the tif holding the band and the band's index.
+    Each one records the identity of the tif when it was computed, its size
+    and either its modification time or a hash of its contents, so a
+    changed tif only invalidates its own bands.
+
+    Parameters
+    ----------
+    path : str
+        The cache file. It is created when first saved.
+    content_hash : bool
+        Identify tifs by a hash of their contents instead of their
+        modification time. Slower, but robust to copies and touches.
+
+    """
+
+    def __init__(self, path: str, content_hash: bool = False) -> None:
+        """Load the cache if it exists."""
+        self._path = path
+        self._content_hash = content_hash
+        self._entries: Dict[Tuple[str, str, int], Tuple[FileId, Any]] = {}
+        self._file_ids: Dict[str, FileId] = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self._entries = pickle.load(f)
+            log.info("Loaded {} cached band entries from {}".format(
+                len(self._entries), path))
+
+    def get(self, kind: str, tif: str, band: int) -> Optional[Any]:
+        """Get the entry for a band, or None if missing or out of date."""
+        path = os.path.abspath(tif)
+        entry = self._entries.get((kind, path, band))
+        if entry is None or entry[0] != self._file_id(path):
+            return None
+        return entry[1]
+
+    def put(self, kind: str, tif: str, band: int, value: Any) -> None:
+        """Set the entry for a band, replacing any older one."""
+        path = os.path.abspath(tif)
+        self._entries[(kind, path, band)] = (self._file_id(path), value)
+
+    def save(self) -> None:
+        """Write the cache, replacing the file atomically."""
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self._entries, f)
+        os.replace(tmp_path, self._path)
+
+    def _file_id(self, path: str) -> FileId:
+        """Get (and remember for this run) the identity of a file."""
+        if path not in self._file_ids:
+            st = os.stat(path)
+            version = _content_hash(path) if self._content_hash \
+                else st.st_mtime_ns
+            self._file_ids[path] = (st.st_size, version)
+        return self._file_ids[path]
+
+
+def _content_hash(path: str) -> str:
+    """Hash the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _stale_files(entries: List[Optional[Any]],
+                 band_files: List[Tuple[str, int]]
+                 ) -> List[str]:
+    """Get the tifs with any band missing from the cache, in stack order."""
+    stale: List[str] = []
+    for e, (path, _) in zip(entries, band_files):
+        if e is None and path not in stale:
+            stale.append(path)
+    return stale
+
+
+def cached_stats(cache: StatsCache,
+                 src: ContinuousStackSource,
+                 batchrows: int,
+                 n_workers: int = 0,
+                 sketch: bool = False
+                 ) -> StatCounter:
+    """
+    Compute statistics of continuous bands, reusing any cached ones.
+
+    Only the tifs with bands missing from the cache are read, and their
+    statistics are added to the cache.
+
+    Parameters
+    ----------
+    cache : StatsCache
+        The cache to read from and update.
+    src : ContinuousStackSource
+        The stack of continuous tifs.
+    batchrows : int
+        The number of rows in each batch read from src.
+    n_workers : int
+        The number of additional worker processes.
+    sketch : bool
+        Whether quantile sketches are needed. Cached bands without them
+        are computed again.
+
+    Returns
+    -------
+    stats : StatCounter
+        The statistics of every band of src.
+
+    """
+    entries = [cache.get("continuous", p, b) for p, b in src.band_files]
+    if sketch:
+        entries = [e if e is not None and e.sketched else None
+                   for e in entries]
+    stale = _stale_files(entries, src.band_files)
+    log.info("Using cached statistics for {} of {} continuous bands".format(
+        sum(e is not None for e in entries), len(entries)))
+    if stale:
+        sub = src.subset(stale)
+        counter = compute_stats(sub, batchrows, n_workers, sketch=sketch)
+        for (p, b), c in zip(sub.band_files, counter.split()):
+            cache.put("continuous", p, b, c)
+        cache.save()
+    counters = [cache.get("continuous", p, b) for p, b in src.band_files]
+    stats = StatCounter.stack(counters)
+    return stats
+
+
+def cached_maps(cache: StatsCache,
+                src: CategoricalStackSource,
+                batchrows: int,
+                n_workers: int = 0
+                ) -> CategoryInfo:
+    """
+    Compute the categories of categorical bands, reusing any cached ones.
+
+    Only the tifs with bands missing from the cache are read, and their
+    categories and counts are added to the cache. See `get_maps`.
+
+    """
+    entries = [cache.get("categorical", p, b) for p, b in src.band_files]
+    stale = _stale_files(entries, src.band_files)
+    log.info("Using cached categories for {} of {} categorical bands".format(
+        sum(e is not None for e in entries), len(entries)))
+    if stale:
+        sub = src.subset(stale)
+        catdata = get_maps(sub, batchrows, n_workers)
+        for (p, b), m, c in zip(sub.band_files, catdata.mappings,
+                                catdata.counts):
+            cache.put("categorical", p, b, (m, c))
+        cache.save()
+    entries = [cache.get("categorical", p, b) for p, b in src.band_files]
+    result = CategoryInfo(mappings=[e[0] for e in entries],
+                          counts=[e[1] for e in entries])
+    return result
@@ -0,0 +1,203 @@
+"""Read point targets from columnar tables (CSV, Parquet and HDF5)."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import csv
+import logging
+import os.path
+from typing import List
+
+import numpy as np
+import tables
+
+from landshark import errors
+from landshark.basetypes import (ArraySource, CategoricalArraySource,
+                                 ContinuousArraySource, CoordinateArraySource)
+
+log = logging.getLogger(__name__)
+
+CSV_EXTENSIONS = (".csv",)
+PARQUET_EXTENSIONS = (".parquet", ".pq")
+HDF5_EXTENSIONS = (".h5", ".hdf5", ".hdf")
+TABLE_EXTENSIONS = CSV_EXTENSIONS + PARQUET_EXTENSIONS + HDF5_EXTENSIONS
+
+
+def _check_columns(filename: str,
+                   labels: List[str],
+                   all_labels: List[str]
+                   ) -> None:
+    """Make sure every requested column is in the table."""
+    unknown = [k for k in labels if k not in all_labels]
+    if unknown:
+        raise errors.UnknownTableColumns(filename, unknown)
+
+
+def _parse_floats(values: List[str]) -> np.ndarray:
+    """Convert a column of CSV fields to float64. Empty fields are NaN."""
+    try:
+        data = np.array(values, dtype=np.float64)
+    except ValueError:
+        data = np.array([float(v) if v.strip() else np.nan
+                         for v in values], dtype=np.float64)
+    return data
+
+
+def _read_csv_columns(filename: str, labels: List[str]) -> np.ndarray:
+    """Read columns of a CSV file with a header row. Empty fields are NaN.
+
+    The body is split into fields in one go, and each requested column
+    is sliced out and parsed as a whole. Quoted fields holding commas are
+    not supported.
+    """
+    with open(filename, newline="") as f:
+        header = [k.strip() for k in next(csv.reader(f))]
+        body = f.read()
+    _check_columns(filename, labels, header)
+    body = body.replace("\r\n", "\n").strip("\n")
+    fields = body.replace("\n", ",").split(",") if body else []
+    ncols = len(header)
+    if len(fields) % ncols != 0:
+        raise errors.RaggedCsvRows(filename)
+    columns = [_parse_floats(fields[header.index(k)::ncols]) for k in labels]
+    data = np.stack(columns, axis=1)
+    return data
+
+
+def _read_parquet_columns(filename: str, labels: List[str]) -> np.ndarray:
+    """Read columns of a Parquet file. Null values are NaN."""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise errors.MissingDependency("pyarrow", "reading Parquet files")
+    _check_columns(filename, labels, pq.read_schema(filename).names)
+    table = pq.read_table(filename, columns=labels)
+    data = np.stack([np.asarray(table.column(k).to_numpy(),
+                                dtype=np.float64) for k in labels], axis=1)
+    return data
+
+
+def _read_hdf5_columns(filename: str, labels: List[str]) -> np.ndarray:
+    """Read columns of the first table in an HDF5 file."""
+    with tables.open_file(filename, "r") as hfile:
+        table = next(hfile.walk_nodes("/", "Table"), None)
+        if table is None:
+            raise errors.NoTableFound(filename)
+        _check_columns(filename, labels, table.colnames)
+        data = np.stack([table.col(k).astype(np.float64) for k in labels],
+                        axis=1)
+    return data
+
+
+def read_table_columns(filename: str, labels: List[str]) -> np.ndarray:
+    """
+    Read whole columns of a point table, chosen by the file extension.
+
+    Parameters
+    ----------
+    filename : str
+        The CSV, Parquet or HDF5 table.
+    labels : List[str]
+        The names of the columns to read.
+
+    Returns
+    -------
+    data : np.ndarray
+        The columns as float64, shape (n_rows, len(labels)).
+
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in CSV_EXTENSIONS:
+        data = _read_csv_columns(filename, labels)
+    elif ext in PARQUET_EXTENSIONS:
+        data = _read_parquet_columns(filename, labels)
+    elif ext in HDF5_EXTENSIONS:
+        data = _read_hdf5_columns(filename, labels)
+    else:
+        raise errors.UnknownTableFormat(filename, TABLE_EXTENSIONS)
+    return data
+
+
+class _AbstractTableArraySource(ArraySource):
+    """
+    Columns of a point table, in file order like the shapefile sources.
+
+    The requested columns are read in one go on construction, so the
+    source is cheap to enter and can be read by worker processes.
+
+    Parameters
+    ----------
+    filename : str
+        The CSV, Parquet or HDF5 table.
+    labels : List[str]
+        The names of the columns to read.
+
+    """
+
+    def __init__(self, filename: str, labels: List[str]) -> None:
+        data = read_table_columns(filename, labels)
+        self._columns = labels
+        self._shape = (data.shape[0], len(labels))
+        self._missing = None
+        log.info("Table contains {} records "
+                 "of {} requested columns.".format(
+                     self._shape[0], self._shape[1]))
+        self._native = 1
+        self._data = self._convert(filename, data)
+
+    def _convert(self, filename: str, data: np.ndarray) -> np.ndarray:
+        return data.astype(self.dtype)
+
+    def _arrayslice(self, start: int, end: int) -> np.ndarray:
+        array = self._data[start:end]
+        return array
+
+
+class ContinuousTableArraySource(_AbstractTableArraySource,
+                                 ContinuousArraySource):
+    pass
+
+
+class CategoricalTableArraySource(_AbstractTableArraySource,
+                                  CategoricalArraySource):
+
+    def _convert(self, filename: str, data: np.ndarray) -> np.ndarray:
+        if not np.all(np.isfinite(data)):
+            raise errors.MissingCategoricalValues(filename)
+        return data.astype(self.dtype)
+
+
+class CoordinateTableArraySource(_AbstractTableArraySource,
+                                 CoordinateArraySource):
+    """
+    The point coordinates of a table.
+
+    Parameters
+    ----------
+    filename : str
+        The CSV, Parquet or HDF5 table.
+    x_label : str
+        The name of the column of x coordinates.
+    y_label : str
+        The name of the column of y coordinates.
+
+    """
+
+    def __init__(self,
+                 filename: str,
+                 x_label: str = "X",
+                 y_label: str = "Y"
+                 ) -> None:
+        super().__init__(filename, [x_label, y_label])
+        self._columns = ["X", "Y"]
@@ -16,11 +16,13 @@
 
 import logging
 import os
+import re
 import sys
 from glob import glob
 from importlib.util import module_from_spec, spec_from_file_location
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+from landshark.featurewrite import QUERY_VALID_FILE
 from landshark.metadata import FeatureSet, Training
 
 log = logging.getLogger(__name__)
@@ -74,10 +76,11 @@ def setup_query(config: str,
                 querydir: str,
                 checkpoint: str
                 ) -> Tuple[Training, FeatureSet, List[str], int, int, str]:
-    strip_list = querydir.rstrip("/").split("strip")[-1].split("of")
-    assert len(strip_list) == 2
-    strip = int(strip_list[0])
-    nstrip = int(strip_list[1])
+    # strips and tiles are both numbered "{i}of{n}" in the directory name
+    match = re.search(r"(?:strip|tile)(\d+)of(\d+)$", querydir.rstrip("/"))
+    assert match is not None
+    strip = int(match.group(1))
+    nstrip = int(match.group(2))
 
     query_metadata = FeatureSet.load(querydir)
     training_metadata = Training.load(checkpoint)
@@ -90,6 +93,12 @@ def setup_query(config: str,
             strip, nstrip, module_name)
 
 
+def query_valid_path(querydir: str) -> Optional[str]:
+    """Get the mask of the query pixels with data, if the query has one."""
+    path = os.path.join(querydir, QUERY_VALID_FILE)
+    return path if os.path.exists(path) else None
+
+
 def get_strips(records: List[str]) -> Tuple[int, int]:
     def f(k: str) -> Tuple[int, int]:
         r = os.path.basename(k).rsplit(".", maxsplit=3)[1]
@@ -83,12 +83,16 @@ class _ImageStackSource(ArraySource):
 
     def __init__(self, image_spec: ImageSpec, path_list: List[str]) -> None:
         """Construct an instance of ImageStack."""
+        self._image_spec = image_spec
         self._path_list = path_list
         with ExitStack() as stack:
             all_images = [stack.enter_context(rasterio.open(k, "r"))
                           for k in path_list]
             bands = _bands(all_images)
             nbands = len(bands)
+            self._band_files = [(p, i + 1) for p, im in
+                                zip(path_list, all_images)
+                                for i in range(im.count)]
             self._shape = (image_spec.height,
                            image_spec.width, nbands)
             self._missing = self._missing_val if _has_missing(bands) else None
@@ -98,6 +102,16 @@ class _ImageStackSource(ArraySource):
         log.info("Found {} {} bands".format(nbands, self._type_name))
         log.info("Largest tif block size is {} rows".format(self._native))
 
+    @property
+    def band_files(self) -> List[Tuple[str, int]]:
+        """Get the path and (1-based) band index of each band."""
+        return self._band_files
+
+    def subset(self, path_list: List[str]) -> "_ImageStackSource":
+        """Get a stack of some of the images of this one."""
+        sub = type(self)(self._image_spec, path_list)
+        return sub
+
     def __enter__(self) -> None:
         self._images = [rasterio.open(k, "r") for k in self._path_list]
         self._bands = _bands(self._images)
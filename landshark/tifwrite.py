@@ -17,26 +17,56 @@
 import itertools
 import logging
 import os.path
-from typing import Dict, Iterator
+from contextlib import ExitStack
+from typing import Any, Dict, Iterator, Optional
 
 import numpy as np
 import rasterio as rs
+import tables
 from rasterio.windows import Window
 from tqdm import tqdm
 
+from landshark.basetypes import ContinuousType
 from landshark.errors import PredictionShape
 from landshark.image import ImageSpec
+from landshark.iteration import batch_slices
+from landshark.metadata import Target
 
 log = logging.getLogger(__name__)
 
+# The approximate number of pixels in each write of an image of nodata
+NODATA_BATCH_PIXELS = 1 << 20
+
+
+def _nodata(dtype: np.dtype) -> Any:
+    """Get the nodata value of an output type.
+
+    Floats use their smallest value, the missing value of continuous data.
+    Integers (class predictions) use their largest value, like compact
+    categorical data (see `category.mapped_missing`), as the smallest value
+    of an unsigned type is a valid class.
+    """
+    if np.issubdtype(dtype, np.floating):
+        return np.finfo(dtype).min
+    if np.issubdtype(dtype, np.integer):
+        return np.iinfo(dtype).max
+    return 0
+
 
 class BatchWriter:
+    """
+    Write a stream of predictions to the rows of an image, in order.
+
+    If a valid mask is given, the predictions are only for the pixels it
+    marks, and the other pixels are filled with nodata.
+    """
 
     def __init__(self,
                  rs_file: rs.DatasetReader,
                  width: int,
                  height: int,
-                 dtype: np.dtype
+                 dtype: np.dtype,
+                 valid: Optional[tables.CArray] = None
                  ) -> None:
         self.f = rs_file
         self.width = width
@@ -44,29 +74,61 @@ class BatchWriter:
         self.dtype = dtype
         self.res = np.array([], dtype=dtype)
         self.rows_written = 0
+        self.valid = valid
+        if valid is not None:
+            counts = [np.count_nonzero(valid[s.start:s.stop], axis=1)
+                      for s in batch_slices(valid.chunkshape[0], height)]
+            # offsets[i] is the number of predictions before row i
+            self.offsets = np.concatenate(
+                ([0], np.cumsum(np.concatenate(counts))))
+
+    def _write_rows(self, d: np.ndarray) -> None:
+        w = Window(0, self.rows_written, d.shape[1], d.shape[0])
+        self.f.write(d, 1, window=w)
+        self.rows_written += d.shape[0]
+
+    def _write_valid(self, all_data: np.ndarray) -> None:
+        """Write the rows whose valid pixels all have predictions."""
+        first = self.rows_written
+        n_done = self.offsets[first] + len(all_data)
+        stop = int(np.searchsorted(self.offsets, n_done, side="right")) - 1
+        if stop > first:
+            used = self.offsets[stop] - self.offsets[first]
+            mask = self.valid[first:stop]
+            d = np.full(mask.shape, _nodata(self.dtype), dtype=self.dtype)
+            d[mask] = all_data[:used]
+            self._write_rows(d)
+            all_data = all_data[used:]
+        self.res = all_data
 
     def write(self, data: np.ndarray) -> None:
 
         assert data.ndim == 1
         all_data = np.hstack((self.res, data))
+        if self.valid is not None:
+            self._write_valid(all_data)
+            return
         nrows = len(all_data) // self.width
         if nrows > 0:
             d = all_data[0: nrows * self.width].reshape(nrows, self.width)
-            w = Window(0, self.rows_written, d.shape[1], d.shape[0])
-            self.f.write(d, 1, window=w)
-            self.rows_written += nrows
+            self._write_rows(d)
             self.res = all_data[nrows * self.width:]
         else:
             self.res = all_data
 
     def close(self) -> None:
+        if self.valid is not None:
+            # Rows after the last prediction with no valid pixels
+            self._write_valid(self.res)
         self.f.close()
 
 
 def _make_writer(directory: str,
                  label: str,
                  dtype: np.dtype,
-                 image_spec: ImageSpec
+                 image_spec: ImageSpec,
+                 valid: Optional[tables.CArray] = None,
+                 nodata: bool = False
                  ) -> BatchWriter:
     crs = rs.crs.CRS(**image_spec.crs)
     params = {
@@ -78,25 +140,71 @@ def _make_writer(directory: str,
         "crs": crs,
         "transform": image_spec.affine
     }
+    if valid is not None or nodata:
+        params["nodata"] = _nodata(dtype)
     fname = os.path.join(directory, label + ".tif")
     f = rs.open(fname, "w", **params)
     writer = BatchWriter(f, width=image_spec.width, height=image_spec.height,
-                         dtype=dtype)
+                         dtype=dtype, valid=valid)
     return writer
 
 
+def target_outputs(targets: Target) -> Dict[str, np.dtype]:
+    """Get the outputs of a model named as in the example configs.
+
+    These are "predictions_{label}" for each target, with the type of the
+    targets. They name the images of a query without predictions, where
+    the outputs of the model can't be seen.
+    """
+    outputs = {"predictions_{}".format(k): np.dtype(targets.dtype)
+               for k in targets.labels}
+    return outputs
+
+
 def write_geotiffs(y_dash: Iterator[Dict[str, np.ndarray]],
                    directory: str,
                    imspec: ImageSpec,
-                   tag: str = ""
+                   tag: str = "",
+                   valid_path: Optional[str] = None,
+                   outputs: Optional[Dict[str, np.dtype]] = None
                    ) -> None:
-    """Write predictions `y` to tifs according to the query image spec."""
+    """Write predictions `y` to tifs according to the query image spec.
+
+    If the query has a mask of the pixels with data (in valid_path), the
+    predictions are only for those pixels, and the rest are nodata. If
+    there are no predictions at all, an image of nodata is written for
+    each of the outputs (name and type) of the model, or a single float
+    "predictions" image if they are not given.
+    """
     log.info("Initialising Geotiff writers")
     log.info("Image width: {} height: {}".format(imspec.width,
                                                  imspec.height))
+    with ExitStack() as stack:
+        valid = None
+        if valid_path:
+            log.info("Filling pixels without data with nodata")
+            valid = stack.enter_context(
+                tables.open_file(valid_path, "r")).root.valid
+        _write_geotiffs(y_dash, directory, imspec, tag, valid, outputs)
+
+
+def _write_geotiffs(y_dash: Iterator[Dict[str, np.ndarray]],
+                    directory: str,
+                    imspec: ImageSpec,
+                    tag: str,
+                    valid: Optional[tables.CArray],
+                    outputs: Optional[Dict[str, np.dtype]]
+                    ) -> None:
 
     # "peek" at the first prediction so we can see what we're dealing with
-    y0 = next(y_dash)
+    y0 = next(y_dash, None)
+    if y0 is None:
+        # A query with no pixels with data has no predictions
+        log.warning("No predictions, so writing images of only nodata")
+        outputs = outputs or {"predictions": np.dtype(ContinuousType)}
+        for k, dtype in outputs.items():
+            _write_nodata(directory, k + "_" + tag, dtype, imspec)
+        return
     y_dash = itertools.chain([y0], y_dash)
 
     for k, v in y0.items():
@@ -104,9 +212,11 @@ def write_geotiffs(y_dash: Iterator[Dict[str, np.ndarray]],
             raise PredictionShape(k, v.shape)
 
     writers = {k: _make_writer(directory, k + "_" + tag, v.dtype,
-                               imspec) for k, v in y0.items()}
+                               imspec, valid) for k, v in y0.items()}
+    total = imspec.width * imspec.height if valid is None else \
+        int(next(iter(writers.values())).offsets[-1])
 
-    with tqdm(total=imspec.width * imspec.height) as pbar:
+    with tqdm(total=total) as pbar:
         for y_i in y_dash:
             for k, v in y_i.items():
                 writers[k].write(v.flatten())
@@ -114,3 +224,17 @@ def write_geotiffs(y_dash: Iterator[Dict[str, np.ndarray]],
 
     for w in writers.values():
         w.close()
+
+
+def _write_nodata(directory: str,
+                  label: str,
+                  dtype: np.dtype,
+                  image_spec: ImageSpec
+                  ) -> None:
+    """Write an image of only nodata, a batch of rows at a time."""
+    writer = _make_writer(directory, label, dtype, image_spec, nodata=True)
+    batchrows = max(1, NODATA_BATCH_PIXELS // image_spec.width)
+    fill = np.full(batchrows * image_spec.width, _nodata(dtype), dtype=dtype)
+    for s in batch_slices(batchrows, image_spec.height):
+        writer.write(fill[:(s.stop - s.start) * image_spec.width])
+    writer.close()
@@ -27,12 +27,17 @@ log = logging.getLogger(__name__)
 def to_masked(array: np.ndarray,
               missing_value: MissingType
               ) -> np.ma.MaskedArray:
-    """Create a masked array from array plus list of missing."""
+    """Create a masked array from array plus list of missing.
+
+    The missing value is also the fill value, as the default (1e20)
+    overflows compact dtypes such as float16.
+    """
     if missing_value is None:
         marray = np.ma.MaskedArray(data=array, mask=np.ma.nomask)
     else:
         mask = array == missing_value
-        marray = np.ma.MaskedArray(data=array, mask=mask)
+        marray = np.ma.MaskedArray(data=array, mask=mask,
+                                   fill_value=missing_value)
     return marray
 
 
@@ -46,7 +46,7 @@ setup(
         "click>=6.7",
         "rasterio>=1.0.2",
         "tables>=3.4.2",
-        "pyshp>=1.2.12",
+        "pyshp>=2.0.0",
         "mypy>=0.521",
         "mypy_extensions>=0.3.0",
         "lru-dict>=1.1.6",
@@ -55,6 +55,9 @@ setup(
         "tensorflow>=1.8,<2.0"
     ],
     extras_require={
+        "parquet": [
+            "pyarrow>=0.15.0",
+        ],
         "dev": [
             "jedi>=0.10.2",
             "pytest>=3.1.3",
@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import numpy as np
+import pytest
 
 from landshark import category
 from landshark.basetypes import CategoricalArraySource, CategoricalType
@@ -33,6 +34,29 @@ def test_unique_values():
         assert np.all(v == w)
 
 
+def test_unique_values_large_range():
+    x = np.array([[-10 ** 6, 5], [3, 5], [10 ** 6, 7], [3, 5]],
+                 dtype=CategoricalType)
+    unique_vals, counts = category._unique_values(x)
+    assert np.all(unique_vals[0] == [-10 ** 6, 3, 10 ** 6])
+    assert np.all(counts[0] == [1, 2, 1])
+    assert np.all(unique_vals[1] == [5, 7])
+    assert np.all(counts[1] == [3, 1])
+
+
+def test_unique_values_missing(monkeypatch):
+    missing = np.iinfo(CategoricalType).min
+    x = np.array([[missing, 5], [3, missing], [4, 7], [3, 5]],
+                 dtype=CategoricalType)
+    # The missing value doesn't stop the columns being counted in a table
+    monkeypatch.setattr(np, "unique", None)
+    unique_vals, counts = category._unique_values(x, missing)
+    assert np.all(unique_vals[0] == [3, 4])
+    assert np.all(counts[0] == [2, 1])
+    assert np.all(unique_vals[1] == [5, 7])
+    assert np.all(counts[1] == [2, 1])
+
+
 def test_category_accumulator():
 
     missing_value = -1
@@ -90,3 +114,42 @@ def test_categorical_transform():
                     [2, 0],
                     [0, 1]], dtype=CategoricalType)
     assert np.all(out == ans)
+
+
+def test_compact_dtype():
+    assert category.compact_dtype(np.array([3, 254])) == np.uint8
+    assert category.compact_dtype(np.array([3, 255])) == np.uint16
+    assert category.compact_dtype(np.array([70000])) == CategoricalType
+
+
+def test_categorical_transform_compact():
+
+    mappings = [np.array([1, 2, 3]), np.array([1, 2, 4])]
+    x = np.array([[2, -1, 3, 1], [4, 1, -1, 2]], dtype=CategoricalType).T
+    f = category.CategoryMapper(mappings, missing_value=-1, dtype=np.uint8)
+    out = f(x)
+    m = np.iinfo(np.uint8).max
+    ans = np.array([[1, 2],
+                    [m, 0],
+                    [2, m],
+                    [0, 1]], dtype=np.uint8)
+    assert out.dtype == np.uint8
+    assert np.all(out == ans)
+
+
+@pytest.mark.parametrize("scale", [1, 10 ** 6])
+def test_categorical_transform_lookup(scale):
+
+    mappings = [np.array([-5, 0, 7]) * scale]
+    x = np.array([[7], [-1], [-5], [0], [7]], dtype=CategoricalType) * scale
+    x[1] = -1
+    f = category.CategoryMapper(mappings, missing_value=-1)
+    out = f(x)
+    ans = np.array([[2], [-1], [0], [1], [2]], dtype=CategoricalType)
+    assert np.all(out == ans)
+
+
+def test_categorical_transform_unseen():
+    f = category.CategoryMapper([np.array([1, 2, 3])], missing_value=-1)
+    with pytest.raises(ValueError):
+        f(np.array([[1], [4]], dtype=CategoricalType))
@@ -0,0 +1,128 @@
+"""Tests for the patch extraction module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import warnings
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import tables
+
+from landshark import dataprocess, patch
+from landshark.basetypes import FixedSlice, IndexType
+from landshark.hread import FeatureArray
+from landshark.image import ImageSpec, band_indices
+
+height, width = 11, 7
+
+
+@pytest.fixture
+def feature_array(tmpdir):
+    rnd = np.random.RandomState(1)
+    data = rnd.randint(0, 5, size=(height, width, 2)).astype(np.int32)
+    hfile = tables.open_file(str(tmpdir.join("features.hdf5")), "w")
+    atom = tables.Int32Atom(shape=(2,))
+    carray = hfile.create_carray(hfile.root, "categorical_data", atom=atom,
+                                 shape=(height, width), chunkshape=(3, 4))
+    carray[:] = data
+    yield FeatureArray([carray], 0)
+    hfile.close()
+
+
+@pytest.mark.parametrize("halfwidth", [0, 1, 2])
+@pytest.mark.parametrize("start,stop,cols", [
+    (0, 77, (0, 7)), (3, 5, (0, 7)), (12, 40, (0, 7)), (70, 77, (0, 7)),
+    (0, 44, (2, 6)), (5, 27, (1, 4)), (30, 33, (3, 6))])
+def test_dense_read(feature_array, halfwidth, start, stop, cols):
+    cols = FixedSlice(*cols)
+    window_width = cols.stop - cols.start
+    indices_y, indices_x = np.divmod(np.arange(start, stop), window_width)
+    indices_x = indices_x + cols.start
+    dense = dataprocess._dense_pixels(indices_x, indices_y)
+    assert dense is not None
+    dense_cols, pixels = dense
+    dense = dataprocess._dense_read(feature_array, dense_cols, pixels,
+                                    halfwidth, width, height)
+    p = patch.patches(indices_x, indices_y, halfwidth, width, height)
+    rows = patch.patch_rows(p)
+    slices = dataprocess._slices_from_rows(rows)
+    generic = dataprocess._rows_read(feature_array, p, slices, rows)
+    np.testing.assert_array_equal(dense.data, generic.data)
+    np.testing.assert_array_equal(dense.mask, generic.mask)
+
+
+def test_dense_pixels_gap():
+    indices_x = np.array([0, 1, 3])
+    indices_y = np.array([2, 2, 2])
+    assert dataprocess._dense_pixels(indices_x, indices_y) is None
+    # Rows of a window, but not of the same columns
+    indices_x = np.array([1, 2, 3, 2, 3, 4])
+    indices_y = np.array([2, 2, 2, 3, 3, 3])
+    assert dataprocess._dense_pixels(indices_x, indices_y) is None
+    indices_x = np.array([1, 2, 3, 1, 2, 3])
+    assert dataprocess._dense_pixels(indices_x, indices_y) == \
+        (FixedSlice(1, 4), FixedSlice(6, 12))
+
+
+def test_masked_patches_float16():
+    missing = np.finfo(np.float16).min
+    data = np.array([[[1., missing]], [[2., 3.]]], dtype=np.float16)
+    outside = np.array([[False], [True]])
+    array = SimpleNamespace(missing=missing)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        marray = dataprocess._masked_patches(array, data, outside)
+        filled = marray.filled()
+    np.testing.assert_array_equal(marray.mask, [[[False, True]],
+                                                [[True, True]]])
+    np.testing.assert_array_equal(filled, [[[1., missing]],
+                                           [[missing, missing]]])
+
+
+class _Features:
+    """Stand-in for H5Features with only categorical data."""
+
+    def __init__(self, categorical):
+        self.continuous = None
+        self.categorical = categorical
+
+
+@pytest.mark.parametrize("halfwidth", [0, 1])
+@pytest.mark.parametrize("cols", [(0, 7), (2, 5)])
+def test_process_query_masked(feature_array, monkeypatch, halfwidth, cols):
+    spec = ImageSpec(np.arange(width + 1, dtype=np.float64),
+                     np.arange(height + 1, dtype=np.float64),
+                     {"init": "epsg:4326"})
+    features = _Features(feature_array)
+    indices = band_indices(FixedSlice(2, 6), FixedSlice(*cols))
+    keep = np.random.RandomState(3).rand(indices.shape[0]) < 0.5
+    expected = dataprocess._process_query(indices[keep], features, spec,
+                                          halfwidth)
+
+    # A masked batch of whole rows of a window is still read densely
+    def no_rows_read(*args):
+        raise AssertionError("masked batch was not read densely")
+    monkeypatch.setattr(dataprocess, "_rows_read", no_rows_read)
+    masked = dataprocess._process_query(indices, features, spec, halfwidth,
+                                        keep)
+    assert masked.image_indices.dtype == IndexType
+    np.testing.assert_array_equal(masked.image_indices, indices[keep])
+    np.testing.assert_array_equal(masked.world_coords,
+                                  expected.world_coords)
+    np.testing.assert_array_equal(masked.cat_marray.data,
+                                  expected.cat_marray.data)
+    np.testing.assert_array_equal(masked.cat_marray.mask,
+                                  expected.cat_marray.mask)
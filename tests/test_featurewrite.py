@@ -0,0 +1,86 @@
+"""Tests for the HDF5 feature writing module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import tables
+
+from landshark.basetypes import (ArraySource, CategoricalArraySource,
+                                 CategoricalType, ContinuousArraySource,
+                                 ContinuousType)
+from landshark.featurewrite import (read_valid_counts, write_categorical,
+                                    write_continuous)
+
+con_missing = np.finfo(ContinuousType).min
+cat_missing = np.iinfo(CategoricalType).max
+
+
+class NPArraySource(ArraySource):
+    def __init__(self, x, missing):
+        self._shape = x.shape
+        self._native = 1
+        self._missing = missing
+        self._columns = ["x{}".format(i) for i in range(x.shape[-1])]
+        self._data = x
+
+    def _arrayslice(self, start, stop):
+        return self._data[start:stop]
+
+
+class NPConArraySource(NPArraySource, ContinuousArraySource):
+    pass
+
+
+class NPCatArraySource(NPArraySource, CategoricalArraySource):
+    pass
+
+
+@pytest.fixture
+def sources():
+    rnd = np.random.RandomState(0)
+    con = rnd.randn(6, 5, 2).astype(ContinuousType)
+    cat = rnd.randint(0, 3, size=(6, 5, 1)).astype(CategoricalType)
+    con_hole = rnd.rand(6, 5) < 0.5
+    cat_hole = rnd.rand(6, 5) < 0.5
+    con[con_hole] = con_missing
+    cat[cat_hole] = cat_missing
+    return (NPConArraySource(con, con_missing),
+            NPCatArraySource(cat, cat_missing),
+            ~(con_hole & cat_hole))
+
+
+def test_valid_mask(tmpdir, sources):
+    con, cat, truth = sources
+    path = str(tmpdir.join("features.hdf5"))
+    with tables.open_file(path, "w") as hfile:
+        write_continuous(con, hfile, 0)
+        write_categorical(cat, hfile, 0)
+        np.testing.assert_array_equal(hfile.root.valid.read(), truth)
+    np.testing.assert_array_equal(read_valid_counts(path), truth.sum(axis=1))
+
+
+def test_no_valid_mask_on_add_bands(tmpdir, sources):
+    # A file imported before the mask existed doesn't get one from the
+    # new bands alone
+    con, cat, _ = sources
+    path = str(tmpdir.join("features.hdf5"))
+    with tables.open_file(path, "w") as hfile:
+        write_continuous(con, hfile, 0)
+        hfile.remove_node("/valid")
+        hfile.remove_node("/valid_counts")
+        write_categorical(cat, hfile, 0)
+        assert not hasattr(hfile.root, "valid")
+    assert read_valid_counts(path) is None
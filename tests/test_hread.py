@@ -0,0 +1,98 @@
+"""Tests for the HDF5 feature reading module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import tables
+
+from landshark.basetypes import FixedSlice
+from landshark.hread import (CachedFeatureArray, FeatureArray,
+                             ResidentFeatureArray, RollingFeatureArray)
+
+
+@pytest.fixture
+def feature_array(tmpdir):
+    rnd = np.random.RandomState(0)
+    data = rnd.randn(23, 17, 3).astype(np.float32)
+    hfile = tables.open_file(str(tmpdir.join("features.hdf5")), "w")
+    atom = tables.Float32Atom(shape=(3,))
+    carray = hfile.create_carray(hfile.root, "continuous_data", atom=atom,
+                                 shape=(23, 17), chunkshape=(4, 5))
+    carray[:] = data
+    yield FeatureArray([carray], None), data
+    hfile.close()
+
+
+def test_feature_array_chunkshape(feature_array):
+    array, _ = feature_array
+    assert array.chunkshape == (4, 5)
+
+
+@pytest.mark.parametrize("max_bytes", [1, 4 * 5 * 3 * 4 * 6, 1 << 20])
+def test_cached_feature_array(feature_array, max_bytes):
+    array, data = feature_array
+    cached = CachedFeatureArray(array, max_bytes)
+    assert cached.shape == array.shape
+    assert len(cached) == 23
+    keys = [slice(None), slice(3, 11), 7, -1, (5, slice(2, 13)),
+            (slice(0, 23), 16), (slice(9, 21), slice(4, 6)), (2, 3),
+            slice(6, 6)]
+    for k in keys:
+        np.testing.assert_array_equal(cached[k], data[k])
+    assert cached.misses > 0
+    before = cached.misses
+    cached[1, 1]
+    cached[1, 1]
+    assert cached.hits > 0 and cached.misses <= before + 1
+
+
+def test_resident_feature_array(feature_array):
+    array, data = feature_array
+    resident = ResidentFeatureArray(array, FixedSlice(6, 19))
+    assert resident.shape == array.shape
+    assert resident.chunkshape == array.chunkshape
+    keys = [slice(6, 19), 6, 18, (slice(8, 12), slice(3, 9)), (10, 4)]
+    for k in keys:
+        np.testing.assert_array_equal(resident[k], data[k])
+    with pytest.raises(AssertionError):
+        resident[2:8]
+
+
+def test_rolling_feature_array(feature_array):
+    array, data = feature_array
+    rolling = RollingFeatureArray(array)
+    assert rolling.shape == array.shape
+    for start, stop in [(0, 5), (3, 9), (3, 9), (7, 12), (20, 23), (0, 23),
+                        (4, 4)]:
+        np.testing.assert_array_equal(rolling[start:stop],
+                                      data[start:stop])
+    np.testing.assert_array_equal(rolling[2, 3:5], data[2, 3:5])
+    assert rolling.rows_reused == 2 + 6 + 2 + 3 + 0
+    assert rolling.rows_read == 5 + 4 + 0 + 3 + 3 + 20
+
+
+def test_rolling_feature_array_columns(feature_array):
+    array, data = feature_array
+    rolling = RollingFeatureArray(array)
+    for start, stop in [(0, 5), (3, 9)]:
+        np.testing.assert_array_equal(rolling[start:stop, 4:11],
+                                      data[start:stop, 4:11])
+    assert rolling.rows_reused == 2
+    # Other columns start afresh
+    np.testing.assert_array_equal(rolling[5:9, 2:6], data[5:9, 2:6])
+    np.testing.assert_array_equal(rolling[5:9], data[5:9])
+    assert rolling.rows_reused == 2
+    assert rolling.rows_read == 5 + 4 + 4 + 4
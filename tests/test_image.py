@@ -20,7 +20,7 @@ import numpy as np
 import pytest
 
 from landshark import image
-from landshark.basetypes import IndexType
+from landshark.basetypes import FixedSlice, IndexType
 
 SEED = 666
 
@@ -159,35 +159,10 @@ def test_strip_image_spec(nstrips, rows, cols):
     assert np.all(y_coords == y_coords_new)
 
 
-@pytest.mark.parametrize("nstrips,rows,cols",
-                         [(1, 10, 3), (3, 3, 10), (4, 101, 102)])
-def test_indices_strip(nstrips, rows, cols):
-    # coords are 1 past last pixel
-    x_coords = np.arange(cols + 1)
-    y_coords = np.arange(rows + 1)
-    crs = {"init": "egs123"}
-    spec = image.ImageSpec(x_coords, y_coords, crs)
-    batchsize = 10
-    xy_inds = []
-    n = 0
-    for i in range(nstrips):
-        it_i, n_i = image.indices_strip(spec, i + 1, nstrips, batchsize)
-        n += n_i
-        for xy in it_i:
-            assert xy.shape[0] <= batchsize
-            assert xy.shape[1] == 2
-            x, y = xy.T
-            xy_inds.append(xy)
-    xy_inds = np.concatenate(xy_inds, axis=0)
-    assert n == rows * cols
-    ans = np.fliplr(np.array(list(product(range(rows), range(cols)))))
-    assert np.all(xy_inds == ans)
-
-
 @pytest.mark.parametrize("total_size, nstrips",
                          [(100, 4), (10, 10), (7, 2), (8, 1)])
 def test_strip_slices(total_size, nstrips):
-    slice_list = image._strip_slices(total_size, nstrips)
+    slice_list = image.strip_slices(total_size, nstrips)
     assert len(slice_list) == nstrips
     assert slice_list[0].start == 0
     for i in range(1, len(slice_list)):
@@ -195,36 +170,97 @@ def test_strip_slices(total_size, nstrips):
     assert slice_list[-1].stop == total_size
 
 
-def test_array_pair_it():
-    """Test the convenience function for manipulating the batch iterators."""
-    x = np.random.randn(10, 2)
-    x_list = x.tolist()
-    out = image._array_pair_it(x_list)
-    assert np.all(out == np.fliplr(x))
-
-
-def test_indices_query():
-    """Check we get consistent image coodinates in the batch generator."""
-    batchsize = 10
-    width = 20
-    height = 10
-    # Fake up some image coord data, make coords equal indices
-    x = np.arange(width)
-    y = np.arange(height)
-    xy = np.array(list(product(y, x)))[..., ::-1]
-
-    # Make the generator
-    coord_gen = image._indices_query(width, height, batchsize)
-
-    coord_accum = []
-    for c in coord_gen:
-
-        # Test sensible batch sizes
-        assert c.shape[0] <= batchsize
-        assert c.shape[1] == 2
+@pytest.mark.parametrize("nstrips", [1, 2, 3, 7, 20])
+def test_balanced_strip_slices(nstrips):
+    rnd = np.random.RandomState(SEED)
+    counts = rnd.randint(0, 50, size=20)
+    counts[:8] = 0
+    slices = image.balanced_strip_slices(counts, nstrips)
+    assert len(slices) == nstrips
+    assert slices[0].start == 0
+    assert slices[-1].stop == 20
+    for a, b in zip(slices[:-1], slices[1:]):
+        assert a.stop == b.start
+    assert all(s.stop > s.start for s in slices)
+    work = np.array([counts[s.start:s.stop].sum() for s in slices])
+    assert work.max() - work.min() <= 2 * counts.max()
+    if nstrips == 2:
+        assert slices[0].stop > 10
+    zeros = np.zeros(20, dtype=int)
+    assert image.balanced_strip_slices(zeros, nstrips) == \
+        image.strip_slices(20, nstrips)
+
+
+@pytest.mark.parametrize("ntiles_y,ntiles_x,rows,cols",
+                         [(1, 1, 10, 3), (3, 2, 3, 10), (4, 5, 101, 102)])
+def test_tile_window(ntiles_y, ntiles_x, rows, cols):
+    x_coords = np.arange(cols + 1, dtype=np.float64)
+    y_coords = np.arange(rows + 1, dtype=np.float64)
+    spec = image.ImageSpec(x_coords, y_coords, {"init": "egs123"})
+    ntiles = ntiles_y * ntiles_x
+    covered = np.zeros((rows, cols), dtype=int)
+    for i in range(ntiles):
+        window = image.tile_window(i + 1, ntiles_y, ntiles_x, spec)
+        assert window.footprint is None
+        covered[window.rows.start:window.rows.stop,
+                window.cols.start:window.cols.stop] += 1
+        wspec = image.window_image_spec(spec, window)
+        np.testing.assert_array_equal(
+            wspec.x_coordinates, x_coords[window.cols.start:
+                                          window.cols.stop + 1])
+    assert np.all(covered == 1)
+    if ntiles_x > 1:
+        first = image.tile_window(1, ntiles_y, ntiles_x, spec)
+        second = image.tile_window(2, ntiles_y, ntiles_x, spec)
+        assert second.rows == first.rows
+        assert second.cols.start == first.cols.stop
+
+
+@pytest.mark.parametrize("nstrips,rows,cols,batchsize,chunk_rows",
+                         [(1, 10, 3, 10, 4), (3, 13, 10, 35, 2),
+                          (4, 101, 102, 5000, 16), (2, 9, 5, 1, 3)])
+def test_row_bands(nstrips, rows, cols, batchsize, chunk_rows):
+    xy_inds = []
+    for strip in image.strip_slices(rows, nstrips):
+        bands = image.row_bands(strip, cols, batchsize, chunk_rows)
+        assert bands[0].start == strip.start
+        assert bands[-1].stop == strip.stop
+        height = image._band_rows(max(1, batchsize // cols), chunk_rows)
+        assert height % chunk_rows == 0 or chunk_rows % height == 0
+        for b in bands:
+            assert 0 < b.stop - b.start <= height
+            assert b.stop == strip.stop or b.stop % height == 0
+            xy_inds.append(image.band_indices(b, FixedSlice(0, cols)))
+    xy_inds = np.concatenate(xy_inds, axis=0)
+    ans = np.fliplr(np.array(list(product(range(rows), range(cols)))))
+    assert np.all(xy_inds == ans)
 
-        coord_accum.append(c)
 
-    # Test we can reconstruct the labels array
-    coord_accum = np.concatenate(coord_accum)
-    assert np.all(coord_accum == xy)
+def test_window():
+    x_coords = np.arange(11, dtype=np.float64) * 2.
+    y_coords = 100. - np.arange(8, dtype=np.float64)
+    spec = image.ImageSpec(x_coords, y_coords, {"init": "egs123"})
+    rows, cols = image.window_slices(spec, (3., 94.5, 8., 96.))
+    assert rows == FixedSlice(4, 6)
+    assert cols == FixedSlice(1, 4)
+    window = image.ImageWindow(rows, cols)
+    wspec = image.window_image_spec(spec, window)
+    assert (wspec.height, wspec.width) == (2, 3)
+    np.testing.assert_array_equal(wspec.x_coordinates, [2., 4., 6., 8.])
+    np.testing.assert_array_equal(wspec.y_coordinates, [96., 95., 94.])
+    xy = image.band_indices(rows, cols)
+    np.testing.assert_array_equal(xy, [[1, 4], [2, 4], [3, 4],
+                                       [1, 5], [2, 5], [3, 5]])
+    empty_rows, _ = image.window_slices(spec, (3., 200., 8., 300.))
+    assert empty_rows.stop == empty_rows.start
+
+
+def test_window_partial_pixels():
+    x_coords = np.arange(11, dtype=np.float64) * 2.
+    y_coords = 100. - np.arange(8, dtype=np.float64)
+    spec = image.ImageSpec(x_coords, y_coords, {"init": "egs123"})
+    # box edges between the pixel boundaries and centres: every pixel
+    # overlapping the box is selected, not just the one centred in it
+    rows, cols = image.window_slices(spec, (3.5, 94.7, 6.5, 96.3))
+    assert rows == FixedSlice(3, 6)
+    assert cols == FixedSlice(1, 4)
@@ -0,0 +1,32 @@
+"""Tests for the metadata module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from landshark.basetypes import CategoricalType, ContinuousType
+from landshark.metadata import CategoricalFeatureSet, ContinuousFeatureSet
+
+
+def test_feature_set_dtype_default():
+    # Feature sets pickled before compact storage have no dtype
+    con = ContinuousFeatureSet(["a"], -1., None, np.float16)
+    cat = CategoricalFeatureSet(["b"], -1, np.array([2]),
+                                [np.array([3, 5])], [np.array([1, 1])],
+                                np.uint8)
+    assert con.dtype == np.float16 and cat.dtype == np.uint8
+    del con._dtype, cat._dtype
+    assert con.dtype == ContinuousType
+    assert cat.dtype == CategoricalType
@@ -0,0 +1,109 @@
+"""Test normalise module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import warnings
+
+import numpy as np
+
+from landshark import normalise
+from landshark.basetypes import FixedSlice
+
+
+def test_statcounter_merge():
+    rnd = np.random.RandomState(42)
+    x = rnd.randn(100, 3) * 5. + 2.
+    mask = rnd.rand(100, 3) < 0.2
+    mask[40:60, 2] = True
+    xm = np.ma.MaskedArray(data=x, mask=mask)
+
+    blocks = [normalise.StatCounter(3) for _ in range(3)]
+    for b, s in zip(blocks, [slice(0, 40), slice(40, 60), slice(60, 100)]):
+        b.update(xm[s])
+    stats = normalise.StatCounter(3)
+    for b in blocks:
+        stats.merge(b)
+
+    assert np.all(stats.count == np.ma.count(xm, axis=0))
+    assert np.allclose(stats.mean, np.ma.mean(xm, axis=0).data)
+    assert np.allclose(stats.sd, np.ma.std(xm, axis=0).data)
+
+
+def test_stats_worker():
+    x = np.array([[[1., -1.], [2., 4.]], [[3., -1.], [-1., 8.]]])
+    stats = normalise._StatsWorker(missing=-1.)((0, x))
+    assert np.all(stats.count == [3, 2])
+    assert np.allclose(stats.mean, [2., 6.])
+    assert np.allclose(stats.sd, [np.sqrt(2. / 3.), 2.])
+
+
+def test_stats_worker_merged_quantiles():
+    rnd = np.random.RandomState(5)
+    x = rnd.lognormal(size=(1000, 50, 2)) * [1., 100.]
+    worker = normalise._StatsWorker(missing=None, sketch=True)
+    stats = normalise.StatCounter(2, sketch=True)
+    blocks = [worker((i, x[i:i + 10])) for i in range(0, 1000, 10)]
+    for b in blocks:
+        stats.merge(b)
+    assert np.all(stats.count == 50000)
+    q = [0.05, 0.25, 0.5, 0.75, 0.95]
+    expected = np.quantile(x.reshape((-1, 2)), q, axis=0)
+    rank_tol = 0.02
+    lower = np.quantile(x.reshape((-1, 2)), np.subtract(q, rank_tol), axis=0)
+    upper = np.quantile(x.reshape((-1, 2)), np.add(q, rank_tol), axis=0)
+    values = stats.quantiles(q)
+    assert values.shape == expected.shape
+    assert np.all((values >= lower) & (values <= upper))
+    # each block and band compacts with its own random stream
+    draws = {s._rnd.randint(1 << 30) for b in blocks[:3] for s in b._sketches}
+    assert len(draws) == 6
+
+
+def test_stratified_sample():
+    slices = [FixedSlice(i, i + 1) for i in range(10)]
+    sample = normalise._stratified_sample(slices, 0.3, seed=1)
+    assert len(sample) == 3
+    starts = [s.start for s in sample]
+    assert 0 <= starts[0] < 3 and 3 <= starts[1] < 6 and 6 <= starts[2] < 10
+    assert len(normalise._stratified_sample(slices, 0.01, seed=1)) == 2
+
+
+def test_statcounter_split_stack():
+    rnd = np.random.RandomState(3)
+    xm = np.ma.MaskedArray(data=rnd.randn(50, 3), mask=rnd.rand(50, 3) < .1)
+    stats = normalise.StatCounter(3, sketch=True)
+    stats.update(xm)
+    parts = stats.split()
+    assert len(parts) == 3 and all(p.sketched for p in parts)
+    assert np.allclose(parts[1].mean, stats.mean[1])
+    joined = normalise.StatCounter.stack(parts)
+    assert np.allclose(joined.mean, stats.mean)
+    assert np.allclose(joined.sd, stats.sd)
+    assert np.allclose(joined.median, stats.median)
+
+
+def test_normaliser_float16_overflow():
+    x = np.array([[1., -1., 1e6], [-1e6, 3., 5.]], dtype=np.float32)
+    f = normalise.Normaliser(np.array([0., 0., 0.]), np.array([1., 1., 1.]),
+                             missing=-1., dtype=np.float16)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        y = f(x)
+    info = np.finfo(np.float16)
+    assert y.dtype == np.float16 and np.all(np.isfinite(y))
+    assert y[0, 1] == info.min
+    assert y[0, 2] == info.max
+    assert info.min < y[1, 0] < -65000.
+    assert np.all(y[[0, 1, 1], [0, 1, 2]] == [1., 3., 5.])
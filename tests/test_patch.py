@@ -26,15 +26,13 @@ def test_patch_00():
     im_height = 5
 
     image = np.arange((im_height * im_width)).reshape((im_height, im_width))
-    n = 2 * halfwidth + 1
 
     #  0,0 corner
-    p_data = np.zeros((n, n), dtype=int) - 1
     x = np.array([0])
     y = np.array([0])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in patch_rws:
-        p_data[r.yp, r.xp] = image[r.y, r.x]
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_data = patch.gather(p, image, np.arange(im_height))[0]
+    p_data[patch.patch_mask(p)[0]] = -1
 
     true_answer = np.array([[-1, -1, -1],
                             [-1, 0, 1],
@@ -47,15 +45,12 @@ def test_patch_00_mask():
     halfwidth = 1
     im_width = 5
     im_height = 5
-    n = 2 * halfwidth + 1
 
     #  0,0 corner
-    p_mask = np.zeros((n, n), dtype=bool)
     x = np.array([0])
     y = np.array([0])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in mask_ws:
-        p_mask[r.yp, r.xp] = True
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_mask = patch.patch_mask(p)[0]
 
     true_answer = np.array([[True, True, True],
                             [True, False, False],
@@ -70,15 +65,13 @@ def test_patch_44():
     im_height = 5
 
     image = np.arange((im_height * im_width)).reshape((im_height, im_width))
-    n = 2 * halfwidth + 1
 
     # 4,4 corner
-    p_data = np.zeros((n, n), dtype=int) - 1
     x = np.array([4])
     y = np.array([4])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in patch_rws:
-        p_data[r.yp, r.xp] = image[r.y, r.x]
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_data = patch.gather(p, image, np.arange(im_height))[0]
+    p_data[patch.patch_mask(p)[0]] = -1
     true_answer = np.array([[18, 19, -1],
                             [23, 24, -1],
                             [-1, -1, -1]], dtype=int)
@@ -90,15 +83,12 @@ def test_patch_44_mask():
     halfwidth = 1
     im_width = 5
     im_height = 5
-    n = 2 * halfwidth + 1
 
     #  0,0 corner
-    p_mask = np.zeros((n, n), dtype=bool)
     x = np.array([4])
     y = np.array([4])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in mask_ws:
-        p_mask[r.yp, r.xp] = True
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_mask = patch.patch_mask(p)[0]
 
     true_answer = np.array([[False, False, True],
                             [False, False, True],
@@ -113,16 +103,14 @@ def test_patch_02():
     im_height = 5
 
     image = np.arange((im_height * im_width)).reshape((im_height, im_width))
-    n = 2 * halfwidth + 1
 
     # 0,2 edge
-    p_data = np.zeros((n, n), dtype=int) - 1
     x = np.array([0])
     y = np.array([2])
 
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in patch_rws:
-        p_data[r.yp, r.xp] = image[r.y, r.x]
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_data = patch.gather(p, image, np.arange(im_height))[0]
+    p_data[patch.patch_mask(p)[0]] = -1
     true_answer = np.array([[-1, 5, 6],
                             [-1, 10, 11],
                             [-1, 15, 16]], dtype=int)
@@ -134,15 +122,12 @@ def test_patch_02_mask():
     halfwidth = 1
     im_width = 5
     im_height = 5
-    n = 2 * halfwidth + 1
 
     #  0,0 corner
-    p_mask = np.zeros((n, n), dtype=bool)
     x = np.array([0])
     y = np.array([2])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in mask_ws:
-        p_mask[r.yp, r.xp] = True
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_mask = patch.patch_mask(p)[0]
 
     true_answer = np.array([[True, False, False],
                             [True, False, False],
@@ -158,15 +143,13 @@ def test_patch_20():
     im_height = 5
 
     image = np.arange((im_height * im_width)).reshape((im_height, im_width))
-    n = 2 * halfwidth + 1
 
     # 2,0 edge
-    p_data = np.zeros((n, n), dtype=int) - 1
     x = np.array([2])
     y = np.array([0])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in patch_rws:
-        p_data[r.yp, r.xp] = image[r.y, r.x]
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_data = patch.gather(p, image, np.arange(im_height))[0]
+    p_data[patch.patch_mask(p)[0]] = -1
     true_answer = np.array([[-1, -1, -1],
                             [1, 2, 3],
                             [6, 7, 8]], dtype=int)
@@ -178,18 +161,48 @@ def test_patch_20_mask():
     halfwidth = 1
     im_width = 5
     im_height = 5
-    n = 2 * halfwidth + 1
 
     #  0,0 corner
-    p_mask = np.zeros((n, n), dtype=bool)
     x = np.array([2])
     y = np.array([0])
-    patch_rws, mask_ws = patch.patches(x, y, halfwidth, im_width, im_height)
-    for r in mask_ws:
-        p_mask[r.yp, r.xp] = True
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    p_mask = patch.patch_mask(p)[0]
 
     true_answer = np.array([[True, True, True],
                             [False, False, False],
                             [False, False, False]], dtype=bool)
 
     assert np.all(true_answer == p_mask)
+
+
+def test_patch_block_gather():
+    """Check patches gathered from a block of rows match the whole image."""
+    halfwidth = 2
+    im_width = 7
+    im_height = 9
+    image = np.arange((im_height * im_width)).reshape((im_height, im_width))
+
+    x = np.array([0, 3, 6, 2])
+    y = np.array([0, 8, 4, 5])
+    p = patch.patches(x, y, halfwidth, im_width, im_height)
+    rows = patch.patch_rows(p)
+    np.testing.assert_array_equal(rows, [0, 1, 2, 3, 4, 5, 6, 7, 8])
+
+    full = patch.gather(p, image, np.arange(im_height))
+    mask = patch.patch_mask(p)
+    assert full.shape == mask.shape == (4, 5, 5)
+    assert np.all(full[mask] == 0)
+    for i in range(4):
+        yy, xx = y[i] + np.arange(-2, 3), x[i] + np.arange(-2, 3)
+        for a in range(5):
+            for b in range(5):
+                inside = 0 <= yy[a] < im_height and 0 <= xx[b] < im_width
+                assert mask[i, a, b] != inside
+                if inside:
+                    assert full[i, a, b] == image[yy[a], xx[b]]
+
+    q = patch.PatchIndices(*(a[1:3] for a in p))
+    block_rows = patch.patch_rows(q)
+    block = image[block_rows, 1:]
+    np.testing.assert_array_equal(patch.gather(q, block, block_rows, 1),
+                                  full[1:3])
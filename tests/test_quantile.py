@@ -0,0 +1,61 @@
+"""Test quantile module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+
+from landshark.quantile import QuantileSketch
+
+q = np.array([0.01, 0.25, 0.5, 0.75, 0.99])
+
+
+def _rank_error(x, values):
+    ranks = np.searchsorted(np.sort(x), values) / x.shape[0]
+    return np.max(np.abs(ranks - q))
+
+
+def test_small_stream_is_exact():
+    x = np.arange(100.)
+    sketch = QuantileSketch(k=200)
+    sketch.update(x)
+    assert len(sketch) == 100
+    assert np.all(sketch.quantile([0., 0.5, 1.]) == [0., 49., 99.])
+
+
+def test_quantile_sketch_accuracy():
+    rnd = np.random.RandomState(0)
+    x = rnd.standard_cauchy(100000)
+    sketch = QuantileSketch(k=200, seed=1)
+    for b in np.array_split(x, 37):
+        sketch.update(b)
+    assert len(sketch) == x.shape[0]
+    assert _rank_error(x, sketch.quantile(q)) < 0.02
+
+
+def test_quantile_sketch_merge():
+    rnd = np.random.RandomState(1)
+    x = rnd.lognormal(size=50000)
+    sketches = [QuantileSketch(seed=i) for i in range(5)]
+    for s, b in zip(sketches, np.array_split(x, 5)):
+        s.update(b)
+    merged = QuantileSketch(seed=9)
+    for s in sketches:
+        merged.merge(s)
+    assert len(merged) == x.shape[0]
+    assert _rank_error(x, merged.quantile(q)) < 0.02
+
+
+def test_empty_sketch():
+    assert np.all(np.isnan(QuantileSketch().quantile([0.5])))
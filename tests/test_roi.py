@@ -0,0 +1,95 @@
+"""Tests for the region of interest module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import numpy as np
+import pytest
+import shapefile
+
+from landshark import errors, roi
+from landshark.basetypes import FixedSlice
+from landshark.image import ImageSpec
+
+# 10 x 8 pixels of side 1, with y decreasing down the rows
+spec = ImageSpec(np.arange(11, dtype=np.float64),
+                 8. - np.arange(9, dtype=np.float64), {"init": "egs123"})
+
+square = [(2., 1.), (5., 1.), (5., 4.), (2., 4.), (2., 1.)]
+
+
+@pytest.fixture(params=["geojson", "shp"])
+def roi_file(request, tmpdir):
+    if request.param == "geojson":
+        path = str(tmpdir.join("roi.geojson"))
+        feature = {"type": "Feature", "properties": {},
+                   "geometry": {"type": "Polygon",
+                                "coordinates": [[list(p) for p in square]]}}
+        with open(path, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": [feature]},
+                      f)
+    else:
+        path = str(tmpdir.join("roi.shp"))
+        with shapefile.Writer(path) as w:
+            w.field("id", "N")
+            w.poly([square])
+            w.record(1)
+    return path
+
+
+def test_read_roi(roi_file):
+    geometries = roi.read_roi(roi_file)
+    assert len(geometries) == 1
+    assert roi.roi_bounds(geometries) == (2., 1., 5., 4.)
+
+
+def test_query_window_roi(roi_file):
+    window, window_spec = roi.query_window(spec, roi=roi_file)
+    assert window.rows == FixedSlice(4, 7)
+    assert window.cols == FixedSlice(2, 5)
+    assert (window_spec.height, window_spec.width) == (3, 3)
+    assert window.footprint.shape == (3, 3)
+    assert window.footprint.all()
+
+
+def test_query_window_bbox():
+    window, window_spec = roi.query_window(spec, bbox=(0.5, 6.5, 3., 7.))
+    assert window.rows == FixedSlice(1, 2)
+    assert window.cols == FixedSlice(0, 3)
+    assert window.footprint is None
+    np.testing.assert_array_equal(window_spec.x_coordinates, [0., 1., 2., 3.])
+
+
+def test_query_window_triangle(tmpdir):
+    path = str(tmpdir.join("roi.geojson"))
+    triangle = [[0., 0.], [10., 0.], [0., 8.], [0., 0.]]
+    with open(path, "w") as f:
+        json.dump({"type": "Polygon", "coordinates": [triangle]}, f)
+    window, _ = roi.query_window(spec, roi=path)
+    assert window.rows == FixedSlice(0, 8)
+    assert window.cols == FixedSlice(0, 10)
+    assert window.footprint[-1, 0] and not window.footprint[0, -1]
+    assert 0 < window.footprint.sum() < 80
+
+
+def test_roi_outside_image():
+    with pytest.raises(errors.RoiOutsideImage):
+        roi.query_window(spec, bbox=(20., 20., 30., 30.))
+
+
+def test_unknown_roi_format(tmpdir):
+    with pytest.raises(errors.UnknownRoiFormat):
+        roi.read_roi(str(tmpdir.join("roi.kml")))
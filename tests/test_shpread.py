@@ -0,0 +1,75 @@
+"""Tests for the shapefile reading module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import struct
+
+import numpy as np
+import pytest
+import shapefile
+
+from landshark import shpread
+from landshark.basetypes import FixedSlice
+from landshark.shpread import (ContinuousShpArraySource,
+                               CoordinateShpArraySource)
+
+
+@pytest.fixture
+def points_file(tmpdir):
+    path = str(tmpdir.join("points.shp"))
+    with shapefile.Writer(path) as w:
+        w.field("value", "N", decimal=3)
+        for i in range(5):
+            w.point(float(i), 10. + i)
+            w.record(1.5 * i)
+    return path
+
+
+def _delete_records(path, indices):
+    """Flag records of a shapefile's DBF table as deleted."""
+    dbf = path[:-len(".shp")] + ".dbf"
+    with open(dbf, "r+b") as f:
+        header_len, record_len = struct.unpack("<8xHH", f.read(12))
+        for i in indices:
+            f.seek(header_len + i * record_len)
+            f.write(b"*")
+
+
+def _read_all(src):
+    with src:
+        return src(FixedSlice(0, src.shape[0]))
+
+
+@pytest.mark.parametrize("mapped", [True, False])
+def test_deleted_records(points_file, monkeypatch, mapped):
+    _delete_records(points_file, [0, 3])
+    if not mapped:
+        monkeypatch.setattr(shpread, "_map_dbf_columns",
+                            lambda f, labels: None)
+        monkeypatch.setattr(shpread, "_map_shp_points", lambda f: None)
+    values = ContinuousShpArraySource(points_file, ["value"])
+    coords = CoordinateShpArraySource(points_file)
+    assert values.shape == (3, 1) and coords.shape == (3, 2)
+    np.testing.assert_array_equal(_read_all(values), [[1.5], [3.], [6.]])
+    np.testing.assert_array_equal(_read_all(coords),
+                                  [[1., 11.], [2., 12.], [4., 14.]])
+
+
+def test_no_deleted_records(points_file):
+    assert shpread._kept_records(points_file) is None
+    values = ContinuousShpArraySource(points_file, ["value"])
+    np.testing.assert_array_equal(_read_all(values)[:, 0],
+                                  1.5 * np.arange(5))
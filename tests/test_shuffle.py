@@ -0,0 +1,122 @@
+"""Tests for the out-of-core shuffle."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from landshark import shuffle
+from landshark.basetypes import (ArraySource, CategoricalArraySource,
+                                 CategoricalType, ContinuousArraySource,
+                                 ContinuousType, FixedSlice)
+from landshark.iteration import batch_slices
+
+
+class NPArraySource(ArraySource):
+    def __init__(self, x):
+        self._shape = x.shape
+        self._native = 1
+        self._missing = None
+        self._columns = ["x{}".format(i) for i in range(x.shape[-1])]
+        self._data = x
+
+    def _arrayslice(self, start, stop):
+        return self._data[start:stop]
+
+
+class NPConArraySource(NPArraySource, ContinuousArraySource):
+    pass
+
+
+class NPCatArraySource(NPArraySource, CategoricalArraySource):
+    pass
+
+
+def _read_all(src, batchsize):
+    with src:
+        data = np.concatenate([src(s) for s in
+                               batch_slices(batchsize, src.shape[0])])
+    return data
+
+
+@pytest.fixture
+def small_buckets(monkeypatch):
+    monkeypatch.setattr(shuffle, "BUCKET_ROWS", 50)
+    monkeypatch.setattr(shuffle, "ID_BLOCK_ROWS", 16)
+
+
+def test_bucket_ids(small_buckets):
+    ids = shuffle.bucket_ids(3, 0, 200, 4)
+    assert ids.shape == (200,)
+    assert set(ids) == {0, 1, 2, 3}
+    np.testing.assert_array_equal(shuffle.bucket_ids(3, 37, 101, 4),
+                                  ids[37:101])
+    assert not np.array_equal(shuffle.bucket_ids(4, 0, 200, 4), ids)
+
+
+def test_bucket_ids_streamed(small_buckets, monkeypatch):
+    draws = []
+    random_state = np.random.RandomState
+
+    def counted(seed):
+        draws.append(seed)
+        return random_state(seed)
+
+    monkeypatch.setattr(np.random, "RandomState", counted)
+    row_ids = shuffle._BucketIds(3, 4)
+    ids = np.concatenate([row_ids(s, min(s + 5, 200))
+                          for s in range(0, 200, 5)])
+    assert len(draws) == 13  # each block of 16 rows drawn once
+    np.testing.assert_array_equal(ids, shuffle.bucket_ids(3, 0, 200, 4))
+
+
+def test_n_buckets(small_buckets):
+    assert shuffle.n_buckets(0) == 1
+    assert shuffle.n_buckets(50) == 1
+    assert shuffle.n_buckets(51) == 2
+
+
+@pytest.mark.parametrize("batchsize", [7, 200])
+def test_bucket_shuffle(tmpdir, small_buckets, batchsize):
+    n = 173
+    rows = np.arange(n)
+    con = NPConArraySource(np.stack((rows, -rows), axis=1)
+                           .astype(ContinuousType))
+    cat = NPCatArraySource(rows[:, np.newaxis].astype(CategoricalType))
+    con_shuffled = shuffle.bucket_shuffle(con, str(tmpdir), "con", 5,
+                                          batchsize)
+    cat_shuffled = shuffle.bucket_shuffle(cat, str(tmpdir), "cat", 5, 11)
+    assert con_shuffled.shape == con.shape
+    assert con_shuffled.dtype == ContinuousType
+    assert con_shuffled.columns == con.columns
+    assert cat_shuffled.dtype == CategoricalType
+    x_con = _read_all(con_shuffled, 13)
+    x_cat = _read_all(cat_shuffled, 64)
+    perm = x_cat[:, 0]
+    assert sorted(perm) == list(rows)
+    assert not np.array_equal(perm, rows)
+    np.testing.assert_array_equal(x_con[:, 0], perm)
+    np.testing.assert_array_equal(x_con[:, 1], -perm)
+
+
+def test_bucket_source_reads(tmpdir, small_buckets):
+    n = 120
+    src = NPConArraySource(np.arange(n, dtype=ContinuousType)[:, None])
+    shuffled = shuffle.bucket_shuffle(src, str(tmpdir), "x", 1, 40)
+    x = _read_all(shuffled, n)
+    with shuffled:
+        for start, stop in [(0, 0), (10, 70), (45, 46), (0, n)]:
+            np.testing.assert_array_equal(
+                shuffled(FixedSlice(start, stop)), x[start:stop])
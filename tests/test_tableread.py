@@ -0,0 +1,105 @@
+"""Tests for the table target reading module."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import tables
+
+from landshark import errors, tableread
+from landshark.basetypes import (CategoricalType, ContinuousType,
+                                 CoordinateType, FixedSlice)
+
+x = np.array([1.5, 2.5, 3.5, 4.5, 5.5])
+y = np.array([-1., -2., -3., -4., -5.])
+z = np.array([0.1, np.nan, 0.3, 0.4, 0.5])
+c = np.array([3, 1, 4, 1, 5])
+
+
+@pytest.fixture(params=["csv", "h5"])
+def table_file(request, tmpdir):
+    if request.param == "csv":
+        path = str(tmpdir.join("points.csv"))
+        with open(path, "w") as f:
+            f.write("lon, lat,z,c\n")
+            for row in zip(x, y, z, c):
+                f.write("{},{},{},{}\n".format(
+                    *["" if v != v else v for v in row]))
+    else:
+        path = str(tmpdir.join("points.h5"))
+        rec = np.rec.fromarrays([x, y, z, c], names="lon,lat,z,c")
+        with tables.open_file(path, "w") as hfile:
+            hfile.create_table("/", "points", rec)
+    return path
+
+
+def _read_all(src):
+    with src:
+        data = src(FixedSlice(0, src.shape[0]))
+    return data
+
+
+def test_read_table_columns(table_file):
+    data = tableread.read_table_columns(table_file, ["z", "lon"])
+    assert data.dtype == np.float64
+    np.testing.assert_array_equal(data, np.stack((z, x), axis=1))
+
+
+def test_table_sources(table_file):
+    coords = _read_all(tableread.CoordinateTableArraySource(
+        table_file, "lon", "lat"))
+    con_src = tableread.ContinuousTableArraySource(table_file, ["z"])
+    cat_src = tableread.CategoricalTableArraySource(table_file, ["c"])
+    con, cat = _read_all(con_src), _read_all(cat_src)
+    assert coords.dtype == CoordinateType
+    assert con.dtype == ContinuousType
+    assert cat.dtype == CategoricalType
+    assert con_src.shape == (5, 1)
+    assert con_src.columns == ["z"]
+    np.testing.assert_array_equal(coords, np.stack((x, y), axis=1))
+    np.testing.assert_array_equal(con[:, 0], z.astype(ContinuousType))
+    np.testing.assert_array_equal(cat[:, 0], c)
+
+
+def test_unknown_columns(table_file):
+    with pytest.raises(errors.UnknownTableColumns):
+        tableread.ContinuousTableArraySource(table_file, ["z", "w"])
+
+
+def test_missing_categorical(table_file):
+    with pytest.raises(errors.MissingCategoricalValues):
+        tableread.CategoricalTableArraySource(table_file, ["z"])
+
+
+def test_unknown_format(tmpdir):
+    path = str(tmpdir.join("points.xlsx"))
+    with pytest.raises(errors.UnknownTableFormat):
+        tableread.read_table_columns(path, ["z"])
+
+
+def test_csv_line_endings(tmpdir):
+    path = str(tmpdir.join("points.csv"))
+    with open(path, "w", newline="") as f:
+        f.write("lon,lat,z\r\n1.5,-1, \r\n2.5,-2,0.2\r\n")
+    data = tableread.read_table_columns(path, ["z", "lon"])
+    np.testing.assert_array_equal(data, [[np.nan, 1.5], [0.2, 2.5]])
+
+
+def test_ragged_csv(tmpdir):
+    path = str(tmpdir.join("points.csv"))
+    with open(path, "w") as f:
+        f.write("lon,lat,z\n1.5,-1,0.1\n2.5,-2\n")
+    with pytest.raises(errors.RaggedCsvRows):
+        tableread.read_table_columns(path, ["z"])
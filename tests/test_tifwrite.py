@@ -0,0 +1,81 @@
+"""Tests for the GeoTIFF prediction writer."""
+
+# Copyright 2019 CSIRO (Data61)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import rasterio as rs
+import tables
+
+from landshark.featurewrite import create_valid_mask
+from landshark.image import ImageSpec
+from landshark.metadata import CategoricalTarget
+from landshark.tifwrite import BatchWriter, target_outputs, write_geotiffs
+
+
+class _RowsFile:
+    """Stand-in for a rasterio file that records the written rows."""
+
+    def __init__(self, height, width, dtype):
+        self.image = np.zeros((height, width), dtype=dtype)
+
+    def write(self, d, band, window):
+        self.image[window.row_off:window.row_off + window.height] = d
+
+    def close(self):
+        pass
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.int32])
+def test_batch_writer_valid(tmpdir, dtype):
+    height, width = 9, 4
+    rnd = np.random.RandomState(2)
+    mask = rnd.rand(height, width) < 0.5
+    mask[3] = False
+    mask[-2:] = False
+    values = np.arange(1, mask.sum() + 1).astype(dtype)
+    with tables.open_file(str(tmpdir.join("valid.hdf5")), "w") as hfile:
+        valid = create_valid_mask(hfile, (height, width))
+        valid[:] = mask
+        f = _RowsFile(height, width, dtype)
+        writer = BatchWriter(f, width, height, dtype, valid)
+        for v in np.split(values, [2, 3, 3, 11]):
+            writer.write(v)
+        writer.close()
+    assert writer.rows_written == height
+    np.testing.assert_array_equal(f.image[mask], values)
+    nodata = np.finfo(dtype).min if dtype == np.float32 \
+        else np.iinfo(dtype).max
+    assert np.all(f.image[~mask] == nodata)
+
+
+def test_write_geotiffs_no_valid_pixels(tmpdir):
+    height, width = 3, 4
+    spec = ImageSpec(np.arange(width + 1, dtype=np.float64),
+                     np.arange(height + 1, dtype=np.float64),
+                     {"init": "epsg:4326"})
+    valid_path = str(tmpdir.join("valid.hdf5"))
+    with tables.open_file(valid_path, "w") as hfile:
+        create_valid_mask(hfile, (height, width))
+    outputs = target_outputs(
+        CategoricalTarget(10, np.array(["a", "b"]), np.array([2, 3]),
+                          [np.arange(2), np.arange(3)],
+                          [np.ones(2), np.ones(3)]))
+    write_geotiffs(iter([]), str(tmpdir), spec, "1of1", valid_path, outputs)
+    for k in ["predictions_a", "predictions_b"]:
+        with rs.open(str(tmpdir.join(k + "_1of1.tif"))) as f:
+            assert (f.height, f.width) == (height, width)
+            assert f.nodata == np.iinfo(np.int32).max
+            assert np.all(f.read(1) == f.nodata)